@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Interval binning of traffic_bins against the per-interval masks it replaced
+in lab1_part1sol.py. Views at the three scales of make_three_scaled_plots
+are taken from poisson*.data and from synthetic traces of growing size, and
+both versions are checked for equal output.
+
+  python3 bench_bins.py --sizes 125000 1000000 10000000 --count 100
+"""
+import argparse
+import time
+
+import numpy as np
+
+from lab1_part1sol import load_trace
+from traffic_bins import SortedTrace
+
+
+def bytes_in_intervals_ref(times_s, sizes_bytes, start_s, interval_s, count=100):
+    """The previous bytes_in_intervals."""
+    out = np.zeros(count, dtype=float)
+    for i in range(count):
+        a = start_s + i * interval_s
+        b = a + interval_s
+        mask = (times_s >= a) & (times_s < b)
+        out[i] = sizes_bytes[mask].sum()
+    return out
+
+
+def specs_for(times, count, rng):
+    """(start, interval, count) at 1 s, 100 ms and 10 ms, random starts."""
+    t_min, t_max = float(times.min()), float(times.max())
+    specs = [(0.0, 1.0, count)]
+    for interval in (0.1, 0.01):
+        latest = max(t_min, t_max - count * interval)
+        specs.append((float(rng.uniform(t_min, latest)), interval, count))
+    return specs
+
+
+def run(name, times, sizes, count, rng):
+    specs = specs_for(times, count, rng)
+
+    t0 = time.perf_counter()
+    ref = [bytes_in_intervals_ref(times, sizes, *spec) for spec in specs]
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    new = SortedTrace(times, sizes).views(specs)
+    t_new = time.perf_counter() - t0
+
+    same = all(np.array_equal(a, b) for a, b in zip(ref, new))
+    print(f"{name:>16} {len(times):>9} {t_ref:>11.4f} {t_new:>10.4f} "
+          f"{t_ref / t_new:>7.1f}x {str(same):>5}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Interval binning benchmark")
+    ap.add_argument("--sizes", type=int, nargs="+",
+                    default=[125_000, 1_000_000, 10_000_000])
+    ap.add_argument("--count", type=int, default=100,
+                    help="Intervals per scale")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(466)
+    print(f"{'trace':>16} {'packets':>9} {'before (s)':>11} {'after (s)':>10} "
+          f"{'speedup':>8} {'same':>5}")
+    for path in ("poisson1.data", "poisson2.data", "poisson3.data"):
+        df = load_trace(path)
+        run(path, df["time_s"].to_numpy(), df["size_bytes"].to_numpy(),
+            args.count, rng)
+    for n in args.sizes:
+        # Poisson arrivals at 1250 packets/s as in poisson3.data
+        times = np.cumsum(rng.exponential(1 / 1250, n))
+        sizes = rng.integers(1, 1500, n)
+        run("synthetic", times, sizes, args.count, rng)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Cold and warm loads of the binary trace cache against parsing the text
+trace with pd.read_csv, as the Lab1 scripts did. Cold is the first load,
+which converts the trace; warm memory-maps the cached columns and, to be
+fair to read_csv, reads every value once.
+
+The shipped traces are measured, then synthetic BC-pAug89-like traces of
+growing size in a temporary directory.
+
+  python3 bench_trace_cache.py --sizes 1000000 10000000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from trace_cache import cache_dir, load_columns
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - t0, out
+
+
+def read_text(path):
+    return pd.read_csv(path, sep=r"\s+", header=None)
+
+
+def read_cached(path):
+    columns = load_columns(path)
+    for col in columns:
+        if col.dtype.kind in "if":
+            col.sum()  # touch every page of the mapping
+    return columns
+
+
+def run(path):
+    shutil.rmtree(cache_dir(path), ignore_errors=True)
+    t_text, df = timed(read_text, path)
+    t_cold, _ = timed(read_cached, path)
+    t_warm, columns = timed(read_cached, path)
+    same = all(np.array_equal(df[i].to_numpy(), col) for i, col in enumerate(columns))
+    print(f"{os.path.basename(path):>18} {len(df):>10} {t_text:>9.3f} "
+          f"{t_cold:>9.3f} {t_warm:>9.4f} {t_text / t_warm:>8.0f}x {str(same):>5}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Trace cache benchmark")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1_000_000, 10_000_000],
+                    help="Rows of the synthetic traces")
+    args = ap.parse_args()
+
+    print(f"{'trace':>18} {'rows':>10} {'text (s)':>9} {'cold (s)':>9} "
+          f"{'warm (s)':>9} {'speedup':>9} {'same':>5}")
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        # copies, so the benchmark leaves no cache next to the shipped traces
+        for name in ("poisson1.data", "poisson2.data", "poisson3.data", "movietrace.data"):
+            shutil.copy(os.path.join(here, name), tmp)
+            run(os.path.join(tmp, name))
+
+        rng = np.random.default_rng(466)
+        for n in args.sizes:
+            path = os.path.join(tmp, f"eth_{n}.TL")
+            t = np.cumsum(rng.exponential(1e-3, n))
+            sizes = rng.integers(64, 1519, n)
+            with open(path, "w") as f:
+                f.writelines(f"{a:.6f}\t{b}\n" for a, b in zip(t, sizes))
+            run(path)
@@ -0,0 +1,169 @@
+"""
+Headless chart rendering, off the path of the analyses that make the charts.
+
+A Chart is a plain description of one PNG (bars and line series, labels,
+size, dpi) that can be pickled to another process. Line series are
+decimated when added: a series of more points than the image has pixel
+columns keeps only the first, last, smallest and largest point of each
+column, which draws the same picture from at most 4 points per column.
+
+Charts are drawn with the Agg backend on a matplotlib Figure that is not
+registered with pyplot, so nothing accumulates in pyplot's figure list;
+each process keeps one Figure and clears it for every chart. A Renderer
+queues charts to a pool of worker processes and returns at once, so the
+caller goes on with its analysis while earlier charts are drawn; with no
+workers it draws each chart when it is submitted. A ChartQueue only
+collects them, for a process that has no Renderer of its own.
+
+  with Renderer(workers=2) as renderer:
+      chart = Chart("cumbytes.png", xlabel="Time (s)", ylabel="Bytes")
+      chart.line(t, np.cumsum(sizes), label="Input")
+      renderer.submit(chart)
+"""
+import multiprocessing as mp
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+_figure = None  # the Figure of this process, reused by every chart
+
+
+def decimate(x: np.ndarray, y: np.ndarray, columns: int):
+    """
+    Points of the series (x, y), x in increasing order, that draw the same
+    line `columns` pixels wide: the first, last, min and max point of each
+    column's x range, in order. Shorter series are returned as they are.
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    n = len(x)
+    if n <= 4 * columns or x[-1] <= x[0]:
+        return x, y
+    edges = x[0] + (x[-1] - x[0]) * (np.arange(1, columns) / columns)
+    starts = np.unique(np.searchsorted(x, edges))  # first point of each column
+    starts = np.concatenate(([0], starts[(starts > 0) & (starts < n)]))
+    lengths = np.diff(np.append(starts, n))
+
+    def first_equal(extremes):
+        """Index of the first point of each column equal to its extreme."""
+        idx = np.flatnonzero(y == np.repeat(extremes, lengths))
+        column = np.searchsorted(starts, idx, side="right")
+        return idx[np.concatenate(([True], np.diff(column) > 0))]
+
+    keep = np.unique(np.concatenate((
+        starts, starts + lengths - 1,
+        first_equal(np.minimum.reduceat(y, starts)),
+        first_equal(np.maximum.reduceat(y, starts)))))
+    return x[keep], y[keep]
+
+
+class Chart:
+    """
+    One PNG: bar and line series on a single axes, written to `path`.
+    """
+
+    def __init__(self, path: str, xlabel: str = "", ylabel: str = "",
+                 title: str = "", size=(6.4, 4.8), dpi: int = 200):
+        """
+        :param size: (width, height) in inches
+        :param dpi: pixels per inch; width * dpi pixel columns for decimate
+        """
+        self.path = path
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.title = title
+        self.size = size
+        self.dpi = dpi
+        self.series = []  # (kind, x, y, label)
+
+    def columns(self) -> int:
+        return max(int(self.size[0] * self.dpi), 1)
+
+    def line(self, x, y, label: str | None = None):
+        """A line through (x, y), decimated to the width of the image."""
+        self.series.append(("line", *decimate(x, y, self.columns()), label))
+        return self
+
+    def bar(self, heights, label: str | None = None):
+        """One bar per value of `heights`, at 0, 1, 2, ..."""
+        heights = np.asarray(heights)
+        self.series.append(("bar", np.arange(len(heights)), heights, label))
+        return self
+
+    def draw(self, fig: Figure):
+        """Clear `fig` and draw the chart on it."""
+        fig.clear()
+        fig.set_size_inches(self.size)
+        ax = fig.add_subplot()
+        for kind, x, y, label in self.series:
+            if kind == "bar":
+                ax.bar(x, y, label=label)
+            else:
+                ax.plot(x, y, label=label)
+        ax.set_xlabel(self.xlabel)
+        ax.set_ylabel(self.ylabel)
+        if self.title:
+            ax.set_title(self.title)
+        if any(label for *_, label in self.series):
+            ax.legend()
+        fig.tight_layout()
+
+
+def render(chart: Chart) -> str:
+    """Draw `chart` on this process's Figure and save it; its path."""
+    global _figure
+    if _figure is None:
+        _figure = Figure()
+        FigureCanvasAgg(_figure)
+    chart.draw(_figure)
+    _figure.savefig(chart.path, dpi=chart.dpi)
+    _figure.clear()  # drop the artists, and the series they hold
+    return chart.path
+
+
+class ChartQueue(list):
+    """
+    Charts kept to be rendered elsewhere: takes the place of a Renderer in
+    a process that only collects charts, e.g. to return them from a pool.
+    """
+
+    def submit(self, chart: Chart):
+        self.append(chart)
+
+
+class Renderer:
+    """
+    Renders submitted charts in `workers` processes, in the background.
+    `close` (or leaving a with block) waits for every chart and returns
+    their paths, in submission order, raising the first rendering error.
+    """
+
+    def __init__(self, workers: int = 1):
+        self.pool = mp.Pool(workers) if workers > 0 else None
+        self.pending = []
+
+    def submit(self, chart: Chart):
+        if self.pool is None:
+            self.pending.append(render(chart))
+        else:
+            self.pending.append(self.pool.apply_async(render, (chart,)))
+
+    def close(self) -> list[str]:
+        pending, self.pending = self.pending, []
+        if self.pool is None:
+            return pending
+        try:
+            return [result.get() for result in pending]
+        finally:
+            self.pool.close()
+            self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
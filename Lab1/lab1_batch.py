@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Batch runner for the Lab1 analyses over many traces.
+
+A manifest lists one trace per line, with its format (a key of
+trace_stream.FORMATS) and the analyses to run on it, comma-separated or
+"all"; paths are relative to the manifest and '#' starts a comment:
+
+  # trace           format   analyses
+  poisson1.data     poisson  iat,bitrate,scaled
+  movietrace.data   video    all
+
+Analyses:
+
+  iat      mean and variance of the interarrival times
+  bitrate  mean bit rate, in Mbps
+  scaled   the three scaled views of lab1_part1sol (1 s, 100 ms and 10 ms
+           bins) or, for video, of lab1_part2sol (500, 50 and 5 frames)
+  frames   count and mean/min/max size of each frame type (video only)
+
+Traces are fanned out over a process pool, one task per trace, so each is
+loaded once (from its trace_cache) and shared by its analyses. Plots go to
+--plot-dir, named after the trace: the analyses only describe them (see
+chart_render.py) and --render-workers more processes draw them while the
+next traces are analysed. Every trace gets one row of the summary table,
+printed and written to --out. A trace that fails gets its error in the
+table instead, and the run exits with status 1.
+
+  python3 lab1_batch.py traces.manifest --workers 4 --out summary.tsv
+"""
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from chart_render import Chart, ChartQueue, Renderer
+from lab1_part1sol import (interarrival_stats, load_pyramid,
+                           make_three_scaled_plots, measured_bitrate_mbps,
+                           pick_random_start)
+from trace_cache import load_frame
+from trace_stream import FORMATS
+from traffic_bins import TrafficPyramid, cached_pyramid
+
+ANALYSES = ("iat", "bitrate", "scaled", "frames")
+FRAME_TYPES = ("I", "P", "B")
+FRAME_WINDOWS = (500, 50, 5)  # frames per window of the video scaled views
+
+
+def read_manifest(path: str) -> list[tuple[str, str, list[str]]]:
+    """(trace path, format, analyses) of each line of the manifest."""
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path) as f:
+        for lineno, line in enumerate(f, 1):
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) not in (2, 3):
+                raise ValueError(f"{path}:{lineno}: expected 'trace format "
+                                 f"[analyses]', got {line.strip()!r}")
+            trace, fmt = fields[:2]
+            if fmt not in FORMATS:
+                raise ValueError(f"{path}:{lineno}: unknown format {fmt!r}, "
+                                 f"expected one of {', '.join(sorted(FORMATS))}")
+            names = fields[2] if len(fields) == 3 else "all"
+            analyses = (list(ANALYSES) if names == "all"
+                        else names.split(","))
+            unknown = set(analyses) - set(ANALYSES)
+            if unknown:
+                raise ValueError(f"{path}:{lineno}: unknown analyses "
+                                 f"{', '.join(sorted(unknown))}")
+            if names == "all" and fmt != "video":
+                analyses.remove("frames")
+            elif "frames" in analyses and fmt != "video":
+                raise ValueError(f"{path}:{lineno}: frames needs a video trace")
+            entries.append((os.path.join(base, trace), fmt, analyses))
+    return entries
+
+
+def load_trace(path: str, fmt: str) -> pd.DataFrame:
+    """The trace with its FORMATS columns plus time_s and size_bytes."""
+    spec = FORMATS[fmt]
+    df = load_frame(path, names=spec["names"])
+    df["time_s"] = df[spec["time"]] * spec["scale"]
+    df["size_bytes"] = df[spec["size"]]
+    return df
+
+
+def make_frame_window_plots(df: pd.DataFrame, title_prefix: str,
+                            out_prefix: str, rng: np.random.Generator,
+                            pyramid: TrafficPyramid, renderer) -> list[str]:
+    """
+    Bytes per 500, 50 and 5 frames, as lab1_part2sol, the first view from
+    frame 0 and the others from random starts, one PNG each, submitted to
+    `renderer`.
+    """
+    n = len(df)
+    files = []
+    for k, window in enumerate(FRAME_WINDOWS, 1):
+        start = 0 if k == 1 else int(pick_random_start(rng, 0, n, 100 * window))
+        values = pyramid.bytes_in_windows(start, window, 100)
+        chart = Chart(
+            f"{out_prefix}_plot{k}_{window}frames.png",
+            f"Window index ({window} frames each)", "Bytes in window",
+            f"{title_prefix} — Scale: {window} frames (start = frame {start})")
+        renderer.submit(chart.bar(values))
+        files.append(chart.path)
+    return files
+
+
+def frame_stats(df: pd.DataFrame) -> dict:
+    """Count and mean/min/max size (bytes) of each frame type."""
+    out = {}
+    sizes = df.groupby("type")["size_bytes"]
+    for t in FRAME_TYPES:
+        s = sizes.get_group(t) if t in sizes.groups else pd.Series(dtype=float)
+        out[f"{t}_frames"] = len(s)
+        out[f"{t}_mean_B"] = float(s.mean()) if len(s) else np.nan
+        out[f"{t}_min_B"] = int(s.min()) if len(s) else np.nan
+        out[f"{t}_max_B"] = int(s.max()) if len(s) else np.nan
+    return out
+
+
+def run_trace(path: str, fmt: str, analyses: list[str], out_prefix: str,
+              seed: int, renderer) -> dict:
+    """
+    Load one trace and run its analyses; one row of the summary. Plots are
+    submitted to `renderer`, a chart_render.Renderer or ChartQueue.
+    """
+    df = load_trace(path, fmt)
+    t = df["time_s"].to_numpy()
+    row = {"packets": len(df), "bytes": int(df["size_bytes"].sum()),
+           "duration_s": float(t.max() - t.min()) if len(t) else 0.0}
+    if "iat" in analyses:
+        row["mean_iat_s"], row["var_iat_s2"] = interarrival_stats(df)
+    if "bitrate" in analyses:
+        row["bitrate_mbps"] = measured_bitrate_mbps(df)
+    if "frames" in analyses:
+        row.update(frame_stats(df))
+    if "scaled" in analyses:
+        rng = np.random.default_rng(seed)
+        title = os.path.basename(path)
+        if fmt == "video":
+            pyramid = cached_pyramid(path, lambda _: (
+                df.index.to_numpy(), df["size_bytes"].to_numpy()), base=1)
+            files = make_frame_window_plots(df, title, out_prefix, rng,
+                                            pyramid, renderer)
+        else:
+            files = make_three_scaled_plots(df, title, out_prefix, rng,
+                                            pyramid=load_pyramid(path, df),
+                                            renderer=renderer)
+        row["plots"] = ",".join(os.path.basename(f) for f in files)
+    return row
+
+
+def format_column(col: pd.Series) -> pd.Series:
+    """A summary column as text: floats to 6 digits, blanks for gaps."""
+    if pd.api.types.is_float_dtype(col):
+        text = col.map(lambda v: f"{v:.6g}")
+    else:
+        text = col.astype(object).map(str)
+    return text.where(col.notna(), "")
+
+
+def _run_task(task):
+    """
+    run_trace in a worker: (row number, summary row, error, seconds, charts),
+    the charts left for the main process to render.
+    """
+    i, (path, fmt, analyses), out_prefix, seed = task
+    started = time.perf_counter()
+    charts = ChartQueue()
+    try:
+        row, error = run_trace(path, fmt, analyses, out_prefix, seed,
+                               charts), ""
+    except Exception as e:
+        row, error = {}, f"{type(e).__name__}: {e}"
+    return i, row, error, time.perf_counter() - started, charts
+
+
+def run_batch(entries, plot_dir: str, workers: int, seed: int = 466,
+              progress=print, render_workers: int = 1) -> pd.DataFrame:
+    """
+    Run the manifest `entries` over `workers` processes; the summary table,
+    one row per entry in manifest order. The plots are drawn by another
+    `render_workers` processes as the analyses finish.
+    """
+    os.makedirs(plot_dir, exist_ok=True)
+    stems = [os.path.splitext(os.path.basename(path))[0] for path, *_ in entries]
+    tasks = [(i, entry, os.path.join(
+                plot_dir, stem if stems.count(stem) == 1 else f"{stem}_{i}"),
+              seed) for i, (entry, stem) in enumerate(zip(entries, stems))]
+    rows = [None] * len(tasks)
+    with Renderer(render_workers) as renderer, \
+            mp.Pool(max(1, min(workers, len(tasks)))) as pool:
+        for done, (i, row, error, seconds, charts) in enumerate(
+                pool.imap_unordered(_run_task, tasks), 1):
+            for chart in charts:
+                renderer.submit(chart)
+            path, fmt, analyses = entries[i]
+            rows[i] = {"trace": path, "format": fmt,
+                       "analyses": ",".join(analyses), **row, "error": error}
+            progress(f"[{done}/{len(tasks)}] {os.path.basename(path)}: "
+                     f"{error or 'done'} ({seconds:.1f} s)")
+    summary = pd.DataFrame(rows)
+    for c in summary:
+        # nullable ints keep counts whole when a failed trace leaves gaps
+        if c in ("packets", "bytes") or c.endswith(("_frames", "_min_B", "_max_B")):
+            summary[c] = summary[c].astype("Int64")
+    last = [c for c in ("plots", "error") if c in summary]
+    return summary[[c for c in summary if c not in last] + last]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Lab1 analyses over many traces")
+    ap.add_argument("manifest", help="Traces, formats and analyses to run")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(),
+                    help="Processes the traces are spread over")
+    ap.add_argument("--render-workers", type=int, default=1,
+                    help="Processes the plots are drawn in (0: in the main "
+                         "process)")
+    ap.add_argument("--plot-dir", default="batch_outputs",
+                    help="Directory the plots are written to")
+    ap.add_argument("--out", default="batch_summary.tsv",
+                    help="Summary table, tab-separated")
+    ap.add_argument("--seed", type=int, default=466,
+                    help="Seed of the random view starts of every trace")
+    args = ap.parse_args()
+
+    try:
+        entries = read_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        ap.error(str(e))
+    if not entries:
+        ap.error(f"no traces in {args.manifest}")
+
+    started = time.perf_counter()
+    summary = run_batch(entries, args.plot_dir, args.workers, args.seed,
+                        render_workers=args.render_workers)
+    summary.to_csv(args.out, sep="\t", index=False)
+
+    shown = summary.assign(trace=summary["trace"].map(os.path.basename))
+    shown = shown.drop(columns=["analyses", "plots"], errors="ignore")
+    print(shown.apply(format_column).to_string(index=False))
+    failed = int((summary["error"] != "").sum())
+    print(f"{len(summary)} traces in {time.perf_counter() - started:.1f} s "
+          f"with {args.workers} workers, {failed} failed; summary in "
+          f"{args.out}, plots in {args.plot_dir}/")
+    if failed:
+        raise SystemExit(1)
@@ -2,10 +2,17 @@
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+
+from chart_render import Chart, Renderer, render
+from trace_cache import load_frame
+from traffic_bins import SortedTrace, TrafficPyramid, cached_pyramid
+
+# Finest bin of the cached traffic pyramids, in seconds
+PYRAMID_BASE_S = 1e-3
+
 
 def load_trace(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path, sep=r"\s+", header=None, names=["pkt", "time_us", "size_bytes"])
+    df = load_frame(path, names=["pkt", "time_us", "size_bytes"])
     df["time_s"] = df["time_us"] * 1e-6
     return df
 
@@ -25,13 +32,7 @@ def measured_bitrate_mbps(df: pd.DataFrame) -> float:
 
 
 def bytes_in_intervals(times_s: np.ndarray, sizes_bytes: np.ndarray, start_s: float, interval_s: float,count: int = 100) -> np.ndarray:
-    out = np.zeros(count, dtype=float)
-    for i in range(count):
-        a = start_s + i * interval_s
-        b = a + interval_s
-        mask = (times_s >= a) & (times_s < b)
-        out[i] = sizes_bytes[mask].sum()
-    return out
+    return SortedTrace(times_s, sizes_bytes).bytes_in_intervals(start_s, interval_s, count)
 
 
 def pick_random_start(rng: np.random.Generator, t_min: float, t_max: float, needed: float) -> float:
@@ -41,7 +42,12 @@ def pick_random_start(rng: np.random.Generator, t_min: float, t_max: float, need
     return float(rng.uniform(t_min, latest_start))
 
 
-def make_three_scaled_plots(df: pd.DataFrame, title_prefix: str, out_prefix: str, rng: np.random.Generator):
+def load_pyramid(path: str, df: pd.DataFrame) -> TrafficPyramid:
+    return cached_pyramid(path, lambda _: (df["time_s"].to_numpy(), df["size_bytes"].to_numpy()), PYRAMID_BASE_S)
+
+
+def make_three_scaled_plots(df: pd.DataFrame, title_prefix: str, out_prefix: str, rng: np.random.Generator,
+                            pyramid: TrafficPyramid | None = None, renderer: Renderer | None = None) -> list[str]:
     times = df["time_s"].to_numpy()
     sizes = df["size_bytes"].to_numpy()
 
@@ -50,41 +56,41 @@ def make_three_scaled_plots(df: pd.DataFrame, title_prefix: str, out_prefix: str
 
     start1 = 0.0
     interval1 = 1.0
-    v1 = bytes_in_intervals(times, sizes, start1, interval1, 100)
-
-    plt.figure()
-    plt.bar(np.arange(100), v1)
-    plt.xlabel("Interval index (1 s each)")
-    plt.ylabel("Bytes in interval")
-    plt.title(f"{title_prefix} — Scale: 1 s bins (start = {start1:.3f} s)")
-    plt.tight_layout()
-    plt.savefig(f"{out_prefix}_plot1_1s.png", dpi=200)
 
     interval2 = 0.1
     needed2 = 100 * interval2
     start2 = pick_random_start(rng, t_min, t_max, needed2)
-    v2 = bytes_in_intervals(times, sizes, start2, interval2, 100)
-
-    plt.figure()
-    plt.bar(np.arange(100), v2)
-    plt.xlabel("Interval index (100 ms each)")
-    plt.ylabel("Bytes in interval")
-    plt.title(f"{title_prefix} — Scale: 100 ms bins (start = {start2:.3f} s)")
-    plt.tight_layout()
-    plt.savefig(f"{out_prefix}_plot2_100ms.png", dpi=200)
 
     interval3 = 0.01
     needed3 = 100 * interval3
     start3 = pick_random_start(rng, t_min, t_max, needed3)
-    v3 = bytes_in_intervals(times, sizes, start3, interval3, 100)
 
-    plt.figure()
-    plt.bar(np.arange(100), v3)
-    plt.xlabel("Interval index (10 ms each)")
-    plt.ylabel("Bytes in interval")
-    plt.title(f"{title_prefix} — Scale: 10 ms bins (start = {start3:.3f} s)")
-    plt.tight_layout()
-    plt.savefig(f"{out_prefix}_plot3_10ms.png", dpi=200)
+    if pyramid is not None:
+        # the pyramid answers views that start on its bin edges
+        start2, start3 = pyramid.snap(start2), pyramid.snap(start3)
+
+    specs = [(start1, interval1, 100), (start2, interval2, 100), (start3, interval3, 100)]
+    if pyramid is not None:
+        v1, v2, v3 = (pyramid.bytes_in_windows(*spec).astype(float) for spec in specs)
+    else:
+        # all three scales from one sorted copy of the trace
+        v1, v2, v3 = SortedTrace(times, sizes).views(specs)
+
+    charts = [
+        Chart(f"{out_prefix}_plot1_1s.png", "Interval index (1 s each)", "Bytes in interval",
+              f"{title_prefix} — Scale: 1 s bins (start = {start1:.3f} s)").bar(v1),
+        Chart(f"{out_prefix}_plot2_100ms.png", "Interval index (100 ms each)", "Bytes in interval",
+              f"{title_prefix} — Scale: 100 ms bins (start = {start2:.3f} s)").bar(v2),
+        Chart(f"{out_prefix}_plot3_10ms.png", "Interval index (10 ms each)", "Bytes in interval",
+              f"{title_prefix} — Scale: 10 ms bins (start = {start3:.3f} s)").bar(v3),
+    ]
+    for chart in charts:
+        # queued to the renderer if there is one, else drawn here
+        if renderer is not None:
+            renderer.submit(chart)
+        else:
+            render(chart)
+    return [chart.path for chart in charts]
 
 
 def print_step1_summary(ex_name: str, df: pd.DataFrame, lam_theory: float):
@@ -108,7 +114,7 @@ def print_step1_summary(ex_name: str, df: pd.DataFrame, lam_theory: float):
     print("=" * 70)
 
 
-def exercise_1a():
+def exercise_1a(renderer: Renderer | None = None):
     pkt_size_bytes = 100.0
     target_rate_mbps = 1.0
     target_rate_Bps = (target_rate_mbps * 1e6) / 8.0  # bytes per second
@@ -123,11 +129,13 @@ def exercise_1a():
         df=df1,
         title_prefix="Exercise 1-a (poisson1.data, 100B packets)",
         out_prefix="ex1a",
-        rng=rng
+        rng=rng,
+        pyramid=load_pyramid("poisson1.data", df1),
+        renderer=renderer
     )
 
 
-def exercise_1b():
+def exercise_1b(renderer: Renderer | None = None):
     lam = 1250.0  # packets per second
 
     df3 = load_trace("poisson3.data")
@@ -137,15 +145,17 @@ def exercise_1b():
         df=df3,
         title_prefix="Exercise 1-b (poisson3.data, variable packet sizes)",
         out_prefix="ex1b",
-        rng=rng
+        rng=rng,
+        pyramid=load_pyramid("poisson3.data", df3),
+        renderer=renderer
     )
 
 
 if __name__ == "__main__":
-    exercise_1a()
-    exercise_1b()
-
-    plt.show()
+    # 1-a's plots are drawn in the background while 1-b is analysed
+    with Renderer(workers=1) as renderer:
+        exercise_1a(renderer)
+        exercise_1b(renderer)
 
     print("\nSaved plot files:")
     print("  ex1a_plot1_1s.png, ex1a_plot2_100ms.png, ex1a_plot3_10ms.png")
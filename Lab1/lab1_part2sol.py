@@ -11,6 +11,9 @@ import random
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from trace_cache import load_frame
+from traffic_bins import TrafficPyramid, cached_pyramid
+
 # Parameters
 file_name = "movietrace.data"   # the name of the table file to read
 initial_frame = 0              # the first frame to use (transmit sequence index)
@@ -29,11 +32,9 @@ RANDOM_SEED = 466
 size_unit = "MB"
 size_unit_multiplier = 1e6  # in bytes
 
-# Read video trace
-df = pd.read_csv(
+# Read video trace (parsed once, then memory-mapped from movietrace.data.cache/)
+df = load_frame(
     file_name,    # file to load
-    sep=r"\s+",   # each column is space-separated
-    header=None,  # the file contains no header
     names=[
         "display_idx",  # frame display index
         "time_ms",      # timestamp, in milliseconds
@@ -55,19 +56,15 @@ p_frame_sizes = df[df["type"] == "P"]["size_B"]
 # - Use hist() for distributions (if you later add a histogram part)
 ###########################################################################
 
-def aggregate_bytes_per_slot(series_B: pd.Series, start: int, window: int, n_windows: int) -> pd.Series:
+def aggregate_bytes_per_slot(pyramid: TrafficPyramid, start: int, window: int, n_windows: int) -> pd.Series:
     """
     Group bytes into contiguous frame windows:
       slot k contains frames [start + k*window, start + (k+1)*window)
     Returns a length-(n_windows+1) Series with missing slots filled to 0,
     matching the style of the provided skeleton (groupby + reindex).
+    `pyramid` holds the bytes per frame at 1, 10, 100 and 1000 frames.
     """
-    idx = series_B.index
-    s = series_B.loc[idx >= start]  # keep only frames at/after start
-    slot = ((s.index - start) // window).astype(int)
-    bytes_per_slot = s.groupby(slot).sum()
-    bytes_per_slot = bytes_per_slot.reindex(range(n_windows + 1), fill_value=0)
-    return bytes_per_slot
+    return pd.Series(pyramid.bytes_in_windows(start, window, n_windows + 1))
 
 
 # Make 3 vertically aligned plots (Plot 1, Plot 2, Plot 3)
@@ -77,6 +74,9 @@ fig, axes = plt.subplots(3, 1, figsize=(10, 8), sharex=False)
 # Use ALL frames for scaled traffic aggregation (recommended)
 all_sizes = df["size_B"]
 
+# Bytes per frame window, cached next to the trace (base bin: 1 frame)
+pyramid = cached_pyramid(file_name, lambda _: (all_sizes.index.to_numpy(), all_sizes.to_numpy()), base=1)
+
 # Pick random starts for W2 and W3 so that 100 windows fit (like your solution)
 random.seed(RANDOM_SEED)
 N = len(all_sizes)
@@ -96,7 +96,7 @@ start3 = random.randint(0, max_start3) if max_start3 > 0 else 0
 # -------------------------
 # Plot 1: bytes per 500 frames, starting at Frame 1
 # -------------------------
-bytes1 = aggregate_bytes_per_slot(all_sizes, start=start1, window=W1, n_windows=num_windows)
+bytes1 = aggregate_bytes_per_slot(pyramid, start=start1, window=W1, n_windows=num_windows)
 frames1 = bytes1.index * W1 + start1
 ax1.fill_between(frames1, (bytes1.values / size_unit_multiplier), step="post")
 ax1.set_title(f"Scaled video traffic: bytes per {W1} frames (starting at Frame {start1 + 1})")
@@ -107,7 +107,7 @@ ax1.grid(True, linewidth=0.3, alpha=0.6)
 # -------------------------
 # Plot 2: bytes per 50 frames, random start (your content goes here)
 # -------------------------
-bytes2 = aggregate_bytes_per_slot(all_sizes, start=start2, window=W2, n_windows=num_windows)
+bytes2 = aggregate_bytes_per_slot(pyramid, start=start2, window=W2, n_windows=num_windows)
 frames2 = bytes2.index * W2 + start2
 ax2.fill_between(frames2, (bytes2.values / size_unit_multiplier), step="post")
 ax2.set_title(f"Scaled video traffic: bytes per {W2} frames (random start at Frame {start2 + 1})")
@@ -118,7 +118,7 @@ ax2.grid(True, linewidth=0.3, alpha=0.6)
 # -------------------------
 # Plot 3: bytes per 5 frames, random start (your content goes here)
 # -------------------------
-bytes3 = aggregate_bytes_per_slot(all_sizes, start=start3, window=W3, n_windows=num_windows)
+bytes3 = aggregate_bytes_per_slot(pyramid, start=start3, window=W3, n_windows=num_windows)
 frames3 = bytes3.index * W3 + start3
 ax3.fill_between(frames3, (bytes3.values / size_unit_multiplier), step="post")
 ax3.set_title(f"Scaled video traffic: bytes per {W3} frames (random start at Frame {start3 + 1})")
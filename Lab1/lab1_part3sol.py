@@ -12,6 +12,9 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from trace_cache import load_columns
+from traffic_bins import TrafficPyramid, cached_pyramid
+
 # ============================================================
 # Parameters
 # ============================================================
@@ -32,48 +35,41 @@ time_unit = "s"
 size_unit = "kB"
 size_unit_multiplier = 1e3  # in bytes
 
+# Finest bin of the cached traffic pyramid; random starts snap to it
+PYRAMID_BASE_S = 1e-3
+
 
 # ============================================================
 # Helper: aggregate bytes in time windows (template-style)
 # ============================================================
-def bytes_per_time_slot(df_in: pd.DataFrame, start_s: float, window_s: float, n_windows: int) -> pd.Series:
+def bytes_per_time_slot(pyramid: TrafficPyramid, start_s: float, window_s: float, n_windows: int) -> pd.Series:
     """
     Group bytes into contiguous time windows:
       slot k contains packets with times in [start_s + k*window_s, start_s + (k+1)*window_s)
 
     Returns a length-(n_windows+1) Series (like the lab skeleton) with empty slots filled to 0.
-    Values are returned in BYTES (not scaled).
+    Values are returned in BYTES (not scaled). start_s and window_s must be
+    multiples of PYRAMID_BASE_S.
     """
-    df = df_in.copy()
-
-    # Keep only the time range we need (faster + ensures slot indices are in range)
-    end_s = start_s + n_windows * window_s
-    df = df[(df["time_s"] >= start_s) & (df["time_s"] < end_s)]
-
-    # Assign each packet to a slot number
-    slots = ((df["time_s"] - start_s) / window_s).astype(int)
+    bytes_slot = pd.Series(pyramid.bytes_in_windows(start_s, window_s, n_windows))
 
-    # Sum bytes per slot
-    bytes_slot = df["size_B"].groupby(slots).sum()
-
-    # Fill missing slots with 0 and force fixed length
+    # Force fixed length, the last slot is past the plotted range
     bytes_slot = bytes_slot.reindex(range(n_windows + 1), fill_value=0)
 
     return bytes_slot
 
 
+def load_packets(path: str):
+    """(times, sizes) of a trace, only read when the pyramid is rebuilt."""
+    time_s, size_B = load_columns(path)
+    return time_s, size_B
+
+
 # ============================================================
 # Main
 # ============================================================
-df = pd.read_csv(
-    file_name,
-    sep=r"\s+",
-    header=None,
-    names=["time_s", "size_B"],
-)
-
-# Ensure time is sorted (some traces may already be sorted, but this is safe)
-df = df.sort_values("time_s").reset_index(drop=True)
+# Bytes per 1 ms, 10 ms, 100 ms and 1 s bin, cached next to the trace
+pyramid = cached_pyramid(file_name, load_packets, base=PYRAMID_BASE_S)
 
 rng = np.random.default_rng(RNG_SEED)
 
@@ -84,7 +80,7 @@ fig, axes = plt.subplots(3, 1, figsize=(10, 8), sharex=False)
 # Plot 1 (given in skeleton idea): 1s bins from t=0
 # ------------------------------------------------------------
 initial_time_s = 0.0
-bytes1 = bytes_per_time_slot(df, start_s=initial_time_s, window_s=W1, n_windows=N_POINTS)
+bytes1 = bytes_per_time_slot(pyramid, start_s=initial_time_s, window_s=W1, n_windows=N_POINTS)
 times1 = bytes1.index * W1 + initial_time_s
 
 ax1.fill_between(times1, (bytes1.values / size_unit_multiplier), step="post")
@@ -97,14 +93,15 @@ ax1.grid(True, linewidth=0.3, alpha=0.6)
 # ------------------------------------------------------------
 # Plot 2: 100ms bins, random start (your content)
 # ------------------------------------------------------------
-t_min = float(df["time_s"].iloc[0])
-t_max = float(df["time_s"].iloc[-1])
+t_min = pyramid.t_min
+t_max = pyramid.t_max
 
 needed2 = N_POINTS * W2
 latest_start2 = max(t_min, t_max - needed2)
 start2 = float(rng.uniform(t_min, latest_start2)) if latest_start2 > t_min else t_min
+start2 = pyramid.snap(start2)
 
-bytes2 = bytes_per_time_slot(df, start_s=start2, window_s=W2, n_windows=N_POINTS)
+bytes2 = bytes_per_time_slot(pyramid, start_s=start2, window_s=W2, n_windows=N_POINTS)
 times2 = bytes2.index * W2 + start2
 
 ax2.fill_between(times2, (bytes2.values / size_unit_multiplier), step="post")
@@ -120,8 +117,9 @@ ax2.grid(True, linewidth=0.3, alpha=0.6)
 needed3 = N_POINTS * W3
 latest_start3 = max(t_min, t_max - needed3)
 start3 = float(rng.uniform(t_min, latest_start3)) if latest_start3 > t_min else t_min
+start3 = pyramid.snap(start3)
 
-bytes3 = bytes_per_time_slot(df, start_s=start3, window_s=W3, n_windows=N_POINTS)
+bytes3 = bytes_per_time_slot(pyramid, start_s=start3, window_s=W3, n_windows=N_POINTS)
 times3 = bytes3.index * W3 + start3
 
 ax3.fill_between(times3, (bytes3.values / size_unit_multiplier), step="post")
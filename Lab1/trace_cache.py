@@ -0,0 +1,222 @@
+"""
+Binary cache of whitespace-separated text traces.
+
+The first load of a trace parses it in chunks and writes each column as a
+raw typed array to `<trace>.cache/`, with a meta.json describing it and
+the size and mtime of the text file it came from. Later loads only check
+that key and memory-map the columns, so nothing is parsed again until the
+trace changes.
+
+A trace whose cache cannot be written (e.g. in a read-only directory) is
+parsed in memory instead, into the same arrays, every time it is loaded.
+
+Numbers are parsed exactly like Python's float()/int(); text columns (e.g.
+the I/P/B frame type) are stored as codes into a list of categories. '#'
+starts a comment. Ragged files raise ValueError (or a pandas ParserError).
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+CHUNK_ROWS = 1_000_000
+
+
+def cache_dir(path: str) -> str:
+    return path + ".cache"
+
+
+def source_key(path: str) -> dict:
+    """What a cache must have been built from to be valid for `path`."""
+    st = os.stat(path)
+    return {"version": CACHE_VERSION, "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns}
+
+
+def read_meta(path: str):
+    """meta.json of the cache of `path`, or None if missing or stale."""
+    try:
+        with open(os.path.join(cache_dir(path), "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("source") == source_key(path) else None
+
+
+class _Widened(Exception):
+    """A chunk needs wider column types than the chunks before it."""
+
+    def __init__(self, dtypes):
+        self.dtypes = dtypes
+
+
+def convert(path: str, chunk_rows: int = CHUNK_ROWS) -> dict:
+    """
+    Parse the text trace at `path` into its cache and return the metadata.
+    Memory use is bounded by `chunk_rows`, whatever the size of the trace.
+    """
+    key = source_key(path)
+    tmp = f"{cache_dir(path)}.tmp{os.getpid()}"
+    forced = {}  # column -> dtype, set when a later chunk widened the column
+    while True:
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            columns, rows = write_columns(path, tmp, forced, chunk_rows)
+            break
+        except _Widened as e:
+            forced.update(e.dtypes)  # parse again with the wider types
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+    meta = {"source": key, "rows": rows, "columns": columns}
+    old = f"{cache_dir(path)}.old{os.getpid()}"
+    try:
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        # swap the finished cache in, so readers never see a partial one
+        if os.path.exists(cache_dir(path)):
+            os.replace(cache_dir(path), old)
+        os.replace(tmp, cache_dir(path))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    shutil.rmtree(old, ignore_errors=True)
+    return meta
+
+
+def encoded_chunks(path, forced, chunk_rows):
+    """
+    Yield the encoded arrays of each chunk of `chunk_rows` rows, one per
+    column, and the column specs updated with them.
+    """
+    reader = pd.read_csv(path, sep=r"\s+", header=None, comment="#",
+                         float_precision="round_trip", dtype=forced or None,
+                         chunksize=chunk_rows)
+    columns = None
+    with reader:
+        for chunk in reader:
+            if columns is None:
+                columns = [None] * chunk.shape[1]
+            arrays = []
+            for i, (_, col) in enumerate(chunk.items()):
+                arr, columns[i] = encode(col, columns[i], i)
+                arrays.append(arr)
+            yield arrays, columns
+
+
+def write_columns(path, out_dir, forced, chunk_rows):
+    """Append each column of each chunk to out_dir/c<i>.bin."""
+    files, columns, rows = [], [], 0
+    try:
+        for arrays, columns in encoded_chunks(path, forced, chunk_rows):
+            if not files:
+                for i in range(len(arrays)):
+                    files.append(open(os.path.join(out_dir, f"c{i}.bin"), "wb"))
+            for f, arr in zip(files, arrays):
+                f.write(arr.tobytes())
+            rows += len(arrays[0])
+    finally:
+        for f in files:
+            f.close()
+    return columns, rows
+
+
+def read_columns(path: str, chunk_rows: int = CHUNK_ROWS):
+    """
+    Parse the text trace at `path` in memory, as convert would, and return
+    the metadata and the arrays of every column.
+    """
+    forced = {}
+    while True:
+        try:
+            parts, columns = [], []
+            for arrays, columns in encoded_chunks(path, forced, chunk_rows):
+                parts.append(arrays)
+            break
+        except _Widened as e:
+            forced.update(e.dtypes)
+    arrays = [np.concatenate(chunks) for chunks in zip(*parts)]
+    rows = len(arrays[0]) if arrays else 0
+    return {"rows": rows, "columns": columns}, arrays
+
+
+def encode(col: pd.Series, spec, i):
+    """
+    The array to store for one chunk of column `i`, and the column's spec
+    ({"dtype": ..., "categories": [...]} for text) updated with it.
+    """
+    if not pd.api.types.is_numeric_dtype(col.dtype):
+        col = col.fillna("").astype(object)  # text missing from a short line
+        if spec is not None and "categories" not in spec:
+            raise _Widened({i: str})
+        categories = spec["categories"] if spec else []
+        index = {c: k for k, c in enumerate(categories)}
+        for value in col.unique():
+            if value not in index:
+                index[value] = len(categories)
+                categories.append(value)
+        dtype = "<i4"
+        return (col.map(index).to_numpy(dtype=dtype),
+                {"dtype": dtype, "categories": categories})
+    dtype = np.dtype(col.dtype).newbyteorder("<").str
+    if spec is not None:
+        if "categories" in spec:
+            raise _Widened({i: str})
+        wide = np.promote_types(spec["dtype"], dtype)
+        if wide.newbyteorder("<").str != spec["dtype"]:
+            raise _Widened({i: wide})
+        dtype = spec["dtype"]  # e.g. whole numbers in a float column
+    return col.to_numpy(dtype=dtype), {"dtype": dtype}
+
+
+def load_columns(path: str, usecols=None) -> list[np.ndarray]:
+    """
+    Every column of the trace at `path`, or those numbered in `usecols`,
+    memory-mapped from its cache (converted first if there is none or the
+    trace changed). Text columns are returned as arrays of str.
+    """
+    meta, arrays = read_meta(path), None
+    if meta is None:
+        try:
+            meta = convert(path)
+        except OSError:  # no cache can be written, or the trace is missing
+            meta, arrays = read_columns(path)
+    specs = meta["columns"]
+    if usecols is None:
+        usecols = range(len(specs))
+    elif any(not 0 <= i < len(specs) for i in usecols):
+        raise ValueError(f"{path} has {len(specs)} columns, "
+                         f"asked for {list(usecols)}")
+    out = []
+    for i in usecols:
+        spec = specs[i]
+        dtype = np.dtype(spec["dtype"])
+        if arrays is not None:
+            arr = arrays[i]
+        elif meta["rows"] == 0:
+            arr = np.zeros(0, dtype=dtype)  # memmap cannot map zero bytes
+        else:
+            arr = np.memmap(os.path.join(cache_dir(path), f"c{i}.bin"),
+                            dtype=dtype, mode="r", shape=(meta["rows"],))
+        if "categories" in spec:
+            arr = np.array(spec["categories"], dtype=str)[arr]
+        out.append(arr)
+    return out
+
+
+def load_frame(path: str, names=None) -> pd.DataFrame:
+    """
+    The trace at `path` as a DataFrame with columns `names`, equal to
+    pd.read_csv(path, sep=r"\\s+", header=None, names=names) but read from
+    the cache.
+    """
+    columns = load_columns(path)
+    names = list(names) if names is not None else list(range(len(columns)))
+    if len(names) != len(columns):
+        raise ValueError(f"{path} has {len(columns)} columns, "
+                         f"got {len(names)} names")
+    return pd.DataFrame(dict(zip(names, columns)))
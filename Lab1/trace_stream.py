@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Streaming statistics of Lab1 traces, read in fixed-size chunks so that
+memory stays bounded however large the trace is. Chunks are slices of the
+memory-mapped columns of trace_cache, which converts the text trace in
+chunks too.
+
+Each aggregator is fed the (times, sizes, index) of one chunk at a time,
+in file order, and gives the same result as the in-memory path of
+lab1_part1sol.py over the whole trace:
+
+  InterarrivalStats  mean and variance of the interarrival times
+  Bitrate            mean bit rate between the first and last packet
+  SlotBytes          bytes per interval, as bytes_in_intervals
+
+  python3 trace_stream.py poisson1.data --format poisson --check
+  python3 trace_stream.py movietrace.data --format video --slot-by index \\
+      --start 0 --interval 500 --count 100 --check
+"""
+import argparse
+
+import numpy as np
+
+from trace_cache import load_columns, load_frame
+from traffic_bins import SortedTrace
+
+# Column layout of each trace format: the column names, the time column and
+# the factor that converts it to seconds, and the size column in bytes
+FORMATS = {
+    "poisson": dict(names=["pkt", "time_us", "size_bytes"],
+                    time="time_us", scale=1e-6, size="size_bytes"),
+    "video": dict(names=["display_idx", "time_ms", "type", "size_B",
+                         "unused1", "unused2", "unused3"],
+                  time="time_ms", scale=1e-3, size="size_B"),
+    "eth": dict(names=["time_s", "size_B"],
+                time="time_s", scale=1.0, size="size_B"),
+}
+
+
+def iter_chunks(path: str, fmt: str, chunksize: int = 1_000_000):
+    """
+    Yield (times_s, sizes_bytes, index) of each chunk of `chunksize` rows,
+    where `index` is the row number of each packet in the file.
+    """
+    spec = FORMATS[fmt]
+    # only the numeric columns, so no text column is decoded in full
+    usecols = [spec["names"].index(spec["time"]),
+               spec["names"].index(spec["size"])]
+    times, sizes = load_columns(path, usecols=usecols)
+    for a in range(0, len(times), chunksize):
+        b = min(a + chunksize, len(times))
+        yield times[a:b] * spec["scale"], np.asarray(sizes[a:b]), np.arange(a, b)
+
+
+class InterarrivalStats:
+    """
+    Mean and population variance of the interarrival times, with Welford's
+    update generalised to whole chunks (Chan et al.): each chunk's mean and
+    sum of squared deviations are merged into the running ones.
+    """
+
+    def __init__(self):
+        self.last = None  # time of the last packet seen
+        self.n = 0        # interarrival times seen
+        self.mean = 0.0
+        self.m2 = 0.0     # sum of squared deviations from the mean
+
+    def update(self, times: np.ndarray, sizes: np.ndarray, index: np.ndarray):
+        if not len(times):
+            return
+        if self.last is None:
+            iat = np.diff(times)
+        else:
+            iat = np.diff(times, prepend=self.last)
+        self.last = times[-1]
+        if not len(iat):
+            return
+        n_b = len(iat)
+        mean_b = iat.mean()
+        m2_b = float(((iat - mean_b) ** 2).sum())
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * self.n * n_b / n
+        self.n = n
+
+    def result(self) -> tuple[float, float]:
+        """(mean, variance) in seconds and seconds squared."""
+        return float(self.mean), float(self.m2 / self.n) if self.n else 0.0
+
+
+class Bitrate:
+    """Mean bit rate from the first to the last packet, in file order."""
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.total_bytes = 0
+
+    def update(self, times: np.ndarray, sizes: np.ndarray, index: np.ndarray):
+        if not len(times):
+            return
+        if self.first is None:
+            self.first = float(times[0])
+        self.last = float(times[-1])
+        self.total_bytes += int(sizes.sum())
+
+    def result(self) -> float:
+        """Mean bit rate in Mbps."""
+        return (self.total_bytes * 8 / (self.last - self.first)) / 1e6
+
+
+class SlotBytes:
+    """
+    Bytes in [start + i*interval, start + i*interval + interval) for i in
+    range(count), over packet times or, with by_index, over row numbers.
+    Chunks may be in any time order.
+    """
+
+    def __init__(self, start: float, interval: float, count: int = 100,
+                 by_index: bool = False):
+        self.start = start
+        self.interval = interval
+        self.count = count
+        self.by_index = by_index
+        self.out = np.zeros(count, dtype=float)
+
+    def update(self, times: np.ndarray, sizes: np.ndarray, index: np.ndarray):
+        keys = index if self.by_index else times
+        self.out += SortedTrace(keys, sizes).bytes_in_intervals(
+            self.start, self.interval, self.count)
+
+    def result(self) -> np.ndarray:
+        return self.out
+
+
+def stream_trace(path: str, fmt: str, aggregators, chunksize: int = 1_000_000):
+    """Feed every chunk of the trace at `path` to each aggregator."""
+    for chunk in iter_chunks(path, fmt, chunksize):
+        for agg in aggregators:
+            agg.update(*chunk)
+    return [agg.result() for agg in aggregators]
+
+
+def in_memory(path: str, fmt: str, start: float, interval: float, count: int,
+              by_index: bool):
+    """The same statistics from the whole trace loaded at once."""
+    from lab1_part1sol import bytes_in_intervals, interarrival_stats, measured_bitrate_mbps
+    spec = FORMATS[fmt]
+    df = load_frame(path, names=spec["names"])
+    df["time_s"] = df[spec["time"]] * spec["scale"]
+    df["size_bytes"] = df[spec["size"]]
+    keys = df.index.to_numpy() if by_index else df["time_s"].to_numpy()
+    return [interarrival_stats(df), measured_bitrate_mbps(df),
+            bytes_in_intervals(keys, df["size_bytes"].to_numpy(), start,
+                               interval, count)]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Streaming trace statistics")
+    ap.add_argument("trace")
+    ap.add_argument("--format", choices=sorted(FORMATS), default="poisson")
+    ap.add_argument("--chunksize", type=int, default=1_000_000,
+                    help="Rows read at a time")
+    ap.add_argument("--slot-by", choices=["time", "index"], default="time",
+                    help="Bin packets by time (s) or by row number")
+    ap.add_argument("--start", type=float, default=0.0)
+    ap.add_argument("--interval", type=float, default=1.0)
+    ap.add_argument("--count", type=int, default=100)
+    ap.add_argument("--check", action="store_true",
+                    help="Compare with the in-memory path")
+    args = ap.parse_args()
+
+    by_index = args.slot_by == "index"
+    (mean_iat, var_iat), rate, slots = stream_trace(
+        args.trace, args.format,
+        [InterarrivalStats(), Bitrate(),
+         SlotBytes(args.start, args.interval, args.count, by_index)],
+        args.chunksize)
+    print(f"Mean IAT (s):          {mean_iat:.9f}")
+    print(f"Var  IAT (s^2):        {var_iat:.12e}")
+    print(f"Mean bit rate (Mbps):  {rate:.6f}")
+    print(f"Bytes in {args.count} slots:   {slots.sum():.0f} "
+          f"(max {slots.max():.0f})")
+
+    if args.check:
+        (ref_mean, ref_var), ref_rate, ref_slots = in_memory(
+            args.trace, args.format, args.start, args.interval, args.count,
+            by_index)
+        # the moments are summed in a different order, equal up to rounding
+        same = (np.isclose(mean_iat, ref_mean, rtol=1e-9, atol=0)
+                and np.isclose(var_iat, ref_var, rtol=1e-9, atol=0)
+                and rate == ref_rate
+                and np.array_equal(slots, ref_slots))
+        print(f"Matches in-memory path: {same}")
+        if not same:
+            raise SystemExit(1)
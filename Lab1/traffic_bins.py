@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+
+
+class SortedTrace:
+    """
+    Packet trace sorted by time once, with a running byte total, so that
+    the bytes of any time interval are a difference of two prefix sums.
+
+    Building it is O(N log N) (O(N) if already sorted); a view of `count`
+    intervals is then O(count log N), however many views are taken.
+    """
+
+    def __init__(self, times_s: np.ndarray, sizes_bytes: np.ndarray):
+        """
+        :param times_s: arrival time of each packet in seconds, in any order
+        :param sizes_bytes: size of each packet in bytes
+        """
+        times_s = np.asarray(times_s, dtype=float)
+        sizes_bytes = np.asarray(sizes_bytes)
+        if np.any(times_s[1:] < times_s[:-1]):
+            order = np.argsort(times_s, kind="stable")
+            times_s, sizes_bytes = times_s[order], sizes_bytes[order]
+        self.times = times_s
+        # cum[k] = bytes of the first k packets
+        self.cum = np.concatenate(([0], np.cumsum(sizes_bytes)))
+
+    def bytes_before(self, t: np.ndarray) -> np.ndarray:
+        """Bytes of the packets with time < t, for each t."""
+        return self.cum[np.searchsorted(self.times, t, side="left")]
+
+    def bytes_in_intervals(self, start_s: float, interval_s: float,
+                           count: int = 100) -> np.ndarray:
+        """
+        Bytes in [start_s + i*interval_s, start_s + i*interval_s + interval_s)
+        for i in range(count).
+        """
+        lo = start_s + np.arange(count) * interval_s
+        # upper edges computed as lo + interval, not as the next lo, so the
+        # intervals are exactly the ones a per-interval mask would use
+        hi = lo + interval_s
+        return (self.bytes_before(hi) - self.bytes_before(lo)).astype(float)
+
+    def views(self, specs) -> list[np.ndarray]:
+        """`bytes_in_intervals` for each (start_s, interval_s, count) spec."""
+        specs = list(specs)
+        if not specs:
+            return []
+        lo = np.concatenate([start + np.arange(count) * interval
+                             for start, interval, count in specs])
+        hi = lo + np.concatenate([np.full(count, interval)
+                                  for _, interval, count in specs])
+        out = (self.bytes_before(hi) - self.bytes_before(lo)).astype(float)
+        return np.split(out, np.cumsum([count for *_, count in specs])[:-1])
+
+
+class TrafficPyramid:
+    """
+    Byte counts of a trace in bins of `base` time units, and in bins of
+    base*10, base*100, ... (one level each), kept as prefix sums.
+
+    A view of n windows whose start and width are multiples of `base` is
+    then n+1 lookups in the coarsest level whose bin divides both, O(n)
+    whatever the trace length, and never touches the packets again. The
+    pyramid can be saved next to its trace and reloaded by `cached_pyramid`.
+    """
+
+    def __init__(self, levels: list[np.ndarray], base: float, origin: float,
+                 t_min: float, t_max: float):
+        """
+        :param levels: prefix sums per level, levels[k][i] = bytes in the
+            first i bins of width base*10**k
+        :param base: width of the finest bins, in trace time units
+        :param origin: time of the left edge of bin 0
+        :param t_min: time of the first packet
+        :param t_max: time of the last packet
+        """
+        self.levels = levels
+        self.base = base
+        self.origin = origin
+        self.t_min = t_min
+        self.t_max = t_max
+
+    @classmethod
+    def build(cls, times: np.ndarray, sizes: np.ndarray, base: float,
+              n_levels: int = 4, origin: float = 0.0) -> "TrafficPyramid":
+        """
+        :param times: arrival time of each packet, in any order, >= origin
+        :param sizes: size of each packet in bytes
+        :param base: width of the finest bins
+        :param n_levels: number of levels, the coarsest is base*10**(n-1)
+        :param origin: time of the left edge of bin 0
+        """
+        times = np.asarray(times, dtype=float)
+        if len(times) and times.min() < origin:
+            raise ValueError("packet times start before the pyramid origin")
+        # rounding absorbs the float error of times that sit on a bin edge
+        bins = np.floor(np.round((times - origin) / base, 6)).astype(np.int64)
+        n_bins = int(bins.max()) + 1 if len(bins) else 0
+        n_bins += -n_bins % 10 ** (n_levels - 1)  # whole bins at every level
+        counts = np.bincount(bins, weights=sizes, minlength=n_bins)
+        counts = np.rint(counts).astype(np.int64)
+        levels = [np.concatenate(([0], np.cumsum(counts)))]
+        for _ in range(n_levels - 1):
+            counts = counts.reshape(-1, 10).sum(axis=1)
+            levels.append(np.concatenate(([0], np.cumsum(counts))))
+        t_min = float(times.min()) if len(times) else origin
+        t_max = float(times.max()) if len(times) else origin
+        return cls(levels, base, origin, t_min, t_max)
+
+    def snap(self, t: float) -> float:
+        """The bin edge at or before time `t`."""
+        return self.origin + np.floor(np.round((t - self.origin) / self.base, 6)) * self.base
+
+    def ticks(self, t: float) -> int:
+        """`t` - origin in units of `base`; `t` must be on a bin edge."""
+        ticks = round((t - self.origin) / self.base)
+        if abs((t - self.origin) / self.base - ticks) > 1e-6:
+            raise ValueError(f"{t} is not a multiple of {self.base} from "
+                             f"{self.origin}, snap() it first")
+        return ticks
+
+    def bytes_in_windows(self, start: float, window: float,
+                         n_windows: int) -> np.ndarray:
+        """
+        Bytes in [start + k*window, start + (k+1)*window) for k in
+        range(n_windows). Windows past either end of the trace are empty.
+        """
+        s, w = self.ticks(start), self.ticks(window)
+        if w <= 0:
+            raise ValueError("window must be at least one base bin")
+        level = 0
+        while (level + 1 < len(self.levels)
+               and s % 10 ** (level + 1) == 0 and w % 10 ** (level + 1) == 0):
+            level += 1
+        step = 10 ** level
+        cum = self.levels[level]
+        edges = (s + np.arange(n_windows + 1) * w) // step
+        return np.diff(cum[np.clip(edges, 0, len(cum) - 1)])
+
+    def save(self, path: str, **meta):
+        """Write to an .npz file, with `meta` stored alongside."""
+        np.savez(path, base=self.base, origin=self.origin, t_min=self.t_min,
+                 t_max=self.t_max, n_levels=len(self.levels),
+                 **{f"level{k}": cum for k, cum in enumerate(self.levels)},
+                 **{f"meta_{k}": v for k, v in meta.items()})
+
+    @classmethod
+    def load(cls, path: str) -> tuple["TrafficPyramid", dict]:
+        """Read a pyramid written by `save`, and its metadata."""
+        with np.load(path) as f:
+            levels = [f[f"level{k}"] for k in range(int(f["n_levels"]))]
+            meta = {k[5:]: f[k].item() for k in f.files if k.startswith("meta_")}
+            return cls(levels, float(f["base"]), float(f["origin"]),
+                       float(f["t_min"]), float(f["t_max"])), meta
+
+
+def cached_pyramid(trace_path: str, load, base: float, n_levels: int = 4,
+                   origin: float = 0.0) -> TrafficPyramid:
+    """
+    Pyramid of the trace at `trace_path`, read from `<trace_path>.pyramid.npz`
+    if that was built from the current file with the same parameters, else
+    built and saved there.
+
+    :param load: called with `trace_path` only on a rebuild, returns
+        (times, sizes) of the packets
+    """
+    st = os.stat(trace_path)
+    key = dict(src_size=st.st_size, src_mtime_ns=st.st_mtime_ns, base=base,
+               n_levels=n_levels, origin=origin)
+    cache = trace_path + ".pyramid.npz"
+    if os.path.exists(cache):
+        try:
+            pyramid, meta = TrafficPyramid.load(cache)
+            if meta == key:
+                return pyramid
+        except (OSError, KeyError, ValueError):
+            pass  # unreadable or from an older layout, rebuild it
+    times, sizes = load(trace_path)
+    pyramid = TrafficPyramid.build(times, sizes, base, n_levels, origin)
+    # write then rename, so a reader never sees a half-written cache
+    tmp = f"{cache}.{os.getpid()}.tmp.npz"
+    pyramid.save(tmp, **key)
+    os.replace(tmp, cache)
+    return pyramid
@@ -1,6 +1,7 @@
-import pandas as pd
 import sys
 
+from trace_cache import load_frame
+
 ############################################################################
 # The program reads an input file "data.txt"  that has entries of the form
 #  0    0.000000    I   536 98.190  92.170	92.170
@@ -12,12 +13,10 @@ import sys
 ############################################################################
 
 
-# Read packet trace
-df = pd.read_csv(
+# Read packet trace (parsed once, then memory-mapped from <file>.cache/)
+df = load_frame(
     #"data.txt",   # file to load
     sys.argv[1],   # file to load
-    sep=r"\s+",   # each column is space-separated
-    header=None,  # the file contains no header
     # column names, with units at the back
     names=[
         "display_idx",  # frame display index
@@ -27,9 +26,10 @@ df = pd.read_csv(
         # We don't use the remaining fields, so just call them "unused"
         "unused1", "unused2", "unused3",
     ],
+).astype(
     # pandas can normally infer the type of each column,
     # but we explicate them just in case
-    dtype={
+    {
         'display_idx': 'Int32', 'type': 'category',
         'time_ms': 'Float64', 'size_B': 'Int32',
     },
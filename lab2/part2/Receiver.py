@@ -1,22 +1,225 @@
 #!/usr/bin/env python3
+import argparse
+import select
+import signal
 import socket
+import struct
 import sys
 import time
 
+import numpy as np
+
+from packet_header import parse
+from replay import LatenessHistogram
+from shaper_metrics import Histogram
+
+# One record per datagram in FastSink's buffer:
+#   recv time, time.monotonic_ns() (int64) | length (int32)
+#   | seq (int64, -1 without a header) | send time (int64)
+#   | shaper enqueue time (int64) | shaper dequeue time (int64)
+RECORD = struct.Struct("<qiqqqq")
+DTYPE = np.dtype([("recv_ns", "<i8"), ("len", "<i4"), ("seq", "<i8"),
+                  ("send_ns", "<i8"), ("enq_ns", "<i8"), ("deq_ns", "<i8")])
+NO_HEADER = (-1, 0, 0, 0)
+PERCENTILES = (50, 99, 99.9)
+
+
+class SinkStats:
+    """
+    Loss, reordering and delays of stamped datagrams, updated one block of
+    records at a time. Sequence numbers are expected from 0; a datagram is
+    reordered if a higher one arrived before it. Delays compare monotonic
+    clocks, so they are only meaningful when Sender (and the shaper) run on
+    the same host:
+
+      one-way delay   send to receive, the whole shaping delay
+      queueing delay  shaper enqueue to dequeue, 0 for datagrams the shaper
+                      sent on arrival (token_bucket.py --stamp)
+      jitter          change in one-way delay between consecutive datagrams,
+                      in arrival order
+
+    Each is counted in a log-linear shaper_metrics.Histogram, so memory
+    stays fixed however long the run, and their p50/p99/p99.9 are upper
+    bounds at most 1/16 (6.25%) above the true values.
+    """
+
+    def __init__(self):
+        self.received = 0     # stamped datagrams
+        self.unstamped = 0
+        self.reordered = 0
+        self.max_seq = -1
+        self.queued = 0       # datagrams with shaper times
+        self.delay = LatenessHistogram("One-way delay")
+        self.last_delay = None  # one-way delay of the last stamped datagram
+        self.samples = {name: Histogram(name, "", {}) for name in
+                        ("one-way delay", "queueing delay", "jitter")}  # ns
+
+    def update(self, rec: np.ndarray):
+        stamped = rec[rec["seq"] >= 0]
+        self.unstamped += len(rec) - len(stamped)
+        if not len(stamped):
+            return
+        seq = stamped["seq"]
+        before = np.maximum.accumulate(np.concatenate(([self.max_seq], seq)))[:-1]
+        self.reordered += int((seq < before).sum())
+        self.max_seq = max(self.max_seq, int(seq.max()))
+        self.received += len(stamped)
+        delay = stamped["recv_ns"] - stamped["send_ns"]
+        self.delay.add_many(delay)
+        jitter = np.abs(np.diff(delay, prepend=delay[0] if self.last_delay is None
+                                else self.last_delay))
+        if self.last_delay is None:
+            jitter = jitter[1:]
+        self.last_delay = int(delay[-1])
+        shaped = stamped["deq_ns"] > 0
+        self.queued += int(shaped.sum())
+        queueing = np.where(shaped, stamped["deq_ns"] - stamped["enq_ns"], 0)
+        for hist, values in zip(self.samples.values(),
+                                (delay, queueing, jitter)):
+            hist.record_many(values)
+
+    def percentiles(self):
+        """Table of the delay percentiles (upper bounds), in us."""
+        lines = [f"  {'(us, <=)':<16}" + "".join(f"{f'p{q:g}':>12}" for q in PERCENTILES)]
+        for name, hist in self.samples.items():
+            if name == "queueing delay" and not self.queued:
+                lines.append(f"  {name:<16}  no shaper times (token_bucket.py --stamp)")
+                continue
+            if not hist.count():
+                continue
+            lines.append(f"  {name:<16}" + "".join(
+                f"{v / 1000:>12.1f}" for v in hist.percentiles(PERCENTILES)))
+        return "\n".join(lines)
+
+    def report(self):
+        if not self.received:
+            return f"No stamped datagrams ({self.unstamped} without a header)"
+        expected = self.max_seq + 1
+        lost = max(expected - self.received, 0)
+        lines = [
+            f"Received {self.received} of {expected} stamped datagrams: "
+            f"lost {lost} ({lost / expected:.3%}), reordered "
+            f"{self.reordered} ({self.reordered / self.received:.3%})"]
+        if self.queued:
+            lines.append(f"Queued by the shaper: {self.queued} "
+                         f"({self.queued / self.received:.3%}), the rest "
+                         f"sent on arrival")
+        return "\n".join(lines + [self.delay.report(), self.percentiles()])
+
+
+class FastSink:
+    """
+    Sink for high packet rates. Each wakeup drains the socket without
+    blocking, and each datagram costs one recv_into and one record packed
+    into a preallocated buffer. Records are written out, in the format of
+    the plain receiver, and fed to SinkStats in bulk: when the buffer is
+    full, every `flush_interval` seconds and on exit.
+    """
+
+    def __init__(self, sock, outfile, capacity=1 << 16, flush_interval=1.0,
+                 rcvbuf=8 << 20):
+        """
+        :param capacity: records held between flushes
+        :param flush_interval: seconds between flushes, 0 for none
+        :param rcvbuf: socket receive buffer in bytes, to ride out bursts
+            (the kernel caps it at net.core.rmem_max)
+        """
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.out = open(outfile, "w")
+        self.out.write("delta_us\tpkt_len\n")
+        self.records = bytearray(RECORD.size * capacity)
+        self.pos = 0
+        self.flush_interval = flush_interval
+        self.last_ns = None  # receive time of the last flushed datagram
+        self.stats = SinkStats()
+
+    def run(self):
+        buf = bytearray(65535)
+        view = memoryview(buf)
+        records = self.records
+        pack_into = RECORD.pack_into
+        size = RECORD.size
+        limit = len(records)
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            timeout = (max(next_flush - time.monotonic(), 0)
+                       if self.flush_interval else None)
+            select.select([self.sock], [], [], timeout)
+            while True:
+                try:
+                    n = self.sock.recv_into(view)
+                except BlockingIOError:
+                    break
+                now = time.monotonic_ns()
+                header = parse(buf, n) or NO_HEADER
+                pack_into(records, self.pos, now, n, *header)
+                self.pos += size
+                if self.pos == limit:
+                    self.flush()
+            if self.flush_interval and time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + self.flush_interval
+
+    def flush(self):
+        """Write out and account the buffered records."""
+        if not self.pos:
+            return
+        rec = np.frombuffer(self.records, dtype=DTYPE, count=self.pos // RECORD.size)
+        recv_ns = rec["recv_ns"]
+        prev = recv_ns[0] if self.last_ns is None else self.last_ns
+        delta_us = np.diff(recv_ns, prepend=prev) // 1000
+        self.out.write("".join(f"{d}\t{n}\n" for d, n in
+                               zip(delta_us.tolist(), rec["len"].tolist())))
+        self.out.flush()
+        self.stats.update(rec)
+        self.last_ns = int(recv_ns[-1])
+        self.pos = 0
+
+    def close(self):
+        self.flush()
+        self.out.close()
+        self.sock.close()
+
+
 def main():
-    if len(sys.argv) != 3:
-        print(f"Usage: {sys.argv[0]} <listen_port> <outfile>")
-        sys.exit(1)
+    ap = argparse.ArgumentParser()
+    ap.add_argument("listen_port", type=int)
+    ap.add_argument("outfile")
+    ap.add_argument("--fast", action="store_true",
+                    help="Batched receive with bulk log writes, and loss, "
+                         "reordering, delay and jitter of Sender --stamp "
+                         "datagrams")
+    ap.add_argument("--capacity", type=int, default=1 << 16,
+                    help="Datagrams buffered between flushes (--fast)")
+    ap.add_argument("--flush-interval", type=float, default=1.0,
+                    help="Seconds between flushes, 0 for none (--fast)")
+    ap.add_argument("--rcvbuf", type=int, default=8 << 20,
+                    help="Socket receive buffer in bytes (--fast)")
+    args = ap.parse_args()
 
-    listen_port = int(sys.argv[1])
-    outfile = sys.argv[2]
+    # Let `kill` end the run like Ctrl+C, so the log is complete
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("", listen_port))
-    print(f"Waiting for UDP on port {listen_port} ... (Ctrl+C to stop)")
+    sock.bind(("", args.listen_port))
+    print(f"Waiting for UDP on port {args.listen_port} ... (Ctrl+C to stop)")
+
+    if args.fast:
+        sink = FastSink(sock, args.outfile, args.capacity, args.flush_interval,
+                        args.rcvbuf)
+        try:
+            sink.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sink.close()
+            print(sink.stats.report())
+        return
 
     last = None
-    with open(outfile, "w") as f:
+    with open(args.outfile, "w") as f:
         f.write("delta_us\tpkt_len\n")
         try:
             while True:
@@ -34,4 +237,4 @@ def main():
             sock.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
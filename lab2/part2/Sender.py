@@ -3,50 +3,11 @@ import socket
 import time
 import argparse
 
+import numpy as np
 
-def parse_poisson(parts):
-    if len(parts) < 3:
-        return None
-    rel_ms = float(parts[1])
-    size = int(parts[2])
-    return rel_ms, size
-
-def parse_video(parts):
-    if len(parts) < 4:
-        return None
-    rel_ms = float(parts[1])
-    size = int(parts[3])
-    return rel_ms, size
-
-
-
-def parse_ethernet(parts):
-    if len(parts) >= 2:
-        rel_ms = float(parts[0]) * 1000.0 
-        size = int(parts[1])
-        return rel_ms, size
-    return None
-
-
-def parse_line(tracefile, line):
-    line = line.strip()
-    if not line or line.startswith("#"):
-        return None
-
-    parts = line.split()
-
-    # --- Part 2 ---
-    if tracefile.endswith("poisson-lab2a.data"):
-        return parse_poisson(parts)
-
-    # --- Part 3-c ---
-    if tracefile.endswith("movietrace.data"):
-        return parse_video(parts)
-
-    if tracefile.endswith("BC-pAug89.TL") or tracefile.endswith("BC-pAug89.TL.Z"):
-        return parse_ethernet(parts)
-
-    return parse_poisson(parts)
+from replay import (LatenessHistogram, Pacer, build_schedule, parallel_replay,
+                    reorder, replay, stream_schedule)
+from trace_reader import iter_trace, read_trace
 
 
 def main():
@@ -58,49 +19,72 @@ def main():
                     help="Max UDP payload (used in Part 3-c)")
     ap.add_argument("--limit", type=int, default=None,
                     help="Limit number of trace entries (used in Part 3-c)")
+    ap.add_argument("--slack-us", type=float, default=200.0,
+                    help="Spin instead of sleeping for the last SLACK_US "
+                         "before each datagram (0: sleep only)")
+    ap.add_argument("--speed", type=float, default=1.0,
+                    help="Replay the trace SPEED times faster")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Send from this many processes, one socket each")
+    ap.add_argument("--stream", action="store_true",
+                    help="Parse while sending, sorting only within "
+                         "--reorder-window entries instead of the whole trace")
+    ap.add_argument("--reorder-window", type=int, default=64,
+                    help="Entries held back to reorder in --stream mode")
+    ap.add_argument("--stamp", action="store_true",
+                    help="Put a sequence number and send time in each "
+                         "datagram (see packet_header.py) instead of b'a's")
     args = ap.parse_args()
+    if args.speed <= 0:
+        ap.error("--speed must be positive")
 
-    rows = []
-    with open(args.tracefile, "r") as f:
-        for line in f:
-            parsed = parse_line(args.tracefile, line)
-            if parsed is None:
-                continue
-            rel_ms, size = parsed
-            rows.append((rel_ms, size))
-            if args.limit is not None and len(rows) >= args.limit:
-                break
+    addr = (args.dst_ip, args.dst_port)
+    slack_ns = int(args.slack_us * 1000)
+    hist = LatenessHistogram()
+
+    if args.stream:
+        if args.workers > 1:
+            ap.error("--stream sends from one process, drop --workers")
+        entries = reorder(iter_trace(args.tracefile, args.limit),
+                          args.reorder_window)
+        schedule = stream_schedule(entries, args.max_dgram, args.speed)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            replay(sock, addr, schedule, time.monotonic_ns(),
+                   Pacer(slack_ns), hist, args.max_dgram, args.stamp)
+        finally:
+            sock.close()
+            print(hist.report())
+        return
 
-    if not rows:
+    rel_ms, size = read_trace(args.tracefile, args.limit)
+
+    if not len(rel_ms):
         print("Trace file empty or unreadable.")
         return
 
-    rows.sort(key=lambda x: x[0])
+    t_ns, sizes = build_schedule(rel_ms, size, args.max_dgram)
+    if args.speed != 1.0:
+        t_ns = np.rint(t_ns / args.speed).astype(np.int64)
+
+    if args.workers > 1:
+        for k, worker_hist in enumerate(parallel_replay(
+                addr, t_ns, sizes, args.workers, slack_ns, args.max_dgram,
+                stamp=args.stamp)):
+            print(f"Worker {k}: {worker_hist.summary()}")
+            hist.merge(worker_hist)
+        print(hist.report())
+        return
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    addr = (args.dst_ip, args.dst_port)
-
-    # Timing setup
-    t0_trace_ms = rows[0][0]
-    t0 = time.monotonic()
-
-    for rel_ms, size in rows:
-        # Sleep until scheduled arrival time
-        target_s = (rel_ms - t0_trace_ms) / 1000.0
-        now_s = time.monotonic() - t0
-        sleep_s = target_s - now_s
-        if sleep_s > 0:
-            time.sleep(sleep_s)
-
-        # Part 2: packets already fit in one datagram
-        # Part 3-c: split large frames into multiple datagrams
-        remaining = size
-        while remaining > 0:
-            chunk = min(remaining, args.max_dgram)
-            sock.sendto(b"a" * chunk, addr)
-            remaining -= chunk
 
-    sock.close()
+    try:
+        replay(sock, addr, zip(t_ns.tolist(), sizes.tolist()),
+               time.monotonic_ns(), Pacer(slack_ns), hist,
+               args.max_dgram, args.stamp)
+    finally:
+        sock.close()
+        print(hist.report())
 
 
 if __name__ == "__main__":
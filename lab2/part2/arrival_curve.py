@@ -0,0 +1,33 @@
+import numpy as np
+
+
+class ArrivalCurve:
+    """
+    Cumulative arrival curve of a packet trace: A(t) = total size of the
+    packets that arrived strictly before t.
+
+    Building it sorts the trace once, O(N log N); each evaluation is then a
+    binary search, O(log N), instead of a pass over the whole trace.
+    """
+
+    def __init__(self, times, sizes):
+        """
+        :param times: arrival time of each packet, in any order
+        :param sizes: size of each packet
+        """
+        times = np.asarray(times, dtype=float)
+        sizes = np.asarray(sizes)
+        order = np.argsort(times, kind="stable")
+        self.times = times[order]
+        # cum[k] = total size of the first k packets in time order
+        self.cum = np.concatenate(([0], np.cumsum(sizes[order])))
+
+    def __call__(self, thresholds):
+        """A(t) for each t in `thresholds`."""
+        idx = np.searchsorted(self.times, thresholds, side="left")
+        return self.cum[idx]
+
+
+def cumulative_arrivals(times, sizes, thresholds):
+    """Total size of the packets arriving strictly before each threshold."""
+    return ArrivalCurve(times, sizes)(thresholds)
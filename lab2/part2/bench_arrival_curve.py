@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Scaling of the cumulative arrival curve against the per-threshold sums it
+replaced in graph.py. The quadratic version is only run while it finishes
+in reasonable time, and both are checked for equal output.
+
+  python3 bench_arrival_curve.py --max-packets 10000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from arrival_curve import cumulative_arrivals
+
+
+def cumulative_arrivals_ref(times, sizes, thresholds):
+    """The per-threshold list comprehension of the old graph.py."""
+    trace = list(zip(sizes, times))
+    return [sum([s for s, t in trace if t < thres]) for thres in thresholds]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Arrival curve benchmark")
+    ap.add_argument("--max-packets", type=int, default=10_000_000)
+    ap.add_argument("--max-ref-packets", type=int, default=20_000,
+                    help="Largest trace to run the quadratic version on")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(466)
+    print(f"{'packets':>10} {'bins':>8} {'before (s)':>11} {'after (s)':>10}")
+    n = 1000
+    while n <= args.max_packets:
+        # Poisson arrivals at 1 packet/ms, 1 ms bins as in graph.py
+        times = np.cumsum(rng.exponential(1.0, n))
+        sizes = rng.integers(1, 100, n).astype(float)
+        bins = np.arange(0, int(times.max()) + 10) + 0.5
+
+        t0 = time.perf_counter()
+        curve = cumulative_arrivals(times, sizes, bins)
+        t_new = time.perf_counter() - t0
+
+        if n <= args.max_ref_packets:
+            t0 = time.perf_counter()
+            ref = cumulative_arrivals_ref(times, sizes, bins)
+            t_ref = f"{time.perf_counter() - t0:>11.3f}"
+            assert np.array_equal(curve, ref)
+        else:
+            t_ref = f"{'-':>11}"
+        print(f"{n:>10} {len(bins):>8} {t_ref} {t_new:>10.3f}")
+        n *= 10
@@ -1,6 +1,9 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import sys
 
+from arrival_curve import cumulative_arrivals
+
 with open('poisson-lab2a.data', 'r') as file:
     real = [[float(j) for j in i.strip().split('\t')] for i in file.readlines()]
 
@@ -8,28 +11,16 @@ with open('output.txt', 'r') as file:
     sim = [[float(j) for j in i.strip().split('\t')] for i in file.readlines()[1:]]
     sim = [[i[1], i[0]/1000] for i in sim]
 
-int_sim = []
-intt = 0
-for size, t in sim:
-    intt += t
-    int_sim.append((size, intt))
-
-
-sim_data = []
-real_data = []
-diffs = []
-
-max_bin = int(max([i[1] for i in real])) + 10
-for thres_int in range(0,max_bin):
-    thres = thres_int + 0.5
-    sim_sum = sum([i[0] for i in int_sim if i[1] < thres])
-    real_sum = sum([i[2] for i in real if i[1] < thres])
-    diff = real_sum - sim_sum
-    diffs.append(diff)
-    sim_data.append(sim_sum)
-    real_data.append(real_sum)
+real = np.array(real)  # columns: seq, time (ms), size (B)
+sim = np.array(sim)    # columns: size (B), inter-arrival (ms)
+sim_times = np.cumsum(sim[:, 1])  # arrival time of each packet (ms)
 
-bins = [0.5+i for i in range(0,max_bin)]
+# Accumulated size before each bin edge, from one sort + cumsum per trace
+max_bin = int(real[:, 1].max()) + 10
+bins = np.arange(0, max_bin) + 0.5
+sim_data = cumulative_arrivals(sim_times, sim[:, 0], bins)
+real_data = cumulative_arrivals(real[:, 1], real[:, 2], bins)
+diffs = real_data - sim_data
 
 plt.figure(figsize=(8, 4))
 plt.fill_between(bins, diffs, step="post")
@@ -1,6 +1,9 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import sys
 
+from arrival_curve import cumulative_arrivals
+
 with open('poisson-lab2a.data', 'r') as file:
     real = [[float(j) for j in i.strip().split('\t')] for i in file.readlines()]
 
@@ -8,34 +11,15 @@ with open('output.txt', 'r') as file:
     sim = [[float(j) for j in i.strip().split('\t')] for i in file.readlines()[1:]]
     sim = [[i[1], i[0]/1000] for i in sim]
 
+real = np.array(real)  # columns: seq, time (ms), size (B)
+sim = np.array(sim)    # columns: size (B), inter-arrival (ms)
+sim_times = np.cumsum(sim[:, 1])  # arrival time of each packet (ms)
 
-int_sim = []
-intt = 0
-#cumsize = 0
-for size, t in sim:
-    intt += t
-    #cumsize += size
-    int_sim.append((size, intt))
-
-#int_real = []
-#cumsize = 0
-#for _, t, size in real:
-#    cumsize += size
-#    int_real.append((cumsize, t))
-
-
-sim_data = []
-real_data = []
-diffs = []
-
-max_bin = int(max([i[1] for i in real])) + 10
-for thres in range(1,max_bin):
-    sim_sum = sum([i[0] for i in int_sim if i[1] < thres])
-    real_sum = sum([i[2] for i in real if i[1] < thres])
-    diff = real_sum - sim_sum
-    diffs.append(diff)
-    sim_data.append(sim_sum)
-    real_data.append(real_sum)
+max_bin = int(real[:, 1].max()) + 10
+thresholds = np.arange(1, max_bin)
+sim_data = cumulative_arrivals(sim_times, sim[:, 0], thresholds)
+real_data = cumulative_arrivals(real[:, 1], real[:, 2], thresholds)
+diffs = real_data - sim_data
 
 plt.figure(figsize=(8, 4))
 plt.fill_between(range(1,max_bin), diffs, step="post")
@@ -0,0 +1,38 @@
+import struct
+
+# Opt-in header at the start of a datagram's payload (Sender --stamp):
+#   magic (4 bytes) | seq (uint64) | send time (int64)
+#   | shaper enqueue time (int64) | shaper dequeue time (int64)
+# All times are time.monotonic_ns(). Sender leaves the shaper times at 0;
+# a shaper run with --stamp fills them in (see byte_queue.py), and leaves
+# them at 0 for a packet it sends on arrival without queueing it.
+# Datagrams shorter than the header are sent without one.
+MAGIC = b"SEQ1"
+HEADER = struct.Struct("<4sQqqq")
+ENQ_OFFSET = 20  # offset of the shaper enqueue time in the header
+DEQ_OFFSET = 28  # offset of the shaper dequeue time in the header
+TIME = struct.Struct("<q")
+
+
+def stamp(buf, seq: int, send_ns: int):
+    """Write the header for datagram `seq` sent at `send_ns` into `buf`."""
+    HEADER.pack_into(buf, 0, MAGIC, seq, send_ns, 0, 0)
+
+
+def stamp_time(buf, offset: int, now_ns: int):
+    """
+    Write `now_ns` at `offset` (ENQ_OFFSET or DEQ_OFFSET) of the writable
+    packet `buf` if it starts with a header; other packets are left as is.
+    """
+    if len(buf) >= HEADER.size and buf[:4] == MAGIC:
+        TIME.pack_into(buf, offset, now_ns)
+
+
+def parse(buf, length: int):
+    """(seq, send_ns, enq_ns, deq_ns) of the first `length` bytes of `buf`, or None."""
+    if length < HEADER.size:
+        return None
+    magic, seq, send_ns, enq_ns, deq_ns = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        return None
+    return seq, send_ns, enq_ns, deq_ns
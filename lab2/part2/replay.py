@@ -0,0 +1,251 @@
+import bisect
+import heapq
+import itertools
+import multiprocessing as mp
+import socket
+import time
+
+import numpy as np
+
+from packet_header import HEADER, stamp as stamp_header
+
+
+def entry_schedule(rel_ms, size):
+    """
+    Trace entries stably sorted by time, with times in ns after the first.
+
+    :return: (t_ns, size) of each entry, including empty ones
+    """
+    rel_ms = np.asarray(rel_ms, dtype=float)
+    size = np.asarray(size, dtype=np.int64)
+    order = np.argsort(rel_ms, kind="stable")
+    rel_ms, size = rel_ms[order], size[order]
+    if not len(rel_ms):
+        return np.zeros(0, dtype=np.int64), size
+    return np.rint((rel_ms - rel_ms[0]) * 1e6).astype(np.int64), size
+
+
+def build_schedule(rel_ms, size, max_dgram=1480):
+    """
+    Datagram schedule of a trace: each entry of `size` bytes at `rel_ms` is
+    split into datagrams of at most `max_dgram` bytes sent back to back.
+    Entries are stably sorted by time first.
+
+    :param rel_ms: time of each trace entry, in ms, in any order
+    :param size: size of each trace entry, in bytes
+    :return: (t_ns, sizes), time of each datagram in ns after the first
+        entry and its size in bytes
+    """
+    t_entry, size = entry_schedule(rel_ms, size)
+    if not len(t_entry):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    n = np.where(size > 0, -(-size // max_dgram), 0)  # datagrams per entry
+    t_ns = np.repeat(t_entry, n)
+    sizes = np.full(len(t_ns), max_dgram, dtype=np.int64)
+    last = np.cumsum(n)[n > 0] - 1  # last datagram of each entry
+    sizes[last] = size[n > 0] - (n[n > 0] - 1) * max_dgram
+    return t_ns, sizes
+
+
+def reorder(entries, window=64):
+    """
+    Yield (rel_ms, size) entries in time order, holding back at most
+    `window` of them. Equal times keep their input order. An entry more
+    than `window` places early in the input comes out late, behind later
+    times, and is then sent as soon as it is reached.
+    """
+    heap = []
+    for seq, (rel_ms, size) in enumerate(entries):
+        heapq.heappush(heap, (rel_ms, seq, size))
+        if len(heap) > window:
+            rel_ms, _, size = heapq.heappop(heap)
+            yield rel_ms, size
+    while heap:
+        rel_ms, _, size = heapq.heappop(heap)
+        yield rel_ms, size
+
+
+def stream_schedule(entries, max_dgram=1480, speed=1.0):
+    """
+    The datagrams of build_schedule, generated one entry at a time from
+    time-ordered (rel_ms, size) entries, with times divided by `speed`.
+    """
+    t0 = None
+    for rel_ms, size in entries:
+        if t0 is None:
+            t0 = rel_ms
+        t_ns = round((rel_ms - t0) * 1e6)
+        if speed != 1.0:
+            t_ns = round(t_ns / speed)
+        while size > 0:
+            chunk = min(size, max_dgram)
+            yield t_ns, chunk
+            size -= chunk
+
+
+class Pacer:
+    """
+    Waits for deadlines on the monotonic clock: sleeps until `slack_ns`
+    before the deadline, then spins for the rest. time.sleep alone wakes
+    up tens to hundreds of us late; the spin absorbs that, at the cost of
+    up to `slack_ns` of CPU per datagram. slack_ns=0 only sleeps.
+    """
+
+    def __init__(self, slack_ns=200_000):
+        self.slack_ns = slack_ns
+
+    def wait_until(self, deadline_ns):
+        """Return once time.monotonic_ns() >= deadline_ns, with the time."""
+        now = time.monotonic_ns()
+        if deadline_ns - now > self.slack_ns:
+            time.sleep((deadline_ns - now - self.slack_ns) / 1e9)
+            now = time.monotonic_ns()
+        if self.slack_ns:
+            while now < deadline_ns:
+                now = time.monotonic_ns()
+        return now
+
+
+class LatenessHistogram:
+    """
+    Histogram of how late each datagram was sent relative to its schedule,
+    in 1-2-5 buckets from 10 us to 1 s. Counts of several histograms can
+    be added with `merge`. Other delays can be counted too, under `label`.
+    """
+
+    EDGES_US = (0, 10, 20, 50, 100, 200, 500, 1_000, 2_000, 5_000, 10_000,
+                20_000, 50_000, 100_000, 200_000, 500_000, 1_000_000)
+
+    def __init__(self, label="Lateness"):
+        self.label = label
+        self.edges_ns = [e * 1000 for e in self.EDGES_US]
+        self.counts = [0] * len(self.EDGES_US)  # bucket i: [edge i, edge i+1)
+        self.n = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, late_ns):
+        self.counts[max(bisect.bisect_right(self.edges_ns, late_ns) - 1, 0)] += 1
+        self.n += 1
+        self.total_ns += late_ns
+        if late_ns > self.max_ns:
+            self.max_ns = late_ns
+
+    def add_many(self, late_ns: np.ndarray):
+        """`add` each value of an array."""
+        if not len(late_ns):
+            return
+        idx = np.maximum(np.searchsorted(self.edges_ns, late_ns, side="right") - 1, 0)
+        for i, count in enumerate(np.bincount(idx, minlength=len(self.counts))):
+            self.counts[i] += int(count)
+        self.n += len(late_ns)
+        self.total_ns += int(late_ns.sum())
+        self.max_ns = max(self.max_ns, int(late_ns.max()))
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.n += other.n
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+
+    def percentile_us(self, q):
+        """Upper edge of the bucket holding the q-th percentile, in us."""
+        rank = q / 100 * self.n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                break
+        if i + 1 < len(self.EDGES_US):
+            return self.EDGES_US[i + 1]
+        return self.max_ns / 1000
+
+    def summary(self):
+        """Count, mean, max and percentiles on one line."""
+        if not self.n:
+            return f"{self.label}: no datagrams"
+        return (f"{self.label} of {self.n} datagrams: mean "
+                f"{self.total_ns / self.n / 1000:.1f} us, max "
+                f"{self.max_ns / 1000:.1f} us, p50 <= "
+                f"{self.percentile_us(50):g} us, p99 <= "
+                f"{self.percentile_us(99):g} us")
+
+    def report(self):
+        """The histogram as text, one line per non-empty bucket."""
+        if not self.n:
+            return self.summary()
+        lines = [self.summary(),
+                 f"  {f'{self.label.lower()} (us)':>20} {'count':>10} {'share':>7}"]
+        for i, count in enumerate(self.counts):
+            if not count:
+                continue
+            hi = (f"{self.EDGES_US[i + 1]}" if i + 1 < len(self.EDGES_US)
+                  else "")
+            lines.append(f"  {f'[{self.EDGES_US[i]}, {hi})':>20} {count:>10} "
+                         f"{count / self.n:>7.2%}")
+        return "\n".join(lines)
+
+
+def replay(sock, addr, schedule, epoch_ns, pacer, hist, max_dgram=1480,
+           stamp=False, seqs=None):
+    """
+    Send each datagram of `schedule` at epoch_ns + its time, recording its
+    lateness in `hist`. Payloads are views of one preallocated buffer.
+
+    :param schedule: iterable of (t_ns, size) in time order
+    :param epoch_ns: time.monotonic_ns() at which t_ns = 0
+    :param stamp: start each datagram that is long enough with a
+        packet_header carrying its send time and the next of `seqs`
+        (default 0, 1, 2, ...)
+    """
+    seqs = iter(seqs) if seqs is not None else itertools.count()
+    buf = bytearray(b"a" * max_dgram)
+    view = memoryview(buf)
+    payloads = {}  # size -> view of buf
+    for t_ns, size in schedule:
+        deadline = epoch_ns + t_ns
+        now = pacer.wait_until(deadline)
+        payload = payloads.get(size)
+        if payload is None:
+            payload = payloads[size] = view[:size]
+        if stamp and size >= HEADER.size:
+            stamp_header(buf, next(seqs), time.monotonic_ns())
+        sock.sendto(payload, addr)
+        hist.add(now - deadline)
+
+
+def replay_worker(addr, t_ns, sizes, epoch_ns, slack_ns, max_dgram, stamp,
+                  seqs):
+    """Replay part of a schedule on a socket of its own; returns the lateness."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    hist = LatenessHistogram()
+    try:
+        replay(sock, addr, zip(t_ns.tolist(), sizes.tolist()), epoch_ns,
+               Pacer(slack_ns), hist, max_dgram, stamp, seqs)
+    finally:
+        sock.close()
+    return hist
+
+
+def parallel_replay(addr, t_ns, sizes, workers, slack_ns=200_000,
+                    max_dgram=1480, lead_ns=500_000_000, stamp=False):
+    """
+    Replay a schedule from `workers` processes, each with its own socket.
+    Datagrams are dealt round robin, so each worker sends every
+    `workers`-th one and the rate per process drops by that factor. All
+    workers pace against one epoch on the monotonic clock, which is shared
+    by every process on the machine, set `lead_ns` ahead so they have all
+    started by then. Stamped datagrams are numbered in schedule order, as
+    from a single process.
+
+    :return: the lateness of each worker, in worker order
+    """
+    stamped = sizes >= HEADER.size
+    seqs = np.cumsum(stamped) - 1
+    epoch_ns = time.monotonic_ns() + lead_ns
+    jobs = [(addr, t_ns[k::workers], sizes[k::workers], epoch_ns, slack_ns,
+             max_dgram, stamp, seqs[k::workers][stamped[k::workers]].tolist())
+            for k in range(workers)]
+    with mp.Pool(workers) as pool:
+        return pool.starmap(replay_worker, jobs)
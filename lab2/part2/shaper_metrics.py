@@ -0,0 +1 @@
+../part3/shaper_metrics.py
\ No newline at end of file
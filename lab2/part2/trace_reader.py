@@ -0,0 +1,103 @@
+"""
+Readers of the Lab 2 traces, shared by Sender.py and the offline shaper
+simulator of part 3: poisson-lab2a.data, movietrace.data and
+BC-pAug89.TL, as (rel_ms, size) entries.
+"""
+import numpy as np
+
+from trace_cache import load_columns
+
+
+def parse_poisson(parts):
+    if len(parts) < 3:
+        return None
+    rel_ms = float(parts[1])
+    size = int(parts[2])
+    return rel_ms, size
+
+def parse_video(parts):
+    if len(parts) < 4:
+        return None
+    rel_ms = float(parts[1])
+    size = int(parts[3])
+    return rel_ms, size
+
+
+
+def parse_ethernet(parts):
+    if len(parts) >= 2:
+        rel_ms = float(parts[0]) * 1000.0 
+        size = int(parts[1])
+        return rel_ms, size
+    return None
+
+
+def parse_line(tracefile, line):
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+
+    parts = line.split()
+
+    # --- Part 2 ---
+    if tracefile.endswith("poisson-lab2a.data"):
+        return parse_poisson(parts)
+
+    # --- Part 3-c ---
+    if tracefile.endswith("movietrace.data"):
+        return parse_video(parts)
+
+    if tracefile.endswith("BC-pAug89.TL") or tracefile.endswith("BC-pAug89.TL.Z"):
+        return parse_ethernet(parts)
+
+    return parse_poisson(parts)
+
+
+def trace_columns(tracefile):
+    """
+    (time column, ms per time unit, size column) of the format parse_line
+    picks for `tracefile`.
+    """
+    if tracefile.endswith("movietrace.data"):
+        return 1, 1.0, 3
+    if tracefile.endswith("BC-pAug89.TL") or tracefile.endswith("BC-pAug89.TL.Z"):
+        return 0, 1000.0, 1
+    return 1, 1.0, 2
+
+
+def iter_trace(tracefile, limit=None):
+    """(rel_ms, size) of the first `limit` entries of the trace, in file order."""
+    n = 0
+    with open(tracefile, "r") as f:
+        for line in f:
+            parsed = parse_line(tracefile, line)
+            if parsed is None:
+                continue
+            yield parsed
+            n += 1
+            if limit is not None and n >= limit:
+                return
+
+
+def read_trace(tracefile, limit=None):
+    """
+    (rel_ms, size) arrays of the first `limit` entries of the trace, in file
+    order. The columns come from the binary trace cache; files it cannot
+    parse are read line by line with parse_line.
+    """
+    t_col, ms_per_unit, s_col = trace_columns(tracefile)
+    try:
+        columns = load_columns(tracefile)
+    except (OSError, ValueError, UnicodeDecodeError):  # ParserError is a ValueError
+        columns = None
+    if (columns is not None and len(columns) > max(t_col, s_col)
+            and columns[t_col].dtype.kind in "if"
+            and columns[s_col].dtype.kind in "if"):
+        rel_ms = columns[t_col] * ms_per_unit
+        size = columns[s_col]
+        ok = ~(np.isnan(rel_ms) | np.isnan(size))  # lines too short to parse
+        rel_ms, size = rel_ms[ok], size[ok].astype(np.int64)
+        return rel_ms[:limit], size[:limit]
+
+    rows = np.array(list(iter_trace(tracefile, limit)), dtype=float).reshape(-1, 2)
+    return rows[:, 0], rows[:, 1].astype(np.int64)
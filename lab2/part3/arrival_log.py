@@ -0,0 +1,156 @@
+import os
+import queue
+import struct
+import threading
+
+# Binary log: an 8-byte magic followed by fixed-width little-endian records
+#   elapsed_ns (int64) | pkt_len (int32) | backlog_bytes (int64) | tokens (float64)
+MAGIC = b"TBLOG1\0\0"
+RECORD = struct.Struct("<qiqd")
+DTYPE = [("elapsed_ns", "<i8"), ("len", "<i4"),
+         ("backlog", "<i8"), ("tokens", "<f8")]
+
+
+class TextArrivalLog:
+    """
+    Arrival log in the original text format, one line per packet:
+    elapsed_us <tab> pkt_len <tab> backlog_bytes <tab> tokens
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "w")
+
+    def append(self, elapsed_ns: int, pkt_len: int, backlog: int,
+               tokens: float):
+        """Record one arrival, `elapsed_ns` after the previous one."""
+        self.file.write(f"{elapsed_ns//1000}\t{pkt_len}\t{backlog}\t{tokens}\n")
+
+    def close(self):
+        self.file.close()
+
+
+class BinaryArrivalLog:
+    """
+    Arrival log of fixed-width binary records (see RECORD).
+
+    `append` packs a record into a preallocated buffer and does no I/O.
+    Full buffers are handed to a background thread that writes them out in
+    one call each, while the receiver carries on with a spare buffer. Only
+    one thread may call `append`. Records still in the active buffer are
+    written by `close`.
+    """
+
+    def __init__(self, path: str, records: int = 4096, buffers: int = 4):
+        """
+        :param path: path of the log file
+        :param records: records per buffer
+        :param buffers: number of buffers, in use or waiting to be written
+        """
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.free = queue.Queue()   # buffers ready to be filled
+        self.full = queue.Queue()   # (buffer, bytes used) waiting for the disk
+        for _ in range(buffers - 1):
+            self.free.put(bytearray(RECORD.size * records))
+        self.buf = bytearray(RECORD.size * records)
+        self.pos = 0
+        self.writer = threading.Thread(target=self.drain, daemon=True)
+        self.writer.start()
+
+    def append(self, elapsed_ns: int, pkt_len: int, backlog: int,
+               tokens: float):
+        """Record one arrival, `elapsed_ns` after the previous one."""
+        RECORD.pack_into(self.buf, self.pos, elapsed_ns, pkt_len, backlog,
+                         tokens)
+        self.pos += RECORD.size
+        if self.pos == len(self.buf):
+            self.rotate()
+
+    def rotate(self):
+        """Hand the active buffer to the writer and take a free one."""
+        self.full.put((self.buf, self.pos))
+        # Blocks only if the disk is `buffers` buffers behind
+        self.buf = self.free.get()
+        self.pos = 0
+
+    def drain(self):
+        """Writer thread: write full buffers until `close`."""
+        while True:
+            buf, used = self.full.get()
+            if buf is None:
+                return
+            self.file.write(memoryview(buf)[:used])
+            self.file.flush()
+            self.free.put(buf)
+
+    def close(self):
+        """Write out all records and close the file."""
+        if self.pos:
+            self.rotate()
+        self.full.put((None, 0))
+        self.writer.join()
+        self.file.close()
+
+
+def open_arrival_log(path: str, fmt: str = "text"):
+    """Arrival log writer for `fmt`, "text" or "binary"."""
+    if fmt == "binary":
+        return BinaryArrivalLog(path)
+    return TextArrivalLog(path)
+
+
+def write_arrival_log(path: str, fmt: str, elapsed_ns, pkt_len, backlog,
+                      tokens):
+    """
+    Write a whole arrival log at once from arrays of its columns, in `fmt`,
+    "text" or "binary", as the writers of open_arrival_log would.
+    """
+    import numpy as np
+    if fmt == "binary":
+        rec = np.empty(len(elapsed_ns), dtype=np.dtype(DTYPE))
+        rec["elapsed_ns"], rec["len"] = elapsed_ns, pkt_len
+        rec["backlog"], rec["tokens"] = backlog, tokens
+        with open(path, "wb") as f:
+            f.write(MAGIC)
+            f.write(rec.tobytes())
+        return
+    elapsed_us = np.asarray(elapsed_ns, dtype=np.int64) // 1000
+    with open(path, "w") as f:
+        f.write("".join(
+            f"{e}\t{n}\t{b}\t{t}\n" for e, n, b, t in
+            zip(elapsed_us.tolist(), np.asarray(pkt_len).tolist(),
+                np.asarray(backlog).tolist(), np.asarray(tokens).tolist())))
+
+
+def is_binary_log(path: str):
+    """Whether `path` is a binary arrival log."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_binary_log(path: str):
+    """Memory-map a binary arrival log as a NumPy structured array."""
+    import numpy as np
+    if os.path.getsize(path) <= len(MAGIC):
+        return np.zeros(0, dtype=DTYPE)  # memmap cannot map zero bytes
+    return np.memmap(path, dtype=np.dtype(DTYPE), mode="r",
+                     offset=len(MAGIC))
+
+
+def export_text(bin_path: str, txt_path: str):
+    """Convert a binary arrival log to the text format."""
+    out = TextArrivalLog(txt_path)
+    with open(bin_path, "rb") as f:
+        f.read(len(MAGIC))
+        data = f.read()
+    for rec in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+        out.append(*rec)
+    out.close()
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        print(f"Usage: {sys.argv[0]} <binary_log> <text_log>")
+        sys.exit(1)
+    export_text(sys.argv[1], sys.argv[2])
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Per-call cost and long-run drift of TokenBucket.
+
+`FloatTokenBucket` is the previous float implementation, kept here as the
+"before" reference.
+
+  python3 bench_bucket.py --calls 200000
+"""
+import argparse
+import threading
+import time
+import timeit
+from fractions import Fraction
+
+from token_bucket import TokenBucket
+
+
+class FloatTokenBucket:
+    """The float-seconds TokenBucket that TokenBucket replaced."""
+
+    def __init__(self, size: float, rate: float):
+        self.capacity = size
+        self.rate = rate
+        self.tokens = size
+        self.last = time.monotonic_ns()
+        self.lock = threading.Lock()
+
+    def updateNoTokens(self):
+        now = time.monotonic_ns()
+        dt_ns = now - self.last
+        if dt_ns <= 0:
+            return
+        self.tokens = min(self.capacity, self.tokens + self.rate * dt_ns / 1e9)
+        self.last = now
+
+    def getWaitingTime(self, target: float):
+        with self.lock:
+            self.updateNoTokens()
+            if self.tokens >= target:
+                return 0.0
+            return (target - self.tokens) / self.rate * 1000.0
+
+    def getNoTokens(self):
+        with self.lock:
+            self.updateNoTokens()
+            return self.tokens
+
+    def removeTokens(self, target: int):
+        with self.lock:
+            self.updateNoTokens()
+            if self.tokens >= target:
+                self.tokens -= target
+                return True
+            return False
+
+
+def per_call_ns(stmt, calls: int):
+    return min(timeit.repeat(stmt, number=calls, repeat=5)) / calls * 1e9
+
+
+def cost(calls: int):
+    print(f"{'call':>34} {'before':>9} {'after':>9}  (ns/call)")
+    old = FloatTokenBucket(10**12, 1)
+    new = TokenBucket(10**12, 1)
+    rows = [
+        ("getNoTokens()", lambda b: b.getNoTokens),
+        ("removeTokens(1000)", lambda b: lambda: b.removeTokens(1000)),
+        ("getWaitingTime(1000)", lambda b: lambda: b.getWaitingTime(1000)),
+    ]
+    for name, make in rows:
+        print(f"{name:>34} {per_call_ns(make(old), calls):>9.0f} "
+              f"{per_call_ns(make(new), calls):>9.0f}")
+
+    # A sender that is short of tokens: two calls before, one call after
+    old = FloatTokenBucket(0, 1)
+    new = TokenBucket(0, 1)
+    pair = per_call_ns(
+        lambda: old.removeTokens(1000) or old.getWaitingTime(1000), calls)
+    one = per_call_ns(lambda: new.removeTokensOrWait(1000), calls)
+    print(f"{'remove + wait / removeTokensOrWait':>34} {pair:>9.0f} {one:>9.0f}")
+
+
+def drift(steps: int):
+    """Refill and spend on a synthetic clock and compare to exact math."""
+    rate, size, spend, step_ns = 100_000, 10**9, 1003, 9_999_991
+    clock = [0]
+    # TokenBucket takes the clock; the float reference reads the module's
+    real_clock = time.monotonic_ns
+    time.monotonic_ns = lambda: clock[0]
+    try:
+        old = FloatTokenBucket(size, rate)
+        new = TokenBucket(size, rate, clock=lambda: clock[0])
+        for _ in range(steps):
+            clock[0] += step_ns
+            old.removeTokens(spend)
+            new.removeTokens(spend)
+        # the bucket starts full, so the first refill is discarded
+        exact = (size + Fraction(rate * step_ns * (steps - 1), 10**9)
+                 - spend * steps)
+        print(f"after {steps} refills: exact={float(exact)!r} "
+              f"before={old.getNoTokens()!r} after={new.getNoTokens()!r}")
+    finally:
+        time.monotonic_ns = real_clock
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="TokenBucket microbenchmark")
+    ap.add_argument("--calls", type=int, default=200_000)
+    ap.add_argument("--steps", type=int, default=1_000_000)
+    args = ap.parse_args()
+    cost(args.calls)
+    drift(args.steps)
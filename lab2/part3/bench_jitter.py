@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Release-time jitter of the threaded and asyncio shaper engines.
+
+The source offers fixed-size datagrams faster than the bucket rate, so the
+shaper is backlogged and should release one packet every size/rate seconds.
+The sink records departure times and we report how far the gaps between
+consecutive departures stray from that ideal spacing.
+
+  python3 bench_jitter.py --packets 2000 --size 1000 --rate 1000000
+"""
+import argparse
+import multiprocessing as mp
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+IN_PORT = 47003
+OUT_PORT = 47004
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_source(packets: int, size: int, rate: int):
+    """Offer `packets` datagrams at twice the bucket rate."""
+    src = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    payload = b"a" * size
+    gap = size / rate / 2
+    t0 = time.monotonic()
+    for i in range(packets):
+        # sleep rather than spin: the source must not steal the shaper's CPU
+        time.sleep(max(0.0, t0 + i * gap - time.monotonic()))
+        src.sendto(payload, ("127.0.0.1", IN_PORT))
+
+
+def measure(engine: str, packets: int, size: int, rate: int):
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+    sink.bind(("127.0.0.1", OUT_PORT))
+    sink.settimeout(1.0)
+
+    # Bucket of one packet, so every release waits for the bucket
+    shaper = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "token_bucket.py"),
+         str(IN_PORT), "127.0.0.1", str(OUT_PORT), str(size), str(rate),
+         "--max-packet-size", str(size), "--buffer-capacity", str(10**9),
+         "--logfile", os.devnull, "--engine", engine])
+    time.sleep(0.5)  # let the shaper bind its port
+
+    src = mp.Process(target=run_source, args=(packets, size, rate),
+                     daemon=True)
+    src.start()
+
+    times = []
+    buf = bytearray(65535)
+    try:
+        while True:
+            sink.recv_into(buf)
+            times.append(time.monotonic_ns())
+    except socket.timeout:
+        pass
+    src.join()
+    shaper.terminate()
+    shaper.wait()
+    sink.close()
+
+    gaps_us = np.diff(np.array(times[1:], dtype=np.int64)) / 1e3
+    error_us = np.abs(gaps_us - size / rate * 1e6)
+    return len(times), error_us
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Shaper release jitter")
+    ap.add_argument("--packets", type=int, default=2000)
+    ap.add_argument("--size", type=int, default=1000, help="Datagram size")
+    ap.add_argument("--rate", type=int, default=1_000_000,
+                    help="Bucket rate, in bytes/sec")
+    args = ap.parse_args()
+
+    print(f"ideal gap: {args.size / args.rate * 1e6:.1f} us")
+    print(f"{'engine':>9} {'recv':>6} {'mean':>8} {'p50':>8} {'p99':>8} "
+          f"{'max':>8}  (|gap - ideal|, us)")
+    for engine in ("threaded", "asyncio"):
+        received, err = measure(engine, args.packets, args.size, args.rate)
+        print(f"{engine:>9} {received:>6} {err.mean():>8.1f} "
+              f"{np.percentile(err, 50):>8.1f} {np.percentile(err, 99):>8.1f} "
+              f"{err.max():>8.1f}")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Trace loaders of plot.py against the line-by-line loaders they replaced.
+
+Synthetic video and Ethernet traces of growing size are written to a
+temporary directory, loaded both ways, checked for identical output and
+timed.
+
+  python3 bench_loaders.py --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from plot import load_eth_trace, load_video_trace
+
+
+def load_video_trace_ref(path, limit=None, max_dgram=1400):
+    """The previous load_video_trace."""
+    rows = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split()
+            if len(parts) < 4:
+                continue
+            t_ms = float(parts[1])
+            remaining = int(parts[3])
+            while remaining > 0:
+                chunk = min(remaining, max_dgram)
+                rows.append((t_ms, chunk))
+                remaining -= chunk
+            if limit is not None and len(rows) >= limit:
+                break
+    rows.sort(key=lambda x: x[0])
+    return (np.array([r[0] for r in rows]) / 1000.0,
+            np.array([r[1] for r in rows]))
+
+
+def load_eth_trace_ref(path, limit=None, max_dgram=1400):
+    """The previous load_eth_trace."""
+    rows = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split()
+            if len(parts) < 2:
+                continue
+            t_s = float(parts[0])
+            remaining = int(parts[1])
+            while remaining > 0:
+                chunk = min(remaining, max_dgram)
+                rows.append((t_s, chunk))
+                remaining -= chunk
+            if limit is not None and len(rows) >= limit:
+                break
+    rows.sort(key=lambda x: x[0])
+    return np.array([r[0] for r in rows]), np.array([r[1] for r in rows])
+
+
+def write_traces(tmp, n, rng):
+    """Video-like (display-order times) and Ethernet-like traces of n rows."""
+    video = os.path.join(tmp, f"video_{n}.data")
+    idx = np.arange(n)
+    # B frames are sent after the P frame they precede in display order
+    shown = idx + np.where(idx % 3 == 1, 2, np.where(idx % 3 == 0, 0, -1))
+    sizes = rng.integers(0, 20000, n)
+    with open(video, "w") as f:
+        f.writelines(f"{i}\t{s * 33.33333:.6f}\tP\t{b}\t0\t0\t0\n"
+                     for i, s, b in zip(idx, shown, sizes))
+    eth = os.path.join(tmp, f"eth_{n}.TL")
+    t = np.cumsum(rng.exponential(1e-3, n))
+    sizes = rng.integers(64, 1519, n)
+    with open(eth, "w") as f:
+        f.writelines(f"{a:.6f}\t{b}\n" for a, b in zip(t, sizes))
+    return video, eth
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return time.perf_counter() - t0, out
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Trace loader benchmark")
+    ap.add_argument("--sizes", type=int, nargs="+",
+                    default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--max-dgram", type=int, default=1400)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(466)
+    print(f"{'trace':>6} {'rows':>9} {'before (s)':>11} {'after (s)':>10} "
+          f"{'speedup':>8} {'same':>5}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            video, eth = write_traces(tmp, n, rng)
+            for name, path, ref, new in (
+                    ("video", video, load_video_trace_ref, load_video_trace),
+                    ("eth", eth, load_eth_trace_ref, load_eth_trace)):
+                for limit in (None, 1000):
+                    t_ref, (a_t, a_sz) = timed(ref, path, limit=limit,
+                                               max_dgram=args.max_dgram)
+                    t_new, (b_t, b_sz) = timed(new, path, limit=limit,
+                                               max_dgram=args.max_dgram)
+                    same = (np.array_equal(a_t, b_t)
+                            and np.array_equal(a_sz, b_sz))
+                    if limit is None:
+                        print(f"{name:>6} {n:>9} {t_ref:>11.3f} {t_new:>10.3f} "
+                              f"{t_ref / t_new:>7.1f}x {str(same):>5}")
+                    elif not same:
+                        print(f"{name:>6} {n:>9} limit={limit} output differs")
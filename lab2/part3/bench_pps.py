@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Packets-per-second benchmark of the token-bucket shaper I/O paths.
+
+A blaster process floods the shaper with fixed-size datagrams, the shaper
+runs in its own process with a bucket large and fast enough that every
+packet conforms, and this process counts what comes out the other side.
+
+  python3 bench_pps.py --packets 200000 --size 100
+"""
+import argparse
+import multiprocessing as mp
+import os
+import socket
+import time
+
+IN_PORT = 47001
+OUT_PORT = 47002
+
+
+def run_shaper(io: str, batch_size: int, logfile: str):
+    from token_bucket import TokenBucket
+    from byte_queue import ByteQueue
+    from bucket_sender import TokenBucketSender
+    from bucket_receiver import TokenBucketReceiver
+    from bucket_batch import BatchTokenBucketSender, BatchTokenBucketReceiver
+
+    rate = 10**12  # every packet conforms, we only measure the I/O path
+    buffer = ByteQueue(10_000_000)
+    bucket = TokenBucket(rate, rate)
+    dst = ("127.0.0.1", OUT_PORT)
+    if io == "batch":
+        sender = BatchTokenBucketSender(buffer, bucket, dst, batch_size)
+        receiver = BatchTokenBucketReceiver(sender, IN_PORT, 65535, logfile,
+                                            batch_size)
+    else:
+        sender = TokenBucketSender(buffer, bucket, dst)
+        receiver = TokenBucketReceiver(sender, IN_PORT, 65535, logfile)
+    sender.start()
+    receiver.start()
+    receiver.join()
+
+
+def run_blaster(packets: int, size: int):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    payload = b"a" * size
+    dst = ("127.0.0.1", IN_PORT)
+    for _ in range(packets):
+        sock.sendto(payload, dst)
+
+
+def measure(io: str, packets: int, size: int, batch_size: int):
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+    sink.bind(("127.0.0.1", OUT_PORT))
+    sink.settimeout(1.0)
+
+    logfile = os.devnull
+    shaper = mp.Process(target=run_shaper, args=(io, batch_size, logfile),
+                        daemon=True)
+    shaper.start()
+    time.sleep(0.5)  # let the shaper bind its port
+    blaster = mp.Process(target=run_blaster, args=(packets, size), daemon=True)
+    blaster.start()
+
+    received = 0
+    first = last = None
+    buf = bytearray(65535)
+    try:
+        while True:
+            sink.recv_into(buf)
+            last = time.monotonic()
+            if first is None:
+                first = last
+            received += 1
+    except socket.timeout:
+        pass
+    blaster.join()
+    shaper.terminate()
+    shaper.join()
+    sink.close()
+
+    duration = (last - first) if received > 1 else float("nan")
+    return received, received / duration
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Shaper pps benchmark")
+    ap.add_argument("--packets", type=int, default=200_000)
+    ap.add_argument("--size", type=int, default=100, help="Datagram size")
+    ap.add_argument("--batch-size", type=int, default=64)
+    args = ap.parse_args()
+
+    print(f"{'io':>8} {'received':>10} {'pps':>12}")
+    for io in ("packet", "batch"):
+        received, pps = measure(io, args.packets, args.size, args.batch_size)
+        print(f"{io:>8} {received:>10} {pps:>12.0f}")
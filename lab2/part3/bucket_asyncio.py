@@ -0,0 +1,137 @@
+import asyncio
+import selectors
+import time
+
+from arrival_log import open_arrival_log
+from shaper_metrics import ShaperMetrics
+
+
+class AsyncTokenBucketShaper(asyncio.DatagramProtocol):
+    """
+    Single-threaded token bucket shaper on an asyncio event loop.
+    It does the work of both TokenBucketReceiver and TokenBucketSender:
+    arrivals are handled in `datagram_received`, and the head-of-line packet
+    is released by a `loop.call_at` timer set exactly at the time the
+    bucket reports enough tokens for it. Everything runs on the loop thread,
+    so no thread handoff is involved.
+
+    Log format is the same as TokenBucketReceiver.
+    """
+
+    def __init__(self, queue, token_bucket, dst_addr, max_pkt_size: int,
+                 logfile: str, log_format: str = "text", metrics=None):
+        """
+        :param queue: ByteQueue (or RingByteQueue) for outgoing packets
+        :param token_bucket: the token bucket controlling send timing
+        :param dst_addr: the destination tuple for UDP sendto
+        :param max_pkt_size: maximum packet size allowed, in bytes
+        :param logfile: path to write arrival log
+        :param log_format: arrival log format, "text" or "binary"
+        :param metrics: ShaperMetrics to count into
+        """
+        self.queue = queue
+        self.bucket = token_bucket
+        self.dst_addr = dst_addr
+        self.max_pkt_size = max_pkt_size
+        self.log = open_arrival_log(logfile, log_format)
+        self.metrics = metrics if metrics is not None else ShaperMetrics()
+        self.loop = asyncio.get_running_loop()
+        self.out = None         # transport for sending packets
+        self.timer = None       # pending release of the head-of-line packet
+        self.lastTime = None    # last received time
+
+    def datagram_received(self, packet, addr):
+        now = time.monotonic_ns()
+        if self.lastTime is None:
+            self.lastTime = now  # put elapsed=zero in the first line
+        queue = self.queue
+        bucket = self.bucket
+
+        # collecting data for logging
+        elapsed = now - self.lastTime  # elasped time, in ns
+        packet_size = len(packet)      # packet size, in bytes
+        backlog = queue.backlog()      # current backlog, in bytes
+        tokens = bucket.getNoTokens()  # the number of tokens, in bytes
+        self.log.append(elapsed, packet_size, backlog, tokens)
+        self.lastTime = now
+        metrics = self.metrics
+        metrics.received.inc()
+        metrics.received_bytes.inc(packet_size)
+        metrics.arrival_backlog.record(backlog)
+        metrics.arrival_tokens.record(tokens)
+
+        if packet_size > self.max_pkt_size:
+            metrics.drop_oversize.inc()
+            return
+
+        # Nothing queued ahead of it and enough tokens: send right away
+        if queue.is_empty() and bucket.removeTokens(packet_size):
+            self.out.sendto(packet, self.dst_addr)
+            metrics.sent_immediate.inc()
+            metrics.sent_immediate_bytes.inc(packet_size)
+            return
+
+        if not queue.try_put(packet):
+            metrics.drop_full.inc()
+        elif self.timer is None:
+            self.schedule()
+
+    def schedule(self):
+        """Arm the timer for the moment the head packet conforms."""
+        packet = self.queue.peek()
+        wait_ms = self.bucket.getWaitingTime(len(packet))
+        self.timer = self.loop.call_at(self.loop.time() + wait_ms/1e3,
+                                       self.release)
+
+    def release(self):
+        """Send every conforming head-of-line packet, then re-arm."""
+        self.timer = None
+        queue = self.queue
+        metrics = self.metrics
+        metrics.wakeups.inc()
+        while (packet := queue.peek()) is not None:
+            wait_ms = self.bucket.removeTokensOrWait(len(packet))
+            if wait_ms:
+                self.timer = self.loop.call_at(self.loop.time() + wait_ms/1e3,
+                                               self.release)
+                return
+            self.out.sendto(packet, self.dst_addr)
+            queue.get()
+            metrics.sent_queued.inc()
+            metrics.sent_queued_bytes.inc(len(packet))
+
+
+async def serve(queue, token_bucket, in_port: int, dst_addr,
+                max_pkt_size: int, logfile: str, log_format: str = "text",
+                metrics=None):
+    """Run the asyncio shaper on `in_port` until cancelled."""
+    loop = asyncio.get_running_loop()
+    shaper = AsyncTokenBucketShaper(queue, token_bucket, dst_addr,
+                                    max_pkt_size, logfile, log_format, metrics)
+    try:
+        # outbound socket for sending packets, as in TokenBucketSender
+        shaper.out, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, local_addr=("0.0.0.0", 0))
+        await loop.create_datagram_endpoint(
+            lambda: shaper, local_addr=("0.0.0.0", in_port))
+        await asyncio.Event().wait()
+    finally:
+        shaper.log.close()
+
+
+def run(main):
+    """
+    Run coroutine `main` on a select()-based loop. epoll and poll take their
+    timeout in whole milliseconds, which would make every `call_at` release
+    up to 1 ms late; select() sleeps with microsecond resolution.
+    """
+    loop = asyncio.SelectorEventLoop(selectors.SelectSelector())
+    task = loop.create_task(main)
+    try:
+        loop.run_until_complete(task)
+    except (KeyboardInterrupt, SystemExit):
+        # Let `main` run its cleanup (e.g. flush the log) before exiting
+        task.cancel()
+        loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+    finally:
+        loop.close()
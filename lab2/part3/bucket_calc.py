@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Token-bucket settings for a trace, worked out analytically (network
+calculus) instead of by trial runs.
+
+The trace is read and split into datagrams as Sender.py does; datagrams
+larger than --max-packet-size are left out, as the shaper drops them.
+
+  - The empirical envelope E(w) is the most bytes the trace sends in any
+    window of w ns (both ends included).
+  - sigma(r), the smallest bucket size the trace passes through at rate r
+    without a datagram ever being queued, is the largest token deficit of
+    a bucket starting full: at each arrival the deficit left by the last
+    one drains at r and grows by the bytes that arrive. This is exact, in
+    the nano-tokens of TokenBucket, and is sup_w (E(w) - r w).
+  - A bucket of size b < sigma(r) queues up to sigma(r) - b bytes of
+    fluid, plus less than one datagram, since the queue holds whole
+    datagrams, and a datagram waits at most (sigma(r) - b) / r. With a
+    buffer smaller than that, datagrams may be dropped; the buffer then
+    bounds the backlog, and the delay by buffer / r.
+
+sigma(r) over a range of rates is the rate/size tradeoff curve: any
+(sigma(r), r) sends the trace unshaped, and smaller buckets trade delay
+for it. --check runs bucket_sweep.py on the curve and the bounds.
+
+  python3 bucket_calc.py movietrace.data --bucket-size 20000 \\
+      --bucket-rate 2000000 --buffer-capacity 200000 --out curve.tsv
+"""
+import argparse
+import time
+
+import numpy as np
+
+from bucket_sweep import grid_values, split_entries, sweep
+from replay import entry_schedule
+from token_bucket import NANO
+from trace_reader import read_trace
+
+UNBOUNDED = 1 << 50  # buffer capacity of a shaper that never drops
+
+
+def arrivals(t_ns, full, rem, max_dgram=1480):
+    """
+    Bytes arriving at each distinct time, from the entries of
+    bucket_sweep.split_entries.
+
+    :return: (t_ns, nbytes), times in increasing order
+    """
+    t_ns, first = np.unique(t_ns, return_index=True)
+    return t_ns, np.add.reduceat(full * max_dgram + rem, first)
+
+
+def max_deficit(t_ns, nbytes, rates):
+    """
+    Largest token deficit of a bucket with no size limit, starting full,
+    at each of `rates` (bytes/sec), in nano-tokens: sigma(r) * NANO.
+    The arrivals are walked once, for all rates at once.
+    """
+    rates = np.asarray(rates, dtype=np.int64)
+    idle = (1 << 62) // rates  # a longer gap drains any deficit there is
+    deficit = np.zeros(len(rates), dtype=np.int64)
+    worst = np.zeros(len(rates), dtype=np.int64)
+    last = int(t_ns[0]) if len(t_ns) else 0
+    for t, n in zip(t_ns.tolist(), nbytes.tolist()):
+        deficit = np.maximum(deficit - rates * np.minimum(t - last, idle),
+                             0) + n * NANO
+        np.maximum(worst, deficit, out=worst)
+        last = t
+    return worst
+
+
+def min_bucket_sizes(t_ns, nbytes, rates):
+    """sigma(r) for each of `rates`: the smallest bucket size, in bytes."""
+    return -(-max_deficit(t_ns, nbytes, rates) // NANO)
+
+
+def envelope(t_ns, nbytes, windows_ns):
+    """E(w) for each of `windows_ns`: most bytes in any window of w ns."""
+    cum = np.concatenate(([0], np.cumsum(nbytes)))
+    return np.array([(cum[1:] - cum[np.searchsorted(t_ns, t_ns - w)]).max()
+                     for w in np.asarray(windows_ns).tolist()],
+                    dtype=np.int64)
+
+
+def bounds(deficit, bucket_size, bucket_rate, buffer_capacity, largest):
+    """
+    Worst-case backlog (bytes) and delay (ns) of the shaper, from the
+    max_deficit at `bucket_rate` and the largest datagram.
+
+    :return: (backlog, delay_ns, lossless)
+    """
+    excess = deficit - bucket_size * NANO  # nano-tokens of fluid backlog
+    if excess <= 0:
+        return 0, 0, True
+    backlog = -(-excess // NANO) + largest - 1
+    if backlog <= buffer_capacity:
+        return backlog, -(-excess // bucket_rate), True
+    return buffer_capacity, -(-buffer_capacity * NANO // bucket_rate), False
+
+
+def check(t_ns, full, rem, rates, sizes, config, largest, max_dgram):
+    """
+    Run bucket_sweep.sweep at sigma(r) and sigma(r) - 1 for each rate, and
+    at `config` (size, rate, capacity); list of what does not hold.
+    """
+    n = len(rates)
+    result = sweep(t_ns, full, rem, np.concatenate((sizes, sizes - 1)),
+                   np.concatenate((rates, rates)), np.full(2 * n, UNBOUNDED),
+                   max_dgram)
+    failures = []
+    for i, (rate, size) in enumerate(zip(rates.tolist(), sizes.tolist())):
+        if result["immediate"][i] != result["sent"][i]:
+            failures.append(f"{size} bytes at {rate} bytes/sec queues")
+        if result["immediate"][n + i] == result["sent"][n + i]:
+            failures.append(f"{size - 1} bytes at {rate} bytes/sec does not queue")
+    if config is not None:
+        size, rate, capacity = config
+        result = sweep(t_ns, full, rem, [size], [rate], [capacity], max_dgram)
+        deficit = max_deficit(*arrivals(t_ns, full, rem, max_dgram), [rate])[0]
+        backlog, delay_ns, lossless = bounds(deficit, size, rate, capacity,
+                                             largest)
+        if result["max_backlog"][0] > backlog:
+            failures.append(f"backlog {result['max_backlog'][0]} > {backlog}")
+        if result["delay_max_ns"][0] > delay_ns:
+            failures.append(f"delay {result['delay_max_ns'][0]} ns > {delay_ns}")
+        if lossless and result["dropped"][0]:
+            failures.append(f"{result['dropped'][0]} datagrams dropped")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Arrival envelope, minimal bucket sizes and shaper "
+                    "bounds of a trace")
+    parser.add_argument("tracefile", help="Trace in a format Sender.py reads")
+    parser.add_argument("--rates", nargs="+", default=None,
+                        help="Token rates of the tradeoff curve, in bytes/sec "
+                             "(values or lo:hi:n; default --points rates from "
+                             "the mean rate to 32 times it)")
+    parser.add_argument("--points", type=int, default=25,
+                        help="Rates of the default curve, geometrically spaced")
+    parser.add_argument("--bucket-size", type=int, default=None,
+                        help="Token bucket size to bound, in bytes")
+    parser.add_argument("--bucket-rate", type=int, default=None,
+                        help="Token rate to bound, in bytes/sec")
+    parser.add_argument("--buffer-capacity", type=int, default=200_000,
+                        help="Buffer capacity to bound, in bytes")
+    parser.add_argument("--max-packet-size", type=int, default=1480,
+                        help="Maximum UDP packet size, in bytes")
+    parser.add_argument("--max-dgram", type=int, default=1480,
+                        help="Split trace entries into datagrams of this many "
+                             "bytes, as Sender.py --max-dgram")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Limit number of trace entries")
+    parser.add_argument("--out", type=str, default=None,
+                        help="Write the tradeoff curve, tab-separated, to "
+                             "this file")
+    parser.add_argument("--envelope", type=str, default=None,
+                        help="Write the envelope, tab-separated, to this file")
+    parser.add_argument("--check", action="store_true",
+                        help="Simulate the curve and the bounds with "
+                             "bucket_sweep.py")
+    args = parser.parse_args()
+    if (args.bucket_size is None) != (args.bucket_rate is None):
+        parser.error("--bucket-size and --bucket-rate go together")
+
+    rel_ms, size = read_trace(args.tracefile, args.limit)
+    t_entry, full, rem, oversize = split_entries(
+        *entry_schedule(rel_ms, size), args.max_dgram, args.max_packet_size)
+    if not len(t_entry):
+        parser.error("trace file empty or unreadable")
+    t_ns, nbytes = arrivals(t_entry, full, rem, args.max_dgram)
+    largest = args.max_dgram if full.any() else int(rem.max())
+    span_ns = int(t_ns[-1] - t_ns[0])
+    total = int(nbytes.sum())
+    mean_rate = total * NANO // span_ns if span_ns else total
+
+    if args.rates:
+        rates = sorted({v for text in args.rates for v in grid_values(text)})
+    else:
+        rates = np.unique(np.geomspace(max(mean_rate, 1), 32 * max(mean_rate, 1),
+                                       args.points).round().astype(np.int64))
+    rates = np.asarray(rates, dtype=np.int64)
+    if (rates <= 0).any():
+        parser.error("rates must be positive")
+
+    started = time.perf_counter()
+    sizes = min_bucket_sizes(t_ns, nbytes, rates)
+    elapsed = time.perf_counter() - started
+
+    print(f"Datagrams: {int(full.sum() + (rem > 0).sum())} in {len(t_ns)} "
+          f"arrivals, {total} bytes over {span_ns / NANO:.1f} s (mean rate "
+          f"{mean_rate} bytes/sec), largest {largest} bytes"
+          + (f", {oversize} too large left out" if oversize else ""))
+    print(f"Smallest bucket sending every datagram on arrival "
+          f"({elapsed:.2f} s):")
+    print(f"  {'rate (bytes/sec)':>18} {'bucket (bytes)':>15}")
+    for rate, b in zip(rates.tolist(), sizes.tolist()):
+        print(f"  {rate:>18} {b:>15}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write("bucket_rate\tbucket_size\n")
+            f.write("".join(f"{r}\t{b}\n" for r, b in
+                            zip(rates.tolist(), sizes.tolist())))
+
+    if args.envelope:
+        gaps = np.diff(t_ns)
+        shortest = int(gaps.min()) if len(gaps) else 1
+        windows = np.unique(np.concatenate(([0], np.geomspace(
+            shortest, max(span_ns, shortest), 100).round().astype(np.int64))))
+        with open(args.envelope, "w") as f:
+            f.write("window_ns\tmax_bytes\n")
+            f.write("".join(f"{w}\t{e}\n" for w, e in zip(
+                windows.tolist(), envelope(t_ns, nbytes, windows).tolist())))
+
+    config = None
+    if args.bucket_size is not None:
+        config = (args.bucket_size, args.bucket_rate, args.buffer_capacity)
+        if args.bucket_rate <= 0:
+            parser.error("bucket rate must be positive")
+        deficit = max_deficit(t_ns, nbytes, [args.bucket_rate])[0]
+        backlog, delay_ns, lossless = bounds(deficit, *config, largest)
+        print(f"A {args.bucket_size}-byte bucket at {args.bucket_rate} "
+              f"bytes/sec (smallest {-(-deficit // NANO)} bytes) with a "
+              f"{args.buffer_capacity}-byte buffer:")
+        print(f"  backlog <= {backlog} bytes, delay <= {delay_ns / 1e6:.3f} ms, "
+              + ("no datagram dropped" if lossless else
+                 "datagrams may be dropped (the buffer is below the backlog "
+                 "bound)"))
+        if args.bucket_size < largest:
+            print(f"  the bucket is smaller than the largest datagram "
+                  f"({largest} bytes), which would never be sent")
+
+    if args.check:
+        failures = check(t_entry, full, rem, rates, sizes, config, largest,
+                         args.max_dgram)
+        for failure in failures:
+            print(f"Check failed: {failure}")
+        print(f"Matches bucket_sweep.py: {not failures}")
+        if failures:
+            raise SystemExit(1)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+A HierarchicalTokenBucket tree under saturating load, on virtual time.
+
+One root and a leaf per --child, each leaf always backlogged with packets
+of --packet-size bytes. At every instant the leaves take turns sending one
+packet each, starting one leaf further on than the instant before, until
+none conforms, then the virtual clock jumps to the
+earliest time one does (removeTokensOrWait). Runs are deterministic, so
+the properties of the tree are checked exactly:
+
+  - the tree never sends faster than the root rate: the departures of all
+    leaves together fit the root bucket, in no window of w ns are more
+    than root_size + root_rate * w bytes sent;
+  - the departures of each leaf with a ceil fit its ceil bucket;
+  - if the assured rates add up to at most the root rate and the root
+    size is at least the sizes of the leaves plus a packet, each leaf
+    sends at least its assured rate over the run, less one packet.
+
+Bucket fits are worked out with bucket_calc.max_deficit. The run exits
+with status 1 if any property does not hold.
+
+  python3 bucket_htb_sim.py 20000 2000000 --child 5000 500000 \\
+      --child 5000 1000000 --child 5000 250000:8000:1500000 --seconds 10
+"""
+import argparse
+import math
+
+import numpy as np
+
+from bucket_calc import max_deficit
+from bucket_sim import VirtualClock
+from token_bucket import NANO, HierarchicalTokenBucket
+
+
+def parse_child(size: str, spec: str):
+    """(size, rate, ceil_size, ceil_rate) from SIZE and RATE[:CSIZE:CRATE]."""
+    fields = [int(v) for v in spec.split(":")]
+    if len(fields) == 1:
+        return int(size), fields[0], None, None
+    if len(fields) == 3:
+        return (int(size), *fields)
+    raise ValueError(f"expected RATE or RATE:CEIL_SIZE:CEIL_RATE, got {spec!r}")
+
+
+def simulate(root_size: int, root_rate: int, children, packet_size: int,
+             duration_ns: int):
+    """
+    Send from every leaf of the tree as fast as it conforms, for
+    `duration_ns` of virtual time.
+
+    :param children: (size, rate, ceil_size, ceil_rate) of each leaf
+    :return: the departure times (ns) of each leaf, as int64 arrays
+    """
+    clock = VirtualClock(0)
+    root = HierarchicalTokenBucket(root_size, root_rate, clock=clock)
+    leaves = [HierarchicalTokenBucket(size, rate, root, ceil_size, ceil_rate)
+              for size, rate, ceil_size, ceil_rate in children]
+    departures = [[] for _ in leaves]
+    order = list(range(len(leaves)))
+    while clock.now <= duration_ns:
+        sent = True
+        while sent:
+            sent, wait_ms = False, math.inf
+            for k in order:
+                leaf, times = leaves[k], departures[k]
+                w = leaf.removeTokensOrWait(packet_size)
+                if w == 0.0:
+                    times.append(clock.now)
+                    sent = True
+                else:
+                    wait_ms = min(wait_ms, w)
+        if wait_ms == math.inf:
+            break
+        order = order[1:] + order[:1]
+        clock.now += max(math.ceil(wait_ms * 1e6), 1)
+    return [np.array(times, dtype=np.int64) for times in departures]
+
+
+def fits(t_ns, packet_size: int, size: int, rate: int):
+    """Whether departures at `t_ns` (ns, ascending) fit a (size, rate) bucket."""
+    if not len(t_ns):
+        return True
+    nbytes = np.full(len(t_ns), packet_size, dtype=np.int64)
+    return bool(max_deficit(t_ns, nbytes, [rate])[0] <= size * NANO)
+
+
+def assured(root_size, root_rate, children, packet_size):
+    """Whether the tree guarantees the leaves their assured rates."""
+    return (sum(rate for _, rate, _, _ in children) <= root_rate
+            and sum(size for size, _, _, _ in children) + packet_size
+            <= root_size)
+
+
+def check(root_size, root_rate, children, packet_size, duration_ns,
+          departures):
+    """List of the properties of the module docstring that do not hold."""
+    failures = []
+    everything = np.sort(np.concatenate(departures))
+    if not fits(everything, packet_size, root_size, root_rate):
+        failures.append(f"the tree sends faster than the root bucket "
+                        f"({root_size} bytes, {root_rate} bytes/sec)")
+    guaranteed = assured(root_size, root_rate, children, packet_size)
+    for k, ((size, rate, ceil_size, ceil_rate), t_ns) in enumerate(
+            zip(children, departures)):
+        if ceil_size is not None and not fits(t_ns, packet_size, ceil_size,
+                                              ceil_rate):
+            failures.append(f"child {k} sends more than its ceil")
+        sent = len(t_ns) * packet_size
+        if guaranteed and sent * NANO < rate * duration_ns - packet_size * NANO:
+            failures.append(f"child {k} sent {sent} bytes, below its assured "
+                            f"{rate * duration_ns // NANO}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Hierarchical token buckets under saturating load, "
+                    "simulated on virtual time")
+    parser.add_argument("root_size", type=int, help="Root bucket size, in bytes")
+    parser.add_argument("root_rate", type=int,
+                        help="Root token rate, in bytes/sec")
+    parser.add_argument("--child", nargs=2, action="append", required=True,
+                        metavar=("SIZE", "RATE[:CEIL_SIZE:CEIL_RATE]"),
+                        help="A leaf under the root with its assured bucket "
+                             "and optional ceil, in bytes and bytes/sec")
+    parser.add_argument("--packet-size", type=int, default=1000,
+                        help="Size of every packet, in bytes")
+    parser.add_argument("--seconds", type=float, default=10.0,
+                        help="Virtual time to run for, in seconds")
+    args = parser.parse_args()
+
+    try:
+        children = [parse_child(*child) for child in args.child]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.root_rate <= 0 or any(rate <= 0 for _, rate, _, _ in children):
+        parser.error("rates must be positive")
+    duration_ns = int(args.seconds * NANO)
+
+    departures = simulate(args.root_size, args.root_rate, children,
+                          args.packet_size, duration_ns)
+    span_s = duration_ns / NANO
+    total = sum(len(t) for t in departures) * args.packet_size
+    print(f"Root: {total} bytes in {span_s:g} s ({total / span_s:,.0f} "
+          f"bytes/sec of {args.root_rate:,})")
+    for k, ((size, rate, ceil_size, ceil_rate), t_ns) in enumerate(
+            zip(children, departures)):
+        sent = len(t_ns) * args.packet_size
+        ceil = f", ceil {ceil_rate:,}" if ceil_size is not None else ""
+        print(f"  child {k}: {sent} bytes ({sent / span_s:,.0f} bytes/sec; "
+              f"assured {rate:,}{ceil})")
+
+    if not assured(args.root_size, args.root_rate, children,
+                   args.packet_size):
+        print("The root cannot guarantee the assured rates (they add up to "
+              "more than its rate, or the leaves to more than its size); they "
+              "are not checked")
+    failures = check(args.root_size, args.root_rate, children,
+                     args.packet_size, duration_ns, departures)
+    for failure in failures:
+        print(f"Check failed: {failure}")
+    print(f"Rate limits and assured rates hold: {not failures}")
+    if failures:
+        raise SystemExit(1)
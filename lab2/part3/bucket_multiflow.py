@@ -0,0 +1,227 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from shaper_metrics import ShaperMetrics
+
+
+# ---------------- Flow keys ----------------
+# A flow key maps a datagram and its source address to a hashable flow id.
+def key_source(packet, addr):
+    """One flow per source (address, port)."""
+    return addr
+
+
+def key_host(packet, addr):
+    """One flow per source address, whatever the port."""
+    return addr[0]
+
+
+def key_payload_prefix(n: int):
+    """One flow per value of the first `n` payload bytes."""
+    def key(packet, addr):
+        return packet[:n]
+    return key
+
+
+def parse_flow_key(spec: str):
+    """Flow key from its CLI name: `src`, `host` or `prefix:N`."""
+    if spec == "src":
+        return key_source
+    if spec == "host":
+        return key_host
+    if spec.startswith("prefix:"):
+        return key_payload_prefix(int(spec.split(":", 1)[1]))
+    raise ValueError(f"unknown flow key {spec!r}")
+
+
+class Flow:
+    """Per-flow shaping state: its own token bucket and packet queue."""
+
+    __slots__ = ("key", "queue", "bucket", "last_seen", "scheduled")
+
+    def __init__(self, key, queue, bucket, now: float):
+        self.key = key
+        self.queue = queue         # ByteQueue of this flow
+        self.bucket = bucket       # TokenBucket of this flow
+        self.last_seen = now       # last arrival, in loop time (seconds)
+        self.scheduled = False     # whether the flow has an entry in the heap
+
+
+class MultiFlowShaper(asyncio.DatagramProtocol):
+    """
+    Shapes many flows arriving on one port, on one asyncio loop.
+
+    Each datagram is classified with `flow_key`. Flows are created lazily
+    on their first packet, each with its own bucket and queue from the
+    `make_bucket`/`make_queue` factories, and evicted once they have been
+    idle (empty queue, no arrival) for `idle_timeout` seconds.
+
+    Backlogged flows sit in a heap ordered by the time their head packet
+    conforms. A single timer is armed for the earliest entry; when it fires,
+    every due flow releases its conforming packets and is pushed back with
+    its next deadline. The cost per release is O(log flows), independent of
+    how many flows are idle. A due flow that still cannot send is pushed
+    back with its own next deadline and the others are served regardless,
+    so one starved flow never stalls the rest. Flows may be children of a
+    shared HierarchicalTokenBucket: the deadline of a flow that has to
+    borrow already waits for the parent it borrows from, while its
+    siblings keep sending on their own tokens.
+
+    Log format is that of TokenBucketReceiver with the flow key appended:
+    elapsed_us <tab> pkt_len <tab> backlog_bytes <tab> tokens <tab> flow
+    """
+
+    def __init__(self, make_queue, make_bucket, dst_addr, max_pkt_size: int,
+                 logfile: str, flow_key=key_source, idle_timeout: float = 30.0,
+                 metrics=None):
+        """
+        :param make_queue: factory of an empty ByteQueue for a new flow
+        :param make_bucket: factory of a full TokenBucket for a new flow
+        :param dst_addr: the destination tuple for UDP sendto
+        :param max_pkt_size: maximum packet size allowed, in bytes
+        :param logfile: path to write arrival log
+        :param flow_key: function (packet, addr) -> flow id
+        :param idle_timeout: idle time before a flow is evicted, in seconds
+        :param metrics: ShaperMetrics to count into, for all flows together
+        """
+        self.make_queue = make_queue
+        self.make_bucket = make_bucket
+        self.dst_addr = dst_addr
+        self.max_pkt_size = max_pkt_size
+        self.log = open(logfile, "w")
+        self.flow_key = flow_key
+        self.idle_timeout = idle_timeout
+        self.metrics = metrics if metrics is not None else ShaperMetrics()
+        self.metrics.registry.gauge("shaper_flows", "Flows with shaping state",
+                                    lambda: len(self.flows))
+        self.loop = asyncio.get_running_loop()
+        self.out = None           # transport for sending packets
+        self.flows = {}           # flow id -> Flow
+        self.heap = []            # (deadline, tiebreak, Flow) of backlogged flows
+        self.seq = itertools.count()  # heap tiebreak, keeps FIFO among equals
+        self.timer = None         # timer armed for the earliest deadline
+        self.timer_at = None      # loop time the timer fires at
+        self.lastTime = None      # last received time
+        self.loop.call_later(idle_timeout, self.evict)
+
+    def datagram_received(self, packet, addr):
+        now = time.monotonic_ns()
+        if self.lastTime is None:
+            self.lastTime = now  # put elapsed=zero in the first line
+
+        key = self.flow_key(packet, addr)
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = self.flows[key] = Flow(key, self.make_queue(),
+                                          self.make_bucket(), self.loop.time())
+        flow.last_seen = self.loop.time()
+        queue = flow.queue
+        bucket = flow.bucket
+
+        # collecting data for logging
+        elapsed = (now - self.lastTime)//1000  # elasped time, in us
+        packet_size = len(packet)              # packet size, in bytes
+        backlog = queue.backlog()              # flow backlog, in bytes
+        tokens = bucket.getNoTokens()          # flow tokens, in bytes
+        self.log.write(f"{elapsed}\t{packet_size}\t{backlog}\t{tokens}\t{key}\n")
+        self.lastTime = now
+        metrics = self.metrics
+        metrics.received.inc()
+        metrics.received_bytes.inc(packet_size)
+        metrics.arrival_backlog.record(backlog)
+        metrics.arrival_tokens.record(tokens)
+
+        if packet_size > self.max_pkt_size:
+            metrics.drop_oversize.inc()
+            return
+
+        # Nothing queued ahead of it in its flow and enough tokens
+        if queue.is_empty() and bucket.removeTokens(packet_size):
+            self.out.sendto(packet, self.dst_addr)
+            metrics.sent_immediate.inc()
+            metrics.sent_immediate_bytes.inc(packet_size)
+            return
+
+        if not queue.try_put(packet):
+            metrics.drop_full.inc()
+        elif not flow.scheduled:
+            self.schedule(flow)
+            self.arm()
+
+    def schedule(self, flow):
+        """Push `flow` with the time its head packet conforms, returned."""
+        wait_ms = flow.bucket.getWaitingTime(len(flow.queue.peek()))
+        deadline = self.loop.time() + wait_ms/1e3
+        heapq.heappush(self.heap, (deadline, next(self.seq), flow))
+        flow.scheduled = True
+        return deadline
+
+    def arm(self):
+        """Make sure the timer fires at the earliest deadline in the heap."""
+        if not self.heap:
+            return
+        when = self.heap[0][0]
+        if self.timer is not None:
+            if self.timer_at <= when:
+                return
+            self.timer.cancel()
+        self.timer = self.loop.call_at(when, self.release)
+        self.timer_at = when
+
+    def release(self):
+        """Serve every flow whose deadline has passed, then re-arm."""
+        self.timer = None
+        heap = self.heap
+        metrics = self.metrics
+        metrics.wakeups.inc()
+        # the loop may run the timer up to its clock resolution early
+        now = max(self.loop.time(), self.timer_at)
+        due = []
+        while heap and heap[0][0] <= now:
+            due.append(heapq.heappop(heap)[2])
+        for flow in due:
+            flow.scheduled = False
+            queue = flow.queue
+            while (packet := queue.peek()) is not None:
+                if not flow.bucket.removeTokens(len(packet)):
+                    break
+                self.out.sendto(packet, self.dst_addr)
+                queue.get()
+                metrics.sent_queued.inc()
+                metrics.sent_queued_bytes.inc(len(packet))
+            if not queue.is_empty():
+                # its own deadline, later than now, so it is not retried
+                # before the other due flows have had their turn
+                self.schedule(flow)
+        self.arm()
+
+    def evict(self):
+        """Drop the state of flows idle for longer than `idle_timeout`."""
+        cutoff = self.loop.time() - self.idle_timeout
+        idle = [key for key, flow in self.flows.items()
+                if not flow.scheduled and flow.last_seen < cutoff]
+        for key in idle:
+            flow = self.flows.pop(key)
+            detach = getattr(flow.bucket, "detach", None)
+            if detach is not None:  # a leaf of a shared tree
+                detach()
+        self.loop.call_later(self.idle_timeout, self.evict)
+
+
+async def serve(make_queue, make_bucket, in_port: int, dst_addr,
+                max_pkt_size: int, logfile: str, flow_key=key_source,
+                idle_timeout: float = 30.0, metrics=None):
+    """Run the multi-flow shaper on `in_port` until cancelled."""
+    loop = asyncio.get_running_loop()
+    shaper = MultiFlowShaper(make_queue, make_bucket, dst_addr, max_pkt_size,
+                             logfile, flow_key, idle_timeout, metrics)
+    try:
+        shaper.out, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, local_addr=("0.0.0.0", 0))
+        await loop.create_datagram_endpoint(
+            lambda: shaper, local_addr=("0.0.0.0", in_port))
+        await asyncio.Event().wait()
+    finally:
+        shaper.log.close()
@@ -2,34 +2,60 @@ import threading
 import time
 import socket
 
+from arrival_log import open_arrival_log
+
 
 class TokenBucketReceiver (threading.Thread):
     """
     This thread listens on specified `port` for incoming packets and enqueues
     them. For each packet, it logs the arrival time, packet size, backlog,
-    and token count.
+    and token count. Drops are only counted, in the sender's ShaperMetrics
+    (see DropReporter).
 
-    Log format
+    Log format (text, see arrival_log.py for the binary format)
     =
     elapsed_us <tab> pkt_len <tab> backlog_bytes <tab> tokens
     """
 
-    def __init__(self, sender, port: int, max_pkt_size: int, logfile: str):
+    def __init__(self, sender, port: int, max_pkt_size: int, logfile: str,
+                 log_format: str = "text"):
         """
         :param sender: token bucket sender
         :param port: UDP port to bind for input
         :param max_pkt_size: maximum packet size allowed, in bytes
         :param logfile: path to write arrival log
+        :param log_format: arrival log format, "text" or "binary"
         """
         super().__init__(daemon=True)
         self.sender = sender              # sender
         self.port = port                  # listening port number
         self.max_pkt_size = max_pkt_size  # maximum packet size, in bytes
-        self.log = open(logfile, "w")     # log file for packet arrival
+        # log for packet arrival
+        self.log = open_arrival_log(logfile, log_format)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("", port))
+        self.stopping = False  # set by `close`, checked after each receive
+
+    def close(self):
+        """
+        Stop the receive loop, wait for it to return, then close the log
+        and the socket, so no arrival is logged into a closed log.
+        """
+        self.stopping = True
+        if self.is_alive():
+            try:
+                self.sock.shutdown(socket.SHUT_RD)  # wakes recv on Linux
+            except OSError:
+                pass
+            # and a datagram for where shutdown does not wake it
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as wake:
+                wake.sendto(b"", ("127.0.0.1", self.port))
+            self.join()
+        self.log.close()
+        self.sock.close()
 
     def run(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(("", self.port))
+        sock = self.sock
 
         # Grab `sender` members here so we can avoid pervasive `self.sender.*`
         dst_addr = self.sender.dst_addr   # destination address
@@ -37,29 +63,34 @@ class TokenBucketReceiver (threading.Thread):
         bucket = self.sender.bucket       # shared token bucket
         snd_socket = self.sender.sock     # socket for sending packets
         snd_lock = self.sender.sock_lock  # mutex lock for `snd_socket`
+        metrics = self.sender.metrics     # shared ShaperMetrics
 
-        noDropped = 0    # the total number of dropped packets
         lastTime = None  # last received time
         while True:
             packet, _ = sock.recvfrom(65535)
+            if self.stopping:
+                return
             now = time.monotonic_ns()
             if lastTime is None:
                 lastTime = now  # put elapsed=zero in the first line
 
             # collecting data for logging
-            elapsed = (now - lastTime)//1000  # elasped time, in us
+            elapsed = now - lastTime       # elasped time, in ns
             packet_size = len(packet)      # packet size, in bytes
             backlog = queue.backlog()      # current backlog, in bytes
             tokens = bucket.getNoTokens()  # the number of tokens, in bytes
             # Record arrival:
-            self.log.write(f"{elapsed}\t{packet_size}\t{backlog}\t{tokens}\n")
+            self.log.append(elapsed, packet_size, backlog, tokens)
+            metrics.received.inc()
+            metrics.received_bytes.inc(packet_size)
+            metrics.arrival_backlog.record(backlog)
+            metrics.arrival_tokens.record(tokens)
 
             lastTime = now  # update last received time
 
             # Check packet size first
             if packet_size > self.max_pkt_size:
-                noDropped = 0
-                print("Packet too large, dropped, total:", noDropped)
+                metrics.drop_oversize.inc()
                 continue
 
             # If buffer is empty, no packet is currently being sent, and there
@@ -70,16 +101,93 @@ class TokenBucketReceiver (threading.Thread):
             # `snd_lock` because the receiver (`self`) is the only thread that
             # enqueues packets. So it is impossible for `queue` to become
             # non-empty while checking the other two conditions.
-            if queue.is_empty() and snd_lock.acquire(blocking=False):
-                try:
-                    if bucket.removeTokens(packet_size):
-                        snd_socket.sendto(packet, dst_addr)
-                        continue  # packet sent, go to the next loop
-                finally:
-                    # Don't forget to release the lock
-                    snd_lock.release()
+            if queue.is_empty():
+                if snd_lock.acquire(blocking=False):
+                    try:
+                        if bucket.removeTokens(packet_size):
+                            snd_socket.sendto(packet, dst_addr)
+                            metrics.sent_immediate.inc()
+                            metrics.sent_immediate_bytes.inc(packet_size)
+                            continue  # packet sent, go to the next loop
+                    finally:
+                        # Don't forget to release the lock
+                        snd_lock.release()
+                else:
+                    metrics.contended.inc()
 
             # `packet` is not sent, try adding it to the queue
             if not queue.try_put(packet):
-                noDropped += 1
-                print("Buffer is full, dropped, total:", noDropped)
+                metrics.drop_full.inc()
+
+
+class RingTokenBucketReceiver(TokenBucketReceiver):
+    """
+    Receiver for a RingByteQueue: each datagram is received straight into a
+    slot reserved in the queue's arena, so a queued packet is never copied
+    and no per-packet buffer is allocated. Log format is unchanged.
+    """
+
+    def run(self):
+        sock = self.sock
+
+        dst_addr = self.sender.dst_addr   # destination address
+        queue = self.sender.queue         # shared RingByteQueue
+        bucket = self.sender.bucket       # shared token bucket
+        snd_socket = self.sender.sock     # socket for sending packets
+        snd_lock = self.sender.sock_lock  # mutex lock for `snd_socket`
+        metrics = self.sender.metrics     # shared ShaperMetrics
+        # Used when the arena has no free slot; the packet is copied then.
+        scratch = memoryview(bytearray(queue.max_pkt_size))
+        # MSG_TRUNC makes recv_into report the real size of a datagram that
+        # is larger than the slot, so oversize packets are still detected.
+        trunc = getattr(socket, "MSG_TRUNC", 0)
+
+        lastTime = None  # last received time
+        while True:
+            slot = queue.reserve()
+            buf = scratch if slot is None else slot
+            packet_size = sock.recv_into(buf, 0, trunc)
+            if self.stopping:
+                return
+            now = time.monotonic_ns()
+            if lastTime is None:
+                lastTime = now  # put elapsed=zero in the first line
+
+            # collecting data for logging
+            elapsed = now - lastTime       # elasped time, in ns
+            backlog = queue.backlog()      # current backlog, in bytes
+            tokens = bucket.getNoTokens()  # the number of tokens, in bytes
+            # Record arrival:
+            self.log.append(elapsed, packet_size, backlog, tokens)
+            metrics.received.inc()
+            metrics.received_bytes.inc(packet_size)
+            metrics.arrival_backlog.record(backlog)
+            metrics.arrival_tokens.record(tokens)
+
+            lastTime = now  # update last received time
+
+            # Check packet size first
+            if packet_size > self.max_pkt_size:
+                metrics.drop_oversize.inc()
+                continue
+            packet = buf[:packet_size]
+
+            # Immediate path, see TokenBucketReceiver.run
+            if queue.is_empty():
+                if snd_lock.acquire(blocking=False):
+                    try:
+                        if bucket.removeTokens(packet_size):
+                            snd_socket.sendto(packet, dst_addr)
+                            metrics.sent_immediate.inc()
+                            metrics.sent_immediate_bytes.inc(packet_size)
+                            continue  # packet sent, the slot is reused
+                    finally:
+                        snd_lock.release()
+                else:
+                    metrics.contended.inc()
+
+            # `packet` is not sent, keep it in its slot or copy it in
+            queued = (queue.try_put(packet) if slot is None
+                      else queue.commit(packet_size))
+            if not queued:
+                metrics.drop_full.inc()
@@ -2,6 +2,8 @@ import threading
 import time
 import socket
 
+from shaper_metrics import ShaperMetrics
+
 
 class TokenBucketSender(threading.Thread):
     """
@@ -9,15 +11,17 @@ class TokenBucketSender(threading.Thread):
     Packets are sent only when there are enough tokens in the `token_bucket`.
     """
 
-    def __init__(self, queue, token_bucket, dst_addr):
+    def __init__(self, queue, token_bucket, dst_addr, metrics=None):
         """
         :param queue: shared ByteQueue for outgoing packets
         :param token_bucket: the token bucket controlling send timing
         :param dst_addr: the destination tuple for UDP sendto
+        :param metrics: ShaperMetrics shared with the receiver
         """
         super().__init__(daemon=True)
         self.queue = queue
         self.bucket = token_bucket
+        self.metrics = metrics if metrics is not None else ShaperMetrics()
         self.dst_addr: socket._Address = dst_addr  # destination address
         # outbound socket for sending packets
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -25,22 +29,27 @@ class TokenBucketSender(threading.Thread):
         self.sock_lock = threading.Lock()
 
     def run(self):
+        metrics = self.metrics
         while True:
             # If buffer is non-empty, get the first packet without removing it
             if packet := self.queue.peek():
-                # There is a packet. If we have enough tokens, `remove` will
-                # succeed, and we can send the packet right away.
-                packet_size = len(packet)
-                if self.bucket.removeTokens(packet_size):
-                    self.queue.get()
+                # There is a packet. If we have enough tokens, they are
+                # removed and we can send the packet right away. Otherwise we
+                # get the expected time when there will be enough tokens.
+                wait_ms = self.bucket.removeTokensOrWait(len(packet))
+                if not wait_ms:
+                    # Send before dequeuing: a RingByteQueue may reuse the
+                    # packet's slot as soon as it is removed.
                     with self.sock_lock:
                         self.sock.sendto(packet, self.dst_addr)
+                        self.queue.get()
+                    metrics.sent_queued.inc()
+                    metrics.sent_queued_bytes.inc(len(packet))
                 else:
-                    # We have insufficient tokens.
-                    # Get expected time when there will be enough tokens,
-                    wait_s: float = self.bucket.getWaitingTime(packet_size)/1e3
-                    # and sleep for that time.
-                    time.sleep(wait_s)
+                    # We have insufficient tokens, sleep for that time.
+                    time.sleep(wait_ms/1e3)
+                    metrics.wakeups.inc()
             else:
                 # There is no packet, wait for a packet to become available
                 self.queue.wait()
+                metrics.wakeups.inc()
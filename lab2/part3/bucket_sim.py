@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Discrete-event simulation of the token-bucket shaper on virtual time.
+
+A trace is read and split into datagrams exactly as Sender.py does, and
+each datagram is handled the way the threaded shaper (TokenBucketReceiver
++ TokenBucketSender) handles it:
+
+  - datagrams larger than --max-packet-size are dropped;
+  - with an empty queue and enough tokens, a datagram is sent on arrival;
+  - otherwise it is queued, or dropped if the buffer is full;
+  - the sender sends the head of the queue as soon as it conforms.
+
+The bucket starts full at the first arrival. Sending takes no time, so at
+equal times departures go before arrivals. Runs are deterministic and
+write the arrival log of token_bucket.py and the departures in the format
+of Receiver.py, to compare with a live run or plot with plot.py.
+
+`simulate` runs the TokenBucket recurrence inline on plain integers (the
+same nano-token arithmetic, refills and waits). `simulate_reference`
+drives the real TokenBucket and ByteQueue classes on a virtual clock and
+is an order of magnitude slower; --check runs both and compares them.
+
+  python3 bucket_sim.py movietrace.data 20000 2000000 \\
+      --logfile sim_arrivals.log --departures sim_departures.log
+"""
+import argparse
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+from arrival_log import write_arrival_log
+from byte_queue import ByteQueue
+from replay import build_schedule
+from token_bucket import NANO, TokenBucket
+from trace_reader import read_trace
+
+
+class VirtualClock:
+    """A clock for TokenBucket that only moves when `now` is set."""
+
+    __slots__ = ("now",)
+
+    def __init__(self, now: int = 0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def check_params(sizes, bucket_size, bucket_rate, max_pkt_size):
+    """Raise ValueError for settings the live shaper would stall on."""
+    if bucket_rate <= 0:
+        raise ValueError("bucket rate must be positive")
+    if ((sizes > bucket_size) & (sizes <= max_pkt_size)).any():
+        raise ValueError("a datagram is larger than the bucket size")
+
+
+def simulate(t_ns, sizes, bucket_size: int, bucket_rate: int,
+             buffer_capacity: int = 200_000, max_pkt_size: int = 1480):
+    """
+    Shape datagrams arriving at `t_ns` (ns, in time order) with `sizes`
+    (bytes).
+
+    :return: (departures, immediate, backlog, tokens, oversize): the
+        departure time of each datagram in ns (-1 if dropped), whether it
+        was sent on arrival, the backlog and tokens it found on arrival,
+        and the number of datagrams dropped as too large
+    """
+    t_ns = np.asarray(t_ns, dtype=np.int64)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    check_params(sizes, bucket_size, bucket_rate, max_pkt_size)
+    n = len(t_ns)
+    departures = [-1] * n
+    immediate = [False] * n
+    backlog_at = [0] * n
+    tokens_at = [0.0] * n
+
+    rate = bucket_rate
+    ncap = int(bucket_size * NANO)   # bucket capacity, in nano-tokens
+    ntok = ncap                      # tokens at `last`, in nano-tokens
+    last = int(t_ns[0]) if n else 0  # last bucket update, in ns
+    q = deque()                      # (index, size) of queued datagrams
+    backlog = 0
+    oversize = 0
+    wake = None                      # when the sender next tries the head
+
+    # One extra arrival at infinity runs the sender until the queue drains
+    for i, t, size in zip(range(n + 1), t_ns.tolist() + [math.inf],
+                          sizes.tolist() + [0]):
+        while wake is not None and wake <= t:
+            now, wake = wake, None
+            while q:
+                j, s = q[0]
+                if now > last:
+                    ntok = min(ncap, ntok + int(rate * (now - last)))
+                    last = now
+                need = s * NANO
+                if ntok < need:
+                    wake = now + math.ceil((need - ntok) / rate)
+                    break
+                ntok -= need
+                q.popleft()
+                backlog -= s
+                departures[j] = now
+        if i == n:
+            break
+
+        backlog_at[i] = backlog
+        # read without updating the bucket, like getNoTokens
+        tokens_at[i] = (min(ncap, ntok + int(rate * (t - last))) if t > last
+                        else ntok) / NANO
+        if size > max_pkt_size:
+            oversize += 1
+            continue
+        if not q:
+            if t > last:
+                ntok = min(ncap, ntok + int(rate * (t - last)))
+                last = t
+            need = size * NANO
+            if ntok >= need:
+                ntok -= need
+                departures[i] = t
+                immediate[i] = True
+                continue
+        if backlog + size <= buffer_capacity:
+            q.append((i, size))
+            backlog += size
+            if wake is None:
+                wake = t  # the sender wakes up for the new packet
+
+    return (np.array(departures, dtype=np.int64), np.array(immediate),
+            np.array(backlog_at, dtype=np.int64), np.array(tokens_at),
+            oversize)
+
+
+def simulate_reference(t_ns, sizes, bucket_size: int, bucket_rate: int,
+                       buffer_capacity: int = 200_000,
+                       max_pkt_size: int = 1480):
+    """`simulate` with the real TokenBucket and ByteQueue on a VirtualClock."""
+    t_ns = np.asarray(t_ns, dtype=np.int64)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    check_params(sizes, bucket_size, bucket_rate, max_pkt_size)
+    n = len(t_ns)
+    clock = VirtualClock(int(t_ns[0]) if n else 0)
+    bucket = TokenBucket(bucket_size, bucket_rate, clock)
+    queue = ByteQueue(buffer_capacity)
+    zeros = memoryview(bytes(int(sizes.max()) if n else 0))
+    departures = np.full(n, -1, dtype=np.int64)
+    immediate = np.zeros(n, dtype=bool)
+    backlog_at = np.zeros(n, dtype=np.int64)
+    tokens_at = np.zeros(n)
+    waiting = deque()  # index of each queued datagram, in queue order
+    oversize = 0
+
+    def release(now):
+        """Send every conforming head packet at `now`; next wake-up or None."""
+        clock.now = now
+        while (packet := queue.peek()) is not None:
+            wait_ms = bucket.removeTokensOrWait(len(packet))
+            if wait_ms:
+                return now + round(wait_ms * 1e6)
+            queue.get()
+            departures[waiting.popleft()] = now
+        return None
+
+    wake = None
+    for i, (t, size) in enumerate(zip(t_ns.tolist(), sizes.tolist())):
+        while wake is not None and wake <= t:
+            wake = release(wake)
+        clock.now = t
+        backlog_at[i] = queue.backlog()
+        tokens_at[i] = bucket.getNoTokens()
+        if size > max_pkt_size:
+            oversize += 1
+            continue
+        if queue.is_empty() and bucket.removeTokens(size):
+            departures[i] = t
+            immediate[i] = True
+            continue
+        if queue.try_put(zeros[:size]):
+            waiting.append(i)
+            if wake is None:
+                wake = t
+    while wake is not None:
+        wake = release(wake)
+    return departures, immediate, backlog_at, tokens_at, oversize
+
+
+def write_departures(path: str, departures: np.ndarray, sizes: np.ndarray):
+    """Sent datagrams in departure order, in the format of Receiver.py."""
+    sent = departures >= 0
+    order = np.argsort(departures[sent], kind="stable")
+    times = departures[sent][order]
+    delta_us = np.diff(times, prepend=times[:1]) // 1000
+    with open(path, "w") as f:
+        f.write("delta_us\tpkt_len\n")
+        f.write("".join(f"{d}\t{n}\n" for d, n in
+                        zip(delta_us.tolist(), sizes[sent][order].tolist())))
+
+
+def summary(t_ns, departures, immediate, oversize):
+    """Counts, drops and queueing delays of a simulation, as text."""
+    sent = departures >= 0
+    full = len(t_ns) - int(sent.sum()) - oversize
+    delay_us = (departures[sent] - t_ns[sent]) / 1000
+    lines = [f"Datagrams: {len(t_ns)}, sent {int(sent.sum())} "
+             f"({int(immediate.sum())} on arrival), dropped {oversize} too "
+             f"large and {full} with the buffer full"]
+    if len(delay_us):
+        p50, p99, p999 = np.percentile(delay_us, [50, 99, 99.9])
+        lines.append(f"Delay (us): mean {delay_us.mean():.1f}, p50 {p50:.1f}, "
+                     f"p99 {p99:.1f}, p99.9 {p999:.1f}, max {delay_us.max():.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Token-bucket shaper simulated on virtual time")
+    parser.add_argument("tracefile", help="Trace in a format Sender.py reads")
+    parser.add_argument("bucket_size", type=int,
+                        help="Token bucket size, in bytes")
+    parser.add_argument("bucket_rate", type=int,
+                        help="Token generation rate, in bytes/sec")
+    parser.add_argument("--max-packet-size", type=int, default=1480,
+                        help="Maximum UDP packet size, in bytes")
+    parser.add_argument("--buffer-capacity", type=int, default=200_000,
+                        help="Buffer capacity, in bytes")
+    parser.add_argument("--max-dgram", type=int, default=1480,
+                        help="Split trace entries into datagrams of this many "
+                             "bytes, as Sender.py --max-dgram")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Limit number of trace entries")
+    parser.add_argument("--logfile", type=str, default="sim_arrivals.log",
+                        help="Arrival log file")
+    parser.add_argument("--log-format", choices=["text", "binary"],
+                        default="text", help="Arrival log format")
+    parser.add_argument("--departures", type=str, default="sim_departures.log",
+                        help="Departure log file, in the format of Receiver.py")
+    parser.add_argument("--reference", action="store_true",
+                        help="Simulate with the TokenBucket and ByteQueue "
+                             "classes instead of the inline recurrence")
+    parser.add_argument("--check", action="store_true",
+                        help="Also run the other simulation and compare")
+    args = parser.parse_args()
+
+    rel_ms, size = read_trace(args.tracefile, args.limit)
+    t_ns, sizes = build_schedule(rel_ms, size, args.max_dgram)
+    if not len(t_ns):
+        parser.error("trace file empty or unreadable")
+
+    engines = [simulate, simulate_reference]
+    if args.reference:
+        engines.reverse()
+    params = (t_ns, sizes, args.bucket_size, args.bucket_rate,
+              args.buffer_capacity, args.max_packet_size)
+    started = time.perf_counter()
+    try:
+        result = engines[0](*params)
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - started
+    departures, immediate, backlog, tokens, oversize = result
+
+    write_arrival_log(args.logfile, args.log_format,
+                      np.diff(t_ns, prepend=t_ns[:1]), sizes, backlog, tokens)
+    write_departures(args.departures, departures, sizes)
+
+    print(summary(t_ns, departures, immediate, oversize))
+    span_s = (max(t_ns[-1], departures.max()) - t_ns[0]) / 1e9
+    print(f"Simulated {span_s:.1f} s of traffic in {elapsed:.2f} s "
+          f"({len(t_ns) / elapsed:,.0f} datagrams/s, "
+          f"{span_s / elapsed:,.0f}x real time)")
+
+    if args.check:
+        other = engines[1](*params)
+        same = all(np.array_equal(a, b) for a, b in zip(result, other))
+        print(f"Matches {engines[1].__name__}: {same}")
+        if not same:
+            raise SystemExit(1)
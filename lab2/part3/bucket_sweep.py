@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Sweep the token-bucket shaper over a grid of bucket sizes, rates and buffer
+capacities, simulating every configuration at once.
+
+The shaper is the one of bucket_sim.py (same trace parsers and datagram
+split as Sender.py, same drops, same nano-token arithmetic), but instead of
+one configuration per run, the state of K configurations is kept in NumPy
+arrays of length K and the trace is walked once. Each step handles a whole
+trace entry: its datagrams arrive together and are sent back to back, so
+how many of them go out on arrival, are queued or are dropped, and when
+each queued one departs, follow in closed form from the tokens at the
+start of the entry. Queued entries are kept in a ring per configuration,
+to age the backlog at later arrivals.
+
+The grid is split across a process pool, and each configuration gets one
+row of the result table: datagrams sent and dropped, the peak backlog and
+the delay of sent datagrams (mean and max exact, percentiles as upper
+bounds from a shaper_metrics.Histogram). --check reruns each configuration
+in bucket_sim.simulate and compares the exact columns.
+
+  python3 bucket_sweep.py movietrace.data --sizes 20000 50000 100000 \\
+      --rates 1000000:4000000:7 --buffers 100000 200000 --out sweep.tsv
+"""
+import argparse
+import itertools
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+from bucket_sim import check_params, simulate
+from replay import build_schedule, entry_schedule
+from shaper_metrics import SUB, Histogram
+from token_bucket import NANO
+from trace_reader import read_trace
+
+PERCENTILES = (50, 99, 99.9)
+BINS = 64 * SUB  # buckets of a Histogram
+COLUMNS = ("bucket_size", "bucket_rate", "buffer_capacity", "sent",
+           "immediate", "dropped", "oversize", "max_backlog", "delay_mean_us",
+           "delay_p50_us", "delay_p99_us", "delay_p99.9_us", "delay_max_us")
+
+# Fields of a queued entry, in the ring of each configuration
+T0, TOKENS, BASE, FULL, END, BYTES = range(6)
+
+
+def split_entries(t_ns, size, max_dgram=1480, max_pkt_size=1480):
+    """
+    Trace entries as Sender.py splits them: `full` datagrams of `max_dgram`
+    bytes then one of `rem` bytes, leaving out datagrams larger than
+    `max_pkt_size`.
+
+    :return: (t_ns, full, rem, oversize) for the entries with a datagram to
+        send, and the number of datagrams too large
+    """
+    keep = size > 0
+    t_ns, size = t_ns[keep], size[keep]
+    full = (size - 1) // max_dgram
+    rem = size - full * max_dgram
+    oversize = int(((rem > max_pkt_size) + (max_dgram > max_pkt_size) * full).sum())
+    if max_dgram > max_pkt_size:
+        full = np.zeros_like(full)
+    rem = np.where(rem <= max_pkt_size, rem, 0)
+    keep = (full > 0) | (rem > 0)
+    return t_ns[keep], full[keep], rem[keep], oversize
+
+
+def sweep(t_ns, full, rem, bucket_size, bucket_rate, buffer_capacity,
+          max_dgram=1480):
+    """
+    Shape the entries of split_entries with K configurations at once.
+
+    Per configuration, `tokens` (nano-tokens) are left in the bucket after
+    the last departure at `last`. An entry arriving at `a` starts at
+    t0 = max(a, last), when the queue ahead of it has left, with `tok`
+    tokens. Sending takes no time, so its i-th accepted datagram, with Q
+    bytes accepted up to and including it, departs at
+    t0 + max(0, ceil((Q * NANO - tok) / rate)): the bucket cannot fill up
+    while a datagram waits for tokens. The ones departing at `a` with an
+    empty queue are the ones sent on arrival; the others are queued, as
+    many as fit in the buffer.
+
+    :param bucket_size, bucket_rate, buffer_capacity: int arrays of K
+    :return: dict of the result columns, arrays of K
+    """
+    k = len(bucket_size)
+    rows = np.arange(k)
+    rate = np.asarray(bucket_rate, dtype=np.int64)
+    ncap = np.asarray(bucket_size, dtype=np.int64) * NANO
+    capacity = np.asarray(buffer_capacity, dtype=np.int64)
+    idle_max = ncap // rate + 1  # any longer idle time fills the bucket
+    tokens = ncap.copy()
+    last = np.full(k, t_ns[0] if len(t_ns) else 0, dtype=np.int64)
+
+    width = 16
+    ring = np.zeros((k, width, 6), dtype=np.int64)
+    head = np.zeros(k, dtype=np.int64)
+    count = np.zeros(k, dtype=np.int64)
+    total = np.zeros(k, dtype=np.int64)  # bytes of the entries in the ring
+
+    sent = np.zeros(k, dtype=np.int64)
+    immediate = np.zeros(k, dtype=np.int64)
+    dropped = np.zeros(k, dtype=np.int64)
+    max_backlog = np.zeros(k, dtype=np.int64)
+    delay_sum = np.zeros(k, dtype=np.int64)
+    delay_max = np.zeros(k, dtype=np.int64)
+    hist = np.zeros((k, BINS), dtype=np.int64)
+    pending = []  # flat histogram slots, counted in bulk
+
+    for a, e, r in zip(t_ns.tolist(), full.tolist(), rem.tolist()):
+        # Retire the entries sent by `a`; departures go before arrivals
+        while True:
+            first = ring[rows, head]
+            done = (count > 0) & (first[:, END] <= a)
+            if not done.any():
+                break
+            total -= np.where(done, first[:, BYTES], 0)
+            head = np.where(done, (head + 1) % width, head)
+            count -= done
+        # ... and the datagrams of the head entry sent so far
+        t0 = first[:, T0]
+        started = (count > 0) & (t0 <= a)
+        sendable = (first[:, TOKENS] + rate * np.where(started, a - t0, 0)) // NANO
+        gone = np.clip((sendable - first[:, BASE]) // max_dgram, 0,
+                       first[:, FULL]) * max_dgram
+        backlog = total - np.where(started, gone, 0)
+
+        empty = count == 0
+        t0 = np.maximum(last, a)
+        tok = np.minimum(ncap, tokens + rate * np.minimum(t0 - last, idle_max))
+        avail = np.where(empty, tok // NANO, 0)
+        imm_full = np.minimum(e, avail // max_dgram)
+        imm_rem = (imm_full == e) & (avail >= e * max_dgram + r) & (r > 0)
+        base = imm_full * max_dgram + imm_rem * r
+        space = capacity - backlog
+        q_full = np.minimum(e - imm_full, space // max_dgram)
+        q_rem = ~imm_rem & (space - q_full * max_dgram >= r) & (r > 0)
+        queued = q_full * max_dgram + q_rem * r
+        dropped += e - imm_full - q_full + ((r > 0) & ~imm_rem & ~q_rem)
+        on_arrival = imm_full + imm_rem
+        sent += on_arrival + q_full + q_rem
+        immediate += on_arrival
+        hist[:, 0] += on_arrival
+
+        need = (base + queued) * NANO
+        end = t0 + np.maximum(-((tok - need) // rate), 0)
+        accepted = need > 0
+        tokens = np.where(accepted, tok + rate * (end - t0) - need, tokens)
+        last = np.where(accepted, end, last)
+
+        push = queued > 0
+        if not push.any():
+            continue
+        if count.max() == width:
+            ring = np.concatenate(
+                (ring[rows[:, None], (head[:, None] + np.arange(width)) % width],
+                 np.zeros_like(ring)), axis=1)
+            head[:] = 0
+            width *= 2
+        tail = (head + count)[push] % width
+        ring[rows[push], tail] = np.stack((t0, tok, base, q_full, end, queued),
+                                          axis=1)[push]
+        count += push
+        total += queued
+        np.maximum(max_backlog, backlog + queued, out=max_backlog)
+
+        # Delays of the queued datagrams
+        delay = np.where(push, end - a, 0)
+        np.maximum(delay_max, delay, out=delay_max)
+        delay_sum += np.where(q_rem, delay, 0)
+        pending.append((Histogram.indices(delay // 1000) + rows * BINS)[q_rem])
+        if e:
+            j = np.arange(1, e + 1)
+            mask = j <= q_full[:, None]
+            q = (base[:, None] + j * max_dgram) * NANO
+            delay = t0[:, None] + np.maximum(
+                -((tok[:, None] - q) // rate[:, None]), 0) - a
+            delay_sum += np.where(mask, delay, 0).sum(axis=1)
+            slots = Histogram.indices(delay // 1000) + (rows * BINS)[:, None]
+            pending.append(slots[mask])
+        if len(pending) >= 512:
+            hist += np.bincount(np.concatenate(pending),
+                                minlength=k * BINS).reshape(k, BINS)
+            pending = []
+    if pending:
+        hist += np.bincount(np.concatenate(pending),
+                            minlength=k * BINS).reshape(k, BINS)
+
+    percentiles = np.zeros((k, len(PERCENTILES)), dtype=np.int64)
+    for i in range(k):
+        h = Histogram("delay", "", {})
+        h.counts = hist[i].tolist()
+        percentiles[i] = h.percentiles(PERCENTILES)
+    np.minimum(percentiles, (delay_max // 1000)[:, None], out=percentiles)
+    return {"sent": sent, "immediate": immediate, "dropped": dropped,
+            "max_backlog": max_backlog, "delay_sum_ns": delay_sum,
+            "delay_max_ns": delay_max, "percentiles_us": percentiles}
+
+
+_entries = None  # (t_ns, full, rem) of the trace, in each worker
+
+
+def _init_worker(entries):
+    global _entries
+    _entries = entries
+
+
+def _sweep_chunk(grid, max_dgram):
+    return sweep(*_entries, grid[:, 0], grid[:, 1], grid[:, 2], max_dgram)
+
+
+def run_sweep(entries, grid, workers, max_dgram=1480):
+    """
+    `sweep` the rows (bucket_size, bucket_rate, buffer_capacity) of `grid`
+    in `workers` processes, each on an equal share of the rows.
+    """
+    chunks = [c for c in np.array_split(grid, workers) if len(c)]
+    if len(chunks) == 1:
+        _init_worker(entries)
+        results = [_sweep_chunk(chunks[0], max_dgram)]
+    else:
+        with mp.Pool(len(chunks), _init_worker, (entries,)) as pool:
+            results = pool.starmap(_sweep_chunk,
+                                   [(c, max_dgram) for c in chunks])
+    return {name: np.concatenate([r[name] for r in results])
+            for name in results[0]}
+
+
+def result_table(grid, result, oversize):
+    """One row per configuration, as tuples in the order of COLUMNS."""
+    sent = result["sent"]
+    mean = np.where(sent > 0, result["delay_sum_ns"] / np.maximum(sent, 1), 0)
+    rows = []
+    for i, (size, rate, capacity) in enumerate(grid.tolist()):
+        rows.append((size, rate, capacity, int(sent[i]),
+                     int(result["immediate"][i]), int(result["dropped"][i]),
+                     oversize, int(result["max_backlog"][i]),
+                     round(mean[i] / 1000, 1),
+                     *result["percentiles_us"][i].tolist(),
+                     int(result["delay_max_ns"][i]) // 1000))
+    return rows
+
+
+def format_table(rows):
+    """The result table as aligned text, delays in ms."""
+    lines = [f"{'size':>8} {'rate':>10} {'buffer':>9} {'sent':>9} "
+             f"{'dropped':>8} {'drop %':>7} {'max backlog':>11}   delay (ms): "
+             f"{'mean':>8} {'p50':>8} {'p99':>8} {'p99.9':>8} {'max':>8}"]
+    for (size, rate, capacity, sent, _, dropped, oversize, backlog, mean,
+         p50, p99, p999, top) in rows:
+        total = sent + dropped + oversize
+        lines.append(
+            f"{size:>8} {rate:>10} {capacity:>9} {sent:>9} {dropped:>8} "
+            f"{dropped / max(total, 1):>7.2%} {backlog:>11}               "
+            + "".join(f"{v / 1000:>9.1f}" for v in (mean, p50, p99, p999, top)))
+    return "\n".join(lines)
+
+
+def check(t_ns, sizes, rows, max_pkt_size):
+    """
+    Rerun each configuration in bucket_sim.simulate; (row, column) of the
+    exact columns that differ.
+    """
+    mismatches = []
+    for row in rows:
+        size, rate, capacity = row[:3]
+        departures, immediate, backlog, _, oversize = simulate(
+            t_ns, sizes, size, rate, capacity, max_pkt_size)
+        sent = departures >= 0
+        queued = departures > t_ns
+        delay = departures[sent] - t_ns[sent]
+        expected = {
+            "sent": int(sent.sum()), "immediate": int(immediate.sum()),
+            "dropped": len(t_ns) - int(sent.sum()) - oversize,
+            "oversize": oversize,
+            "max_backlog": int((backlog + sizes * queued).max(initial=0)),
+            "delay_max_us": int(delay.max(initial=0)) // 1000,
+            "delay_mean_us": round(delay.sum() / max(len(delay), 1) / 1000, 1)}
+        for name, value in expected.items():
+            if row[COLUMNS.index(name)] != value:
+                mismatches.append((row[:3], name))
+    return mismatches
+
+
+def grid_values(text):
+    """An int, or lo:hi:n for n ints evenly spaced from lo to hi."""
+    if ":" not in text:
+        return [int(text)]
+    lo, hi, n = text.split(":")
+    return np.linspace(int(lo), int(hi), int(n)).round().astype(int).tolist()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Token-bucket shaper simulated over a grid of settings")
+    parser.add_argument("tracefile", help="Trace in a format Sender.py reads")
+    parser.add_argument("--sizes", nargs="+", default=["20000"],
+                        help="Token bucket sizes, in bytes (values or lo:hi:n)")
+    parser.add_argument("--rates", nargs="+", default=["2000000"],
+                        help="Token generation rates, in bytes/sec "
+                             "(values or lo:hi:n)")
+    parser.add_argument("--buffers", nargs="+", default=["200000"],
+                        help="Buffer capacities, in bytes (values or lo:hi:n)")
+    parser.add_argument("--max-packet-size", type=int, default=1480,
+                        help="Maximum UDP packet size, in bytes")
+    parser.add_argument("--max-dgram", type=int, default=1480,
+                        help="Split trace entries into datagrams of this many "
+                             "bytes, as Sender.py --max-dgram")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Limit number of trace entries")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Processes the grid is split across")
+    parser.add_argument("--out", type=str, default=None,
+                        help="Also write the table, tab-separated, to this file")
+    parser.add_argument("--check", action="store_true",
+                        help="Rerun each configuration in bucket_sim.simulate "
+                             "and compare")
+    args = parser.parse_args()
+
+    rel_ms, size = read_trace(args.tracefile, args.limit)
+    t_ns, full, rem, oversize = split_entries(
+        *entry_schedule(rel_ms, size), args.max_dgram, args.max_packet_size)
+    if not len(t_ns):
+        parser.error("trace file empty or unreadable")
+
+    grid = np.array(list(itertools.product(
+        *(sorted({v for text in values for v in grid_values(text)})
+          for values in (args.sizes, args.rates, args.buffers)))),
+        dtype=np.int64)
+    dgram_sizes = np.unique(np.append(rem[rem > 0],
+                                      [args.max_dgram] if full.any() else []))
+    for bucket_size, bucket_rate, _ in grid.tolist():
+        try:
+            check_params(dgram_sizes, bucket_size, bucket_rate,
+                         args.max_packet_size)
+        except ValueError as e:
+            parser.error(f"{e} ({bucket_size} bytes at {bucket_rate} bytes/sec)")
+
+    started = time.perf_counter()
+    result = run_sweep((t_ns, full, rem), grid, args.workers, args.max_dgram)
+    elapsed = time.perf_counter() - started
+    rows = result_table(grid, result, oversize)
+
+    print(format_table(rows))
+    datagrams = int(full.sum() + (rem > 0).sum()) + oversize
+    print(f"{len(grid)} configurations x {datagrams} datagrams "
+          f"({len(t_ns)} entries) in {elapsed:.2f} s with {args.workers} "
+          f"workers ({len(grid) * datagrams / elapsed:,.0f} datagrams/s)")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write("\t".join(COLUMNS) + "\n")
+            f.write("".join("\t".join(map(str, row)) + "\n" for row in rows))
+
+    if args.check:
+        mismatches = check(*build_schedule(rel_ms, size, args.max_dgram),
+                           rows, args.max_packet_size)
+        for config, name in mismatches:
+            print(f"Mismatch in {name} for {config}")
+        print(f"Matches bucket_sim.simulate: {not mismatches}")
+        if mismatches:
+            raise SystemExit(1)
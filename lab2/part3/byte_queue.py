@@ -1,16 +1,35 @@
+import time
 from threading import Lock, Event
 from collections import deque
+from itertools import islice
+
+from packet_header import DEQ_OFFSET, ENQ_OFFSET, stamp_time
 
 
 class ByteQueue:
     """
     Thread-safe FIFO buffer for incoming packets.
     Capacity is specified in bytes (sum of lengths of stored packets).
+
+    With `stamp`, packets carrying a packet_header get the time they are
+    enqueued written into it, and the time they are dequeued each time they
+    are peeked at: every sender peeks right before it sends, so the last
+    peek is the departure. Stamped packets are stored as bytearrays.
+
+    With a `delay` histogram (see shaper_metrics.py), the enqueue time of
+    every packet is kept and its queueing delay, in us, recorded on removal.
     """
 
-    def __init__(self, MAX_BYTES: int):
-        """:param MAX_BYTES: total byte capacity allowed in the queue."""
+    def __init__(self, MAX_BYTES: int, stamp: bool = False, delay=None):
+        """
+        :param MAX_BYTES: total byte capacity allowed in the queue.
+        :param stamp: write enqueue/dequeue times into packet headers
+        :param delay: Histogram to record queueing delays into, or None
+        """
         self.MAX_BYTES = MAX_BYTES  # queue capacity, in bytes
+        self.stamp = stamp
+        self.delay = delay
+        self.enq_ns = deque()       # enqueue times, kept with `delay` only
         self.bytes = 0              # current backlog, in bytes
         self.q = deque()            # underlying (not-thread-safe) queue
         self.lock = Lock()          # locks for accessing `bytes`
@@ -24,11 +43,43 @@ class ByteQueue:
         with self.lock:
             if self.bytes + len(data) > self.MAX_BYTES:
                 return False
+            if self.stamp:
+                data = bytearray(data)
+                stamp_time(data, ENQ_OFFSET, time.monotonic_ns())
             self.bytes += len(data)
             self.q.append(data)
-            self.nonempty.set()
+            if self.delay is not None:
+                self.enq_ns.append(time.monotonic_ns())
+            if len(self.q) == 1:
+                # Was empty: the flag is set whenever the queue is not
+                self.nonempty.set()
             return True
 
+    def put_many(self, packets):
+        """
+        Put each packet of `packets` in the queue if there is space for it,
+        under a single lock acquisition. Returns the number of dropped packets.
+        Packets may be buffer views, they are copied to `bytes` when stored.
+        """
+        dropped = 0
+        copy = bytearray if self.stamp else bytes
+        now = time.monotonic_ns()
+        with self.lock:
+            for data in packets:
+                if self.bytes + len(data) > self.MAX_BYTES:
+                    dropped += 1
+                    continue
+                self.bytes += len(data)
+                data = copy(data)
+                if self.stamp:
+                    stamp_time(data, ENQ_OFFSET, now)
+                self.q.append(data)
+                if self.delay is not None:
+                    self.enq_ns.append(now)
+            if self.q:
+                self.nonempty.set()
+        return dropped
+
     def get(self):
         """
         Return the first packet from the queue,
@@ -37,11 +88,33 @@ class ByteQueue:
         with self.lock:
             data: bytes = self.q.popleft()
             self.bytes -= len(data)
+            if self.delay is not None:
+                self._record_delay(1)
             if not self.q:
                 # We pop the last packet, clear the non-empty flag
                 self.nonempty.clear()
             return data
 
+    def get_many(self, count: int):
+        """
+        Remove and return the first `count` packets from the queue,
+        assuming there are at least `count` packets.
+        """
+        with self.lock:
+            out = [self.q.popleft() for _ in range(count)]
+            self.bytes -= sum(map(len, out))
+            if self.delay is not None:
+                self._record_delay(count)
+            if not self.q:
+                self.nonempty.clear()
+            return out
+
+    def _record_delay(self, count: int):
+        """Record the queueing delay of the `count` packets just removed."""
+        now = time.monotonic_ns()
+        for _ in range(count):
+            self.delay.record((now - self.enq_ns.popleft()) // 1000)
+
     def wait(self, timeout: float | None = None):
         """Block until a packet becomes available."""
         self.nonempty.wait(timeout)
@@ -53,7 +126,27 @@ class ByteQueue:
         """
         with self.lock:
             if self.q:
-                return self.q[0]
+                packet = self.q[0]
+                if self.stamp:
+                    stamp_time(packet, DEQ_OFFSET, time.monotonic_ns())
+                return packet
+
+    def peek_many(self, count: int):
+        """
+        Up to `count` packets from the head of queue, oldest first.
+        The packets are not removed.
+        """
+        with self.lock:
+            packets = list(islice(self.q, count))
+        self._stamp_dequeue(packets)
+        return packets
+
+    def _stamp_dequeue(self, packets):
+        """With `stamp`, write the current time as dequeue time of `packets`."""
+        if self.stamp:
+            now = time.monotonic_ns()
+            for packet in packets:
+                stamp_time(packet, DEQ_OFFSET, now)
 
     def backlog(self):
         """Total backlog, in bytes."""
@@ -64,3 +157,187 @@ class ByteQueue:
         """Boolean whether the queue is empty"""
         with self.lock:
             return not self.q
+
+
+class RingByteQueue(ByteQueue):
+    """
+    ByteQueue backed by one preallocated byte arena instead of one `bytes`
+    object per packet. Packets are stored contiguously in the arena and the
+    queue holds (offset, length) descriptors, so the receiver can
+    `recv_into` a slot directly and the sender can `sendto` a view of it.
+
+    The arena is `MAX_BYTES + max_pkt_size` bytes long. The extra packet of
+    slack guarantees that a packet which fits the byte capacity also finds
+    a contiguous slot, so capacity semantics are exactly those of ByteQueue.
+
+    Views returned by `peek`/`get` point into the arena: a packet must be
+    sent before it is removed from the queue, because its slot may be
+    reused by the next `try_put`/`commit` right after removal.
+    """
+
+    def __init__(self, MAX_BYTES: int, max_pkt_size: int = 65535,
+                 stamp: bool = False, delay=None):
+        """
+        :param MAX_BYTES: total byte capacity allowed in the queue.
+        :param max_pkt_size: largest packet the queue has to hold, in bytes
+        :param stamp: write enqueue/dequeue times into packet headers
+        :param delay: Histogram to record queueing delays into, or None
+        """
+        super().__init__(MAX_BYTES, stamp, delay)
+        self.max_pkt_size = max_pkt_size
+        self.arena = memoryview(bytearray(MAX_BYTES + max_pkt_size))
+        self.head = 0          # arena offset of the oldest stored byte
+        self.tail = 0          # arena offset where the next packet goes
+        self.wrap_at = None    # end of the data before `tail` wrapped to 0
+        self.reserved = None   # arena offset handed out by `reserve`
+
+    def _find_slot(self, size: int):
+        """Arena offset of a free contiguous `size` bytes at tail, or None."""
+        if not self.q:
+            return 0
+        if self.wrap_at is None:
+            if len(self.arena) - self.tail >= size:
+                return self.tail
+            if self.head >= size:
+                return 0
+            return None
+        if self.head - self.tail >= size:
+            return self.tail
+        return None
+
+    def _store(self, offset: int, size: int):
+        """Append the descriptor of a packet already written at `offset`."""
+        if not self.q:
+            self.head = offset
+            self.wrap_at = None
+        elif offset < self.tail:
+            self.wrap_at = self.tail
+        self.tail = offset + size
+        self.bytes += size
+        self.q.append((offset, size))
+        if self.delay is not None:
+            self.enq_ns.append(time.monotonic_ns())
+
+    def _put(self, data):
+        if self.bytes + len(data) > self.MAX_BYTES:
+            return False
+        offset = self._find_slot(len(data))
+        if offset is None:
+            return False
+        self.arena[offset:offset + len(data)] = data
+        self._store(offset, len(data))
+        if self.stamp:
+            stamp_time(self.arena[offset:offset + len(data)], ENQ_OFFSET,
+                       time.monotonic_ns())
+        return True
+
+    def _pop(self):
+        offset, size = self.q.popleft()
+        self.bytes -= size
+        if self.delay is not None:
+            self._record_delay(1)
+        if not self.q:
+            # Empty again: restart at the front so slots stay contiguous
+            self.head = self.tail = 0
+            self.wrap_at = None
+            self.nonempty.clear()
+        else:
+            self.head = self.q[0][0]
+            if self.wrap_at is not None and self.head < offset:
+                # Moved past the wrap point, the gap at the end is free again
+                self.wrap_at = None
+        return self.arena[offset:offset + size]
+
+    def try_put(self, data: bytes):
+        """
+        If there is available space, copy `data` into the arena and returns
+        True. Otherwise, discard the packet and returns False.
+        """
+        with self.lock:
+            if not self._put(data):
+                return False
+            if len(self.q) == 1:
+                self.nonempty.set()
+            return True
+
+    def put_many(self, packets):
+        """
+        Copy each packet of `packets` into the arena if there is space for it,
+        under a single lock acquisition. Returns the number of dropped packets.
+        """
+        with self.lock:
+            dropped = sum(not self._put(data) for data in packets)
+            if self.q:
+                self.nonempty.set()
+        return dropped
+
+    def reserve(self):
+        """
+        A writable view of a free `max_pkt_size` slot at the tail of the
+        arena, to receive the next packet into, or None if no such slot is
+        free right now. The slot only becomes part of the queue on `commit`.
+        """
+        with self.lock:
+            offset = self._find_slot(self.max_pkt_size)
+            self.reserved = offset
+            if offset is None:
+                return None
+            return self.arena[offset:offset + self.max_pkt_size]
+
+    def commit(self, size: int):
+        """
+        Enqueue the first `size` bytes of the slot handed out by the last
+        `reserve` and return True, or return False if the byte capacity
+        does not allow it (the slot is then simply reused).
+        """
+        with self.lock:
+            if self.bytes + size > self.MAX_BYTES:
+                return False
+            self._store(self.reserved, size)
+            if self.stamp:
+                stamp_time(self.arena[self.reserved:self.reserved + size],
+                           ENQ_OFFSET, time.monotonic_ns())
+            self.reserved = None
+            if len(self.q) == 1:
+                self.nonempty.set()
+            return True
+
+    def get(self):
+        """
+        Return a view of the first packet in the queue,
+        assuming there is at least one packet.
+        """
+        with self.lock:
+            return self._pop()
+
+    def get_many(self, count: int):
+        """
+        Remove and return views of the first `count` packets in the queue,
+        assuming there are at least `count` packets.
+        """
+        with self.lock:
+            return [self._pop() for _ in range(count)]
+
+    def peek(self):
+        """
+        A view of the head of queue, or None if the queue is empty.
+        The head of queue is not removed.
+        """
+        with self.lock:
+            if self.q:
+                offset, size = self.q[0]
+                packet = self.arena[offset:offset + size]
+                if self.stamp:
+                    stamp_time(packet, DEQ_OFFSET, time.monotonic_ns())
+                return packet
+
+    def peek_many(self, count: int):
+        """
+        Views of up to `count` packets from the head of queue, oldest first.
+        The packets are not removed.
+        """
+        with self.lock:
+            packets = [self.arena[offset:offset + size]
+                       for offset, size in islice(self.q, count)]
+        self._stamp_dequeue(packets)
+        return packets
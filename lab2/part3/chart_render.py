@@ -0,0 +1 @@
+../../Lab1/chart_render.py
\ No newline at end of file
@@ -0,0 +1 @@
+../part2/packet_header.py
\ No newline at end of file
@@ -1,5 +1,9 @@
 import numpy as np
-import matplotlib.pyplot as plt
+import pandas as pd
+
+from arrival_log import is_binary_log, load_binary_log
+from chart_render import Chart, Renderer, render
+from trace_cache import load_columns
 
 
 # ---------- helpers ----------
@@ -14,7 +18,14 @@ def load_tb_log(path):
     """
     Token bucket log format:
       delta_us  pkt_len  backlog_bytes  tokens
+    Binary logs (token_bucket.py --log-format binary) are memory-mapped.
     """
+    if is_binary_log(path):
+        rec = load_binary_log(path)
+        t = np.cumsum(rec["elapsed_ns"]) / 1e9
+        return t, rec["len"].astype(int), rec["backlog"].astype(float), \
+            np.asarray(rec["tokens"])
+
     delta_us = []
     sizes = []
     backlog = []
@@ -62,107 +73,110 @@ def load_sink_log(path):
     t = cumtime_from_deltas_us(delta_us)
     return t, sizes
 
+def read_trace_columns(path, cols):
+    """
+    Columns `cols` of a whitespace-separated trace, parsed in bulk.
+    Blank lines, '#' lines and lines too short to have every column are
+    skipped. Values are parsed exactly like Python's float(), once: later
+    calls read the binary trace cache (see trace_cache.py).
+    Returns one float array per column.
+    """
+    need = max(cols) + 1
+    try:
+        columns = load_columns(path)
+    except (OSError, ValueError, UnicodeDecodeError):  # ParserError too
+        columns = None
+    if columns is None or len(columns) < need:
+        # Ragged or unusual file: fall back to splitting line by line
+        rows = []
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < need or parts[0].startswith("#"):
+                    continue
+                rows.append([float(parts[c]) for c in cols])
+        arr = np.array(rows, dtype=float).reshape(-1, len(cols))
+        return [arr[:, i] for i in range(len(cols))]
+    sub = pd.DataFrame({c: columns[c] for c in cols})
+    sub = sub.apply(pd.to_numeric, errors="coerce").dropna()
+    return [sub[c].to_numpy(dtype=float) for c in cols]
+
+def expand_chunks(t, size, limit=None, max_dgram=1400):
+    """
+    Split each packet/frame (time `t`, `size` bytes) into datagrams of at
+    most `max_dgram` bytes sharing its timestamp, the way Sender sends it.
+    With `limit`, stop after the first packet that brings the datagram count
+    to `limit`. Returns (times, sizes) of the datagrams, stably time-sorted.
+    """
+    size = size.astype(np.int64)
+    n = np.where(size > 0, -(-size // max_dgram), 0)  # datagrams per packet
+    cum = np.cumsum(n)
+    if limit is not None:
+        hit = np.flatnonzero(cum >= limit)
+        if hit.size:
+            stop = hit[0] + 1
+            t, size, n, cum = t[:stop], size[:stop], n[:stop], cum[:stop]
+    if not cum.size or cum[-1] == 0:
+        return np.array([]), np.array([])
+
+    t_rep = np.repeat(t, n)
+    sz = np.full(cum[-1], max_dgram, dtype=np.int64)
+    last = cum[n > 0] - 1                          # last datagram of a packet
+    sz[last] = size[n > 0] - (n[n > 0] - 1) * max_dgram
+    order = np.argsort(t_rep, kind="stable")
+    return t_rep[order], sz[order]
+
 def load_video_trace(path, limit=None, max_dgram=1400):
     """
     movietrace.data commonly: seq  time_ms  frameType  size_bytes ...
     For plotting, we convert each frame into UDP chunks of size max_dgram,
     because that's what your Sender actually sends.
     """
-    rows = []
-    with open(path, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            parts = line.split()
-            if len(parts) < 4:
-                continue
-            t_ms = float(parts[1])
-            frame_bytes = int(parts[3])
-
-            # split into chunks (same timestamp)
-            remaining = frame_bytes
-            while remaining > 0:
-                chunk = min(remaining, max_dgram)
-                rows.append((t_ms, chunk))
-                remaining -= chunk
-
-            if limit is not None and len(rows) >= limit:
-                break
-
-    rows.sort(key=lambda x: x[0])
-    t = np.array([r[0] for r in rows]) / 1000.0
-    sz = np.array([r[1] for r in rows])
-    return t, sz
+    t_ms, frame_bytes = read_trace_columns(path, (1, 3))
+    t, sz = expand_chunks(t_ms, frame_bytes, limit, max_dgram)
+    return t / 1000.0, sz
 
 def load_eth_trace(path, limit=None, max_dgram=1400):
     """
     BC-pAug89.TL format (confirmed): time_sec  size_bytes
     For plotting, we split packets into chunks of max_dgram like Sender does.
     """
-    rows = []
-    with open(path, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            parts = line.split()
-            if len(parts) < 2:
-                continue
-            t_s = float(parts[0])
-            pkt_bytes = int(parts[1])
-
-            remaining = pkt_bytes
-            while remaining > 0:
-                chunk = min(remaining, max_dgram)
-                rows.append((t_s, chunk))
-                remaining -= chunk
-
-            if limit is not None and len(rows) >= limit:
-                break
+    t_s, pkt_bytes = read_trace_columns(path, (0, 1))
+    return expand_chunks(t_s, pkt_bytes, limit, max_dgram)  # already seconds
 
-    rows.sort(key=lambda x: x[0])
-    t = np.array([r[0] for r in rows])  # already seconds
-    sz = np.array([r[1] for r in rows])
-    return t, sz
 
-
-def plot_set(tag, in_t, in_sz, tb_log_path, sink_log_path, out_prefix):
+def plot_set(tag, in_t, in_sz, tb_log_path, sink_log_path, out_prefix,
+             renderer=None):
+    """
+    Cumulative bytes, tokens and backlog charts of one run, as
+    <out_prefix>_{cumbytes,tokens,backlog}.png. With a chart_render.Renderer
+    the charts are queued to it; otherwise they are drawn before returning.
+    """
     tb_t, tb_sz, tb_backlog, tb_tokens = load_tb_log(tb_log_path)
     out_t, out_sz = load_sink_log(sink_log_path)
 
-    # cumulative bytes
-    plt.figure()
-    plt.plot(in_t, cumbytes(in_sz), label=f"Input ({tag})")
-    plt.plot(tb_t, cumbytes(tb_sz), label="Arrivals at Token Bucket")
-    plt.plot(out_t, cumbytes(out_sz), label="Output (Sink)")
-    plt.xlabel("Time (s)")
-    plt.ylabel("Cumulative bytes")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(f"{out_prefix}_cumbytes.png", dpi=200)
-
-    # tokens
-    plt.figure()
-    plt.plot(tb_t, tb_tokens)
-    plt.xlabel("Time (s)")
-    plt.ylabel("Tokens (bytes)")
-    plt.tight_layout()
-    plt.savefig(f"{out_prefix}_tokens.png", dpi=200)
-
-    # backlog
-    plt.figure()
-    plt.plot(tb_t, tb_backlog)
-    plt.xlabel("Time (s)")
-    plt.ylabel("Backlog (bytes)")
-    plt.tight_layout()
-    plt.savefig(f"{out_prefix}_backlog.png", dpi=200)
+    charts = [
+        Chart(f"{out_prefix}_cumbytes.png", "Time (s)", "Cumulative bytes")
+        .line(in_t, cumbytes(in_sz), label=f"Input ({tag})")
+        .line(tb_t, cumbytes(tb_sz), label="Arrivals at Token Bucket")
+        .line(out_t, cumbytes(out_sz), label="Output (Sink)"),
+        Chart(f"{out_prefix}_tokens.png", "Time (s)", "Tokens (bytes)")
+        .line(tb_t, tb_tokens),
+        Chart(f"{out_prefix}_backlog.png", "Time (s)", "Backlog (bytes)")
+        .line(tb_t, tb_backlog),
+    ]
+    for chart in charts:
+        if renderer is not None:
+            renderer.submit(chart)
+        else:
+            render(chart)
 
 
 if __name__ == "__main__":
     # Match your run settings
     LIMIT = 1000
     MAX_DGRAM = 1400
+    renderer = Renderer(workers=2)  # draws the video charts while eth loads
 
     # --- VIDEO (Part 3-c) ---
     # Input trace is in part3/, logs are arrivals_video.log (part3) and sink_video.log (part2)
@@ -173,7 +187,8 @@ if __name__ == "__main__":
         in_sz=video_in_sz,
         tb_log_path="arrivals_video.log",
         sink_log_path="../part2/sink_video.log",
-        out_prefix="p3c_video"
+        out_prefix="p3c_video",
+        renderer=renderer
     )
 
     # --- ETHERNET (Part 3-c) ---
@@ -184,7 +199,9 @@ if __name__ == "__main__":
         in_sz=eth_in_sz,
         tb_log_path="arrivals_eth.log",
         sink_log_path="../part2/sink_eth.log",
-        out_prefix="p3c_eth"
+        out_prefix="p3c_eth",
+        renderer=renderer
     )
+    renderer.close()
 
     print("Saved: p3c_video_{cumbytes,tokens,backlog}.png and p3c_eth_{cumbytes,tokens,backlog}.png")
\ No newline at end of file
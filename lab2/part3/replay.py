@@ -0,0 +1 @@
+../part2/replay.py
\ No newline at end of file
@@ -0,0 +1,346 @@
+"""
+In-process metrics of the shaper: counters, gauges and histograms kept in
+a Registry, rendered in the Prometheus text format and exposed over HTTP
+and/or rewritten to a snapshot file from a background thread.
+
+Updates are plain integer arithmetic with no lock: every counter and
+histogram is written by one thread only (the receiver, the sender, or the
+asyncio loop), and a scrape from another thread may just see it a packet
+behind. Gauges are functions sampled at scrape time, so they cost nothing
+in the hot path.
+
+  python3 token_bucket.py 9000 127.0.0.1 9100 20000 200000 --metrics-port 9300
+  curl -s localhost:9300/metrics
+"""
+import http.server
+import os
+import sys
+import threading
+
+import numpy as np
+
+SUB_BITS = 4
+SUB = 1 << SUB_BITS  # buckets per power of two in a Histogram
+
+
+class Counter:
+    """A count that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: dict):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+    def samples(self):
+        """(name, labels, value) of each exposed series."""
+        yield self.name, self.labels, self.value
+
+
+class Gauge:
+    """A value read from `fn()` whenever the registry is rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn, labels: dict):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = labels
+
+    def samples(self):
+        yield self.name, self.labels, self.fn()
+
+
+class Histogram:
+    """
+    Log-linear histogram of non-negative integers, in the style of
+    HdrHistogram: values below 2*SUB are counted exactly and larger ones in
+    SUB buckets per power of two, so a percentile is never more than 1/SUB
+    (6.25%) above the true value. `record` only increments one slot of a
+    preallocated list covering the whole int64 range; the count and max
+    are worked out from the buckets when read.
+
+    Exposed as a summary (quantiles and _count) plus _max.
+    """
+
+    kind = "summary"
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, name: str, help: str, labels: dict):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.counts = [0] * (64 * SUB)
+
+    def record(self, value, count: int = 1):
+        """Count `value` (truncated to an int, negatives as 0) `count` times."""
+        value = int(value)
+        if value < 2 * SUB:
+            self.counts[value if value > 0 else 0] += count
+        else:
+            shift = value.bit_length() - SUB_BITS - 1
+            self.counts[(shift << SUB_BITS) + (value >> shift)] += count
+
+    @staticmethod
+    def indices(values):
+        """
+        Bucket index of each value of an int64 NumPy array of values below
+        2**53, as `record` counts it (negatives as 0).
+        """
+        values = np.maximum(values, 0)
+        shift = np.maximum(np.frexp(values)[1] - SUB_BITS - 1, 0)
+        return (shift << SUB_BITS) + (values >> shift)
+
+    def record_many(self, values):
+        """`record` each value of an int64 NumPy array of values below 2**53."""
+        if not len(values):
+            return
+        slots, counts = np.unique(self.indices(values), return_counts=True)
+        for i, count in zip(slots.tolist(), counts.tolist()):
+            self.counts[i] += count
+
+    @staticmethod
+    def bucket_high(index: int):
+        """Largest value counted in bucket `index`."""
+        if index < 2 * SUB:
+            return index
+        shift = (index >> SUB_BITS) - 1
+        return ((index - (shift << SUB_BITS) + 1) << shift) - 1
+
+    def percentiles(self, qs):
+        """
+        Upper bounds of the `qs`-th percentiles (0 <= q <= 100, ascending),
+        all 0 if nothing was recorded, from one copy of the counts.
+        """
+        counts = list(self.counts)
+        n = sum(counts)
+        out, seen, i = [], 0, 0
+        for q in qs:
+            rank = max(q / 100 * n, 1)
+            while i < len(counts) and seen + counts[i] < rank:
+                seen += counts[i]
+                i += 1
+            out.append(self.bucket_high(i) if n and i < len(counts) else 0)
+        return out
+
+    def count(self):
+        return sum(self.counts)
+
+    def max(self):
+        """Upper bound of the largest value recorded, 0 if none."""
+        return self.percentiles([100])[0]
+
+    def samples(self):
+        values = self.percentiles([q * 100 for q in self.QUANTILES] + [100])
+        for q, value in zip(self.QUANTILES, values):
+            yield self.name, {**self.labels, "quantile": f"{q:g}"}, value
+        yield self.name + "_count", self.labels, self.count()
+        yield self.name + "_max", self.labels, values[-1]
+
+
+class Registry:
+    """The metrics of a process, in registration order."""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()  # registration vs rendering only
+
+    def add(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, **labels) -> Counter:
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, fn, **labels) -> Gauge:
+        return self.add(Gauge(name, help, fn, labels))
+
+    def histogram(self, name: str, help: str, **labels) -> Histogram:
+        return self.add(Histogram(name, help, labels))
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics)
+        lines, described = [], set()
+        for metric in metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    pairs = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                    name = f"{name}{{{pairs}}}"
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class ShaperMetrics:
+    """
+    The metrics of one shaper, registered in `registry`. Engines count
+    arrivals and sends, queues record the queueing delay of each packet
+    into `queueing_delay` (see ByteQueue), and `watch` adds gauges of the
+    live backlog and token level.
+    """
+
+    def __init__(self, registry: Registry | None = None):
+        self.registry = r = registry if registry is not None else Registry()
+        self.received = r.counter("shaper_received_packets_total",
+                                  "Datagrams received")
+        self.received_bytes = r.counter("shaper_received_bytes_total",
+                                        "Bytes received")
+        self.sent_immediate = r.counter(
+            "shaper_sent_packets_total",
+            "Datagrams sent, on arrival or from the queue", path="immediate")
+        self.sent_queued = r.counter("shaper_sent_packets_total", "",
+                                     path="queued")
+        self.sent_immediate_bytes = r.counter(
+            "shaper_sent_bytes_total",
+            "Bytes sent, on arrival or from the queue", path="immediate")
+        self.sent_queued_bytes = r.counter("shaper_sent_bytes_total", "",
+                                           path="queued")
+        self.wakeups = r.counter(
+            "shaper_sender_wakeups_total",
+            "Times the sender woke up from waiting for a packet or tokens")
+        self.contended = r.counter(
+            "shaper_send_lock_contended_total",
+            "Receive attempts to take the send lock that found the sender "
+            "holding it, one per datagram or batch, whose datagrams were "
+            "queued instead of sent on arrival")
+        self.queueing_delay = r.histogram(
+            "shaper_queueing_delay_us",
+            "Time from enqueue to dequeue of each queued packet, in us")
+        self.arrival_backlog = r.histogram(
+            "shaper_arrival_backlog_bytes",
+            "Backlog seen by each arrival, in bytes")
+        self.arrival_tokens = r.histogram(
+            "shaper_arrival_tokens",
+            "Tokens in the bucket at each arrival, rounded down")
+        # Drops, by reason. A policer would drop non-conforming packets
+        # instead of queueing them; no engine has one yet.
+        self.drop_oversize = r.counter(
+            "shaper_dropped_packets_total",
+            "Datagrams dropped, by reason", reason="oversize")
+        self.drop_full = r.counter("shaper_dropped_packets_total", "",
+                                   reason="buffer_full")
+        self.drop_policer = r.counter("shaper_dropped_packets_total", "",
+                                      reason="policer")
+        self.drops = {"too large": self.drop_oversize,
+                      "buffer full": self.drop_full,
+                      "policed": self.drop_policer}
+
+    def watch(self, queue, bucket):
+        """Gauges of the current backlog of `queue` and tokens of `bucket`."""
+        self.registry.gauge("shaper_backlog_bytes", "Current backlog, in bytes",
+                            queue.backlog)
+        self.registry.gauge("shaper_tokens", "Current tokens in the bucket",
+                            bucket.getNoTokens)
+
+
+def serve_http(registry: Registry, port: int, host: str = "127.0.0.1"):
+    """
+    Serve `registry` as text at http://host:port/metrics from a daemon
+    thread, and return the server.
+    """
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # no line per scrape on stderr
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class SnapshotWriter(threading.Thread):
+    """
+    Rewrites `path` with the rendered registry every `interval` seconds.
+    Each snapshot replaces the file atomically, so a reader never sees a
+    partial one. `close` stops the thread and writes a last snapshot.
+    """
+
+    def __init__(self, registry: Registry, path: str, interval: float = 1.0):
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        tmp = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp, "w") as f:
+            f.write(self.registry.render())
+        os.replace(tmp, self.path)
+
+    def close(self):
+        self.stopped.set()
+        self.write()
+
+
+class DropReporter(threading.Thread):
+    """
+    Prints one line every `interval` seconds in which packets were dropped,
+    with the drops of the interval and the totals so far, by reason. The
+    engines only increment the ShaperMetrics drop counters, so the receive
+    path does no I/O however many packets are dropped. `close` stops the
+    thread and prints the totals.
+    """
+
+    def __init__(self, metrics: ShaperMetrics, interval: float = 1.0,
+                 file=None):
+        super().__init__(daemon=True)
+        self.drops = metrics.drops
+        self.interval = interval
+        self.file = file if file is not None else sys.stdout
+        self.last = {reason: 0 for reason in self.drops}
+        self.stopped = threading.Event()
+
+    def totals(self):
+        return {reason: c.value for reason, c in self.drops.items()}
+
+    @staticmethod
+    def describe(counts):
+        return ", ".join(f"{n} {reason}" for reason, n in counts.items() if n)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        """Print the drops since the last report, if any."""
+        totals = self.totals()
+        new = {reason: totals[reason] - self.last[reason] for reason in totals}
+        self.last = totals
+        if any(new.values()):
+            print(f"Dropped in the last {self.interval:g} s: "
+                  f"{self.describe(new)} (total: {self.describe(totals)})",
+                  file=self.file, flush=True)
+
+    def close(self):
+        self.stopped.set()
+        totals = self.totals()
+        print(f"Dropped in total: {self.describe(totals) or 'none'}",
+              file=self.file, flush=True)
@@ -0,0 +1,70 @@
+"""
+Properties of HierarchicalTokenBucket on virtual time (pytest).
+
+  python3 -m pytest -q test_htb.py
+"""
+import math
+
+import numpy as np
+
+from bucket_htb_sim import check, fits, simulate
+from bucket_sim import VirtualClock
+from token_bucket import NANO, HierarchicalTokenBucket
+
+PACKET = 1000
+SECONDS = 10 * NANO
+
+
+def run(root_size, root_rate, children):
+    departures = simulate(root_size, root_rate, children, PACKET, SECONDS)
+    return departures, check(root_size, root_rate, children, PACKET, SECONDS,
+                             departures)
+
+
+def test_root_caps_oversubscribed_leaves():
+    children = [(5000, 100000, None, None)] * 3
+    departures, failures = run(5000, 100000, children)
+    assert failures == []
+    everything = np.sort(np.concatenate(departures))
+    assert fits(everything, PACKET, 5000, 100000)
+    assert len(everything) * PACKET <= 5000 + 100000 * SECONDS // NANO
+
+
+def test_assured_rates_and_ceils():
+    children = [(5000, 500000, None, None), (5000, 1000000, None, None),
+                (5000, 250000, 8000, 1500000)]
+    departures, failures = run(20000, 2000000, children)
+    assert failures == []
+    # The unused root rate is borrowed, by the leaf with the highest ceil
+    assert len(departures[2]) * PACKET > 250000 * SECONDS // NANO * 3 // 2
+
+
+def test_borrower_first_does_not_starve_assured_leaf():
+    clock = VirtualClock(0)
+    root = HierarchicalTokenBucket(20000, 1000000, clock=clock)
+    borrower = HierarchicalTokenBucket(5000, 100000, root, 20000, 1000000)
+    owner = HierarchicalTokenBucket(5000, 500000, root)
+    sent = {borrower: 0, owner: 0}
+    while clock.now <= SECONDS:
+        wait_ms = math.inf
+        for leaf in (borrower, owner, borrower):  # the borrower goes first
+            w = leaf.removeTokensOrWait(PACKET)
+            while w == 0.0:
+                sent[leaf] += PACKET
+                w = leaf.removeTokensOrWait(PACKET)
+            wait_ms = min(wait_ms, w)
+        clock.now += max(math.ceil(wait_ms * 1e6), 1)
+    assert sent[owner] >= 500000 * SECONDS // NANO - PACKET
+    assert sent[borrower] + sent[owner] <= 20000 + 1000000 * SECONDS // NANO
+
+
+def test_detach_releases_reserve():
+    clock = VirtualClock(0)
+    root = HierarchicalTokenBucket(10000, 1000, clock=clock)
+    leaves = [HierarchicalTokenBucket(1000, 10, root) for _ in range(9)]
+    assert not leaves[0].removeTokens(1500)  # root keeps 9000 back
+    for leaf in leaves[1:]:
+        leaf.detach()
+    leaves[1].detach()  # twice is harmless
+    assert root.nreserve == 1000 * NANO
+    assert leaves[0].removeTokens(1500)
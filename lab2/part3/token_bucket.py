@@ -1,71 +1,102 @@
 import argparse
+import atexit
+import math
+import signal
 import sys
 import threading
 import time
 
 # imports from other .py in the same directory
 from bucket_sender import TokenBucketSender
-from bucket_receiver import TokenBucketReceiver
-from byte_queue import ByteQueue
+from bucket_receiver import TokenBucketReceiver, RingTokenBucketReceiver
+from bucket_batch import BatchTokenBucketSender, BatchTokenBucketReceiver
+import bucket_asyncio
+import bucket_multiflow
+from byte_queue import ByteQueue, RingByteQueue
+from shaper_metrics import (DropReporter, ShaperMetrics, SnapshotWriter,
+                            serve_http)
+
+
+NANO = 1_000_000_000  # nano-tokens per token
 
 
 class TokenBucket:
     """
     Token bucket implementation for shaping the network traffic.
     For efficiency, tokens are computed lazily on demand instead of on a timer.
+
+    Tokens are kept as an integer number of nano-tokens. A rate of r
+    tokens/second is r nano-tokens per nanosecond, so refilling over an
+    integer number of nanoseconds is exact for integer rates and the count
+    never drifts, however long the bucket runs.
+
+    The bucket state is a single (nano-tokens, last update) tuple that
+    writers replace under `self.lock`. `getNoTokens` only reads it, so it
+    takes no lock.
+
+    Time comes from `clock`, time.monotonic_ns by default; bucket_sim.py
+    passes a virtual clock instead.
     """
 
-    def __init__(self, size: float, rate: float):
+    def __init__(self, size: float, rate: float, clock=time.monotonic_ns):
         """
         Create a token bucket with bucket `size` and token refill `rate`.
 
         :param size: maximum tokens allowed in the bucket, in tokens
         :param rate: token refill rate in tokens/second
+        :param clock: function returning the current time, in ns
         """
         self.capacity = size  # the bucket capacity, in tokens
         self.rate = rate      # the bucket filling rate, in tokens/second
-        self.tokens = size    # the current number of tokens, in tokens
-        self.last = time.monotonic_ns()  # last update time, in nanoseconds
+        self.ncapacity = int(size * NANO)  # the bucket capacity, in nano-tokens
+        self.clock = clock
+        # (current number of tokens in nano-tokens, last update time in ns)
+        self.state = (self.ncapacity, clock())
         self.lock = threading.Lock()
 
+    @property
+    def tokens(self):
+        """The number of tokens at the last update, in tokens."""
+        return self.state[0] / NANO
+
+    def refill(self, ntokens: int, last: int, now: int):
+        """Nano-tokens after refilling `ntokens` from `last` to `now`."""
+        if now <= last:
+            return ntokens
+        return min(self.ncapacity, ntokens + int(self.rate * (now - last)))
+
     def updateNoTokens(self):
         """
-        Update the current number of tokens (self.tokens).
-        Tokens are capped at the bucket size (excess tokens are discarded).
+        Update the current number of tokens (self.state) and return it, in
+        nano-tokens. Tokens are capped at the bucket size (excess tokens are
+        discarded). Must be called with `self.lock` held.
         """
-        # <-- student portion: implement this -->
-        # This function is never called by the sender or the receiver.
-        # It is only used to implement TokenBucket's other three functions.
-        now = time.monotonic_ns()
-        dt_ns = now - self.last
-        if dt_ns <= 0:
-            return
+        ntokens, last = self.state
+        now = self.clock()
+        if now > last:
+            ntokens = min(self.ncapacity, ntokens + int(self.rate * (now - last)))
+            self.state = (ntokens, now)
+        return ntokens
 
-        dt_s = dt_ns / 1e9
-        self.tokens = min(self.capacity, self.tokens + self.rate * dt_s)
-        self.last = now
+    def waitNs(self, ntarget: int, ntokens: int):
+        """Nanoseconds until `ntarget` nano-tokens are available."""
+        if ntokens >= ntarget:
+            return 0
+        if self.rate <= 0:
+            # never fills; "infinite" wait
+            return float("inf")
+        return math.ceil((ntarget - ntokens) / self.rate)
 
     def getWaitingTime(self, target: float):
         """Calculate waiting time (ms) until `target` tokens are available."""
         with self.lock:
-            # <-- student portion: implement this -->
-            self.updateNoTokens()
-            target = float(target)
-            if self.tokens >= target:
-                return 0.0
-            if self.rate <= 0:
-                # never fills; "infinite" wait
-                return float("inf")
-            needed = target - self.tokens  # tokens
-            wait_s = needed / self.rate
-            return wait_s * 1000.0
+            ntokens = self.updateNoTokens()
+            return self.waitNs(int(target * NANO), ntokens) / 1e6
 
     def getNoTokens(self):
         """The current number of tokens"""
-        with self.lock:
-            # <-- student portions: implement this -->
-            self.updateNoTokens()
-            return self.tokens
+        ntokens, last = self.state
+        return self.refill(ntokens, last, self.clock()) / NANO
 
     def removeTokens(self, target: int):
         """
@@ -73,13 +104,253 @@ class TokenBucket:
         Otherwise, return False.
         """
         with self.lock:
-            self.updateNoTokens()
-            target = float(target)
-            if self.tokens >= target:
-                self.tokens -= target
+            ntokens = self.updateNoTokens()
+            ntarget = int(target * NANO)
+            if ntokens >= ntarget:
+                self.state = (ntokens - ntarget, self.state[1])
                 return True
             return False
-        
+
+    def removeTokensOrWait(self, target: int):
+        """
+        If `target` tokens are available, remove them and return 0.0.
+        Otherwise, return the waiting time (ms, always > 0) until they are.
+        One lock acquisition instead of `removeTokens` + `getWaitingTime`.
+        """
+        with self.lock:
+            ntokens = self.updateNoTokens()
+            ntarget = int(target * NANO)
+            if ntokens >= ntarget:
+                self.state = (ntokens - ntarget, self.state[1])
+                return 0.0
+            return self.waitNs(ntarget, ntokens) / 1e6
+
+    def removeTokensRun(self, sizes):
+        """
+        Remove tokens for the longest prefix of `sizes` that can be paid for
+        with the tokens currently available, and return the prefix length.
+        One lock acquisition covers the whole run.
+        """
+        with self.lock:
+            ntokens = self.updateNoTokens()
+            count = 0
+            for size in sizes:
+                nsize = int(size * NANO)
+                if ntokens < nsize:
+                    break
+                ntokens -= nsize
+                count += 1
+            self.state = (ntokens, self.state[1])
+            return count
+
+
+class HierarchicalTokenBucket:
+    """
+    Node of a token bucket tree in the style of Linux HTB.
+
+    Every node has an assured bucket (`size`, `rate`) and optionally a ceil
+    bucket (`ceil_size`, `ceil_rate`) bounding what it may send including
+    borrowed tokens. The root's ceil is its assured bucket, so nothing is
+    borrowed from the root beyond its rate.
+
+    Packets are checked against a leaf, and the leaf and all its ancestors
+    are settled in one step under one tree-wide lock. Every node on the path
+    must have `target` ceil tokens, the root's included, so the tree never
+    sends faster than the root rate beyond the root size. Within that, the
+    lowest node on the path with `target` assured tokens to spare lends
+    them: a child with too few tokens of its own borrows the unused tokens
+    of its parent, grandparent, ... A parent keeps back the sizes of its
+    children's buckets and lends only what it holds beyond them, so what
+    the children borrow never takes the tokens their own sends need: with
+    the assured rates of the children adding up to at most the rate of
+    their parent, and its size at least the sum of theirs plus a packet,
+    each child gets its assured rate whatever its siblings borrow. Ceil and
+    assured tokens are charged on the whole path, which may push those of
+    the ancestors below zero; they lend again once refilled. `detach` a
+    leaf that is dropped. A leaf is interchangeable with a TokenBucket for
+    the shaper.
+
+    Tokens are integer nano-tokens and time comes from `clock`, as in
+    TokenBucket; bucket_htb_sim.py drives a tree on a virtual clock.
+    """
+
+    def __init__(self, size: float, rate: float, parent=None,
+                 ceil_size: float | None = None,
+                 ceil_rate: float | None = None, clock=None):
+        """
+        :param size: assured bucket size, in tokens
+        :param rate: assured refill rate in tokens/second
+        :param parent: parent node, or None for the root
+        :param ceil_size: ceil bucket size, in tokens (None: no own ceil)
+        :param ceil_rate: ceil refill rate in tokens/second
+        :param clock: function returning the current time, in ns (default:
+            the parent's, or time.monotonic_ns for the root)
+        """
+        if parent is None:
+            ceil_size, ceil_rate = size, rate
+        if clock is None:
+            clock = parent.clock if parent is not None else time.monotonic_ns
+        self.parent = parent
+        self.capacity = size  # the assured bucket capacity, in tokens
+        self.rate = rate      # the assured filling rate, in tokens/second
+        self.ncapacity = int(size * NANO)
+        self.ntokens = self.ncapacity  # assured nano-tokens, may be negative
+        self.ceil_capacity = ceil_size
+        self.ceil_rate = ceil_rate
+        self.nceil_capacity = (int(ceil_size * NANO) if ceil_size is not None
+                               else None)
+        self.nceil_tokens = self.nceil_capacity  # ceil nano-tokens
+        self.nreserve = 0  # nano-tokens kept back for the children's own sends
+        self.attached = parent is not None  # counted in the parent's reserve
+        self.clock = clock
+        self.last = clock()  # last update time, in ns
+        # Path from this node up to the root, this node first
+        self.path = [self] + (parent.path if parent is not None else [])
+        # One lock for the whole tree, so a path is settled atomically
+        self.lock = parent.lock if parent is not None else threading.Lock()
+        if parent is not None:
+            with self.lock:
+                parent.nreserve += self.ncapacity
+
+    def detach(self):
+        """Stop keeping back tokens for this node in its parent."""
+        with self.lock:
+            if self.attached:
+                self.parent.nreserve -= self.ncapacity
+                self.attached = False
+
+    @property
+    def tokens(self):
+        """The assured tokens at the last update, in tokens."""
+        return self.ntokens / NANO
+
+    @property
+    def ceil_tokens(self):
+        """The ceil tokens at the last update, in tokens (None: no ceil)."""
+        if self.nceil_tokens is None:
+            return None
+        return self.nceil_tokens / NANO
+
+    def updateNoTokens(self):
+        """
+        Refill the assured and ceil buckets of every node on the path. Must
+        be called with `self.lock` held.
+        """
+        now = self.clock()
+        for node in self.path:
+            dt = now - node.last
+            if dt <= 0:
+                continue
+            node.ntokens = min(node.ncapacity,
+                               node.ntokens + int(node.rate * dt))
+            if node.nceil_capacity is not None:
+                node.nceil_tokens = min(node.nceil_capacity,
+                                        node.nceil_tokens
+                                        + int(node.ceil_rate * dt))
+            node.last = now
+
+    def lender(self, ntarget: int):
+        """The node lending `ntarget` nano-tokens right now, or None."""
+        lender = None
+        for node in self.path:
+            if node.nceil_capacity is not None and node.nceil_tokens < ntarget:
+                return None
+            if lender is None and node.ntokens - node.nreserve >= ntarget:
+                lender = node
+        return lender
+
+    def charge(self, ntarget: int):
+        """Pay `ntarget` nano-tokens along the path."""
+        for node in self.path:
+            node.ntokens -= ntarget
+            if node.nceil_capacity is not None:
+                node.nceil_tokens -= ntarget
+
+    @staticmethod
+    def fillNs(ntarget: int, ntokens: int, rate: float):
+        """Nanoseconds until a bucket at `rate` holds `ntarget` nano-tokens."""
+        if ntokens >= ntarget:
+            return 0
+        if rate <= 0:
+            return float("inf")
+        return math.ceil((ntarget - ntokens) / rate)
+
+    def waitNs(self, ntarget: int):
+        """Nanoseconds until `ntarget` nano-tokens conform, lock held."""
+        # Every ceil bucket must refill, and the assured bucket of some node
+        # beyond its reserve
+        ceil_wait = 0
+        lend_wait = float("inf")
+        for node in self.path:
+            if node.nceil_capacity is not None:
+                ceil_wait = max(ceil_wait, self.fillNs(
+                    ntarget, node.nceil_tokens, node.ceil_rate))
+            nneeded = ntarget + node.nreserve
+            if nneeded <= node.ncapacity:
+                lend_wait = min(lend_wait, self.fillNs(nneeded, node.ntokens,
+                                                       node.rate))
+        return max(ceil_wait, lend_wait)
+
+    def getWaitingTime(self, target: float):
+        """Calculate waiting time (ms) until `target` tokens are available."""
+        with self.lock:
+            self.updateNoTokens()
+            return self.waitNs(int(target * NANO)) / 1e6
+
+    def getNoTokens(self):
+        """The number of tokens this node could spend right now"""
+        with self.lock:
+            self.updateNoTokens()
+            ceil = min(node.nceil_tokens for node in self.path
+                       if node.nceil_capacity is not None)
+            lend = max(node.ntokens - node.nreserve for node in self.path)
+            return min(ceil, lend) / NANO
+
+    def removeTokens(self, target: int):
+        """
+        If `target` tokens are available along the path, remove the tokens
+        and return True. Otherwise, return False.
+        """
+        with self.lock:
+            self.updateNoTokens()
+            ntarget = int(target * NANO)
+            lender = self.lender(ntarget)
+            if lender is None:
+                return False
+            self.charge(ntarget)
+            return True
+
+    def removeTokensOrWait(self, target: int):
+        """
+        If `target` tokens are available along the path, remove them and
+        return 0.0. Otherwise, return the waiting time (ms) until they are.
+        """
+        with self.lock:
+            self.updateNoTokens()
+            ntarget = int(target * NANO)
+            lender = self.lender(ntarget)
+            if lender is not None:
+                self.charge(ntarget)
+                return 0.0
+            return self.waitNs(ntarget) / 1e6
+
+    def removeTokensRun(self, sizes):
+        """
+        Remove tokens for the longest prefix of `sizes` that can be paid for
+        with the tokens currently available, and return the prefix length.
+        """
+        with self.lock:
+            self.updateNoTokens()
+            count = 0
+            for size in sizes:
+                nsize = int(size * NANO)
+                lender = self.lender(nsize)
+                if lender is None:
+                    break
+                self.charge(nsize)
+                count += 1
+            return count
+
 
 # ---------------- Main function ----------------
 # You do not need to edit this portion. Run `python3 token_bucket.py -h` to see
@@ -101,7 +372,59 @@ if __name__ == "__main__":
                         help="Buffer capacity, in bytes")
     parser.add_argument("--logfile", type=str, default="arrivals.log",
                         help="Arrival log file")
+    parser.add_argument("--log-format", choices=["text", "binary"],
+                        default="text",
+                        help="Arrival log format; binary logs are written by "
+                             "a background thread (not with --multi-flow)")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"],
+                        default="threaded",
+                        help="Sender/receiver threads or one asyncio loop")
+    parser.add_argument("--multi-flow", action="store_true",
+                        help="Shape each flow with its own bucket and buffer "
+                             "of the given sizes (asyncio engine)")
+    parser.add_argument("--flow-key", type=str, default="src",
+                        help="Flow classifier with --multi-flow: src (address "
+                             "and port), host (address) or prefix:N (first N "
+                             "payload bytes)")
+    parser.add_argument("--aggregate-size", type=int, default=None,
+                        help="With --multi-flow, cap all flows together with a "
+                             "parent bucket of this size, in bytes")
+    parser.add_argument("--aggregate-rate", type=int, default=None,
+                        help="Rate of the --aggregate-size parent bucket, in "
+                             "bytes/sec; flows send at most this rate "
+                             "together, and borrow what the parent holds "
+                             "beyond their own bucket sizes")
+    parser.add_argument("--idle-timeout", type=float, default=30.0,
+                        help="Evict flows idle this long, in seconds")
+    parser.add_argument("--queue", choices=["deque", "ring"], default="deque",
+                        help="Packet buffer: deque of bytes or preallocated ring")
+    parser.add_argument("--io", choices=["packet", "batch"], default="packet",
+                        help="Per-packet or batched receive/send path "
+                             "(threaded engine only)")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="Maximum datagrams per wakeup with --io batch")
+    parser.add_argument("--stamp", action="store_true",
+                        help="Write enqueue and dequeue times into the "
+                             "header of Sender --stamp datagrams")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve live metrics at "
+                             "http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-file", type=str, default=None,
+                        help="Rewrite this file with a metrics snapshot every "
+                             "--metrics-interval seconds and on exit")
+    parser.add_argument("--metrics-interval", type=float, default=1.0,
+                        help="Seconds between --metrics-file snapshots")
+    parser.add_argument("--drop-report-interval", type=float, default=1.0,
+                        help="Print the drops of every such interval, in "
+                             "seconds, by reason (0: only the totals on exit)")
     args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.idle_timeout <= 0:
+        parser.error("--idle-timeout must be positive")
+
+    # Exit (and flush the arrival log) on `kill` as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     if args.bucket_size < args.max_packet_size:
         print("Bucket size should not be smaller than the maximum packet size!", file=sys.stderr)
@@ -109,13 +432,75 @@ if __name__ == "__main__":
               "packet with size gratar than bucket size will prevent sending of any further packets.",
               file=sys.stderr)
 
-    buffer = ByteQueue(args.buffer_capacity)
+    metrics = ShaperMetrics()
+    if args.metrics_port is not None:
+        serve_http(metrics.registry, args.metrics_port)
+    if args.metrics_file is not None:
+        snapshots = SnapshotWriter(metrics.registry, args.metrics_file,
+                                   args.metrics_interval)
+        snapshots.start()
+        atexit.register(snapshots.close)
+    drops = DropReporter(metrics, args.drop_report_interval)
+    if args.drop_report_interval > 0:
+        drops.start()
+    atexit.register(drops.close)
+    delay = metrics.queueing_delay
+
+    if args.multi_flow:
+        flow_key = bucket_multiflow.parse_flow_key(args.flow_key)
+        if args.queue == "ring":
+            make_queue = lambda: RingByteQueue(args.buffer_capacity,
+                                               args.max_packet_size, args.stamp,
+                                               delay)
+        else:
+            make_queue = lambda: ByteQueue(args.buffer_capacity, args.stamp,
+                                           delay)
+        if args.aggregate_rate is not None:
+            root = HierarchicalTokenBucket(
+                args.aggregate_size or args.bucket_size, args.aggregate_rate)
+            make_bucket = lambda: HierarchicalTokenBucket(
+                args.bucket_size, args.bucket_rate, root)
+        else:
+            make_bucket = lambda: TokenBucket(args.bucket_size,
+                                              args.bucket_rate)
+        bucket_asyncio.run(bucket_multiflow.serve(
+            make_queue, make_bucket, args.in_port, (args.out_ip, args.out_port),
+            args.max_packet_size, args.logfile, flow_key, args.idle_timeout,
+            metrics))
+        sys.exit(0)
+
+    if args.queue == "ring":
+        buffer = RingByteQueue(args.buffer_capacity, args.max_packet_size,
+                               args.stamp, delay)
+    else:
+        buffer = ByteQueue(args.buffer_capacity, args.stamp, delay)
     bucket = TokenBucket(args.bucket_size, args.bucket_rate)
-    sender = TokenBucketSender(buffer, bucket, (args.out_ip, args.out_port))
-    receiver = TokenBucketReceiver(sender, args.in_port, args.max_packet_size,
-                                   args.logfile)
+    metrics.watch(buffer, bucket)
+    if args.engine == "asyncio":
+        bucket_asyncio.run(bucket_asyncio.serve(
+            buffer, bucket, args.in_port, (args.out_ip, args.out_port),
+            args.max_packet_size, args.logfile, args.log_format, metrics))
+        sys.exit(0)
+
+    if args.io == "batch":
+        sender = BatchTokenBucketSender(buffer, bucket,
+                                        (args.out_ip, args.out_port),
+                                        args.batch_size, metrics)
+        receiver = BatchTokenBucketReceiver(sender, args.in_port,
+                                            args.max_packet_size, args.logfile,
+                                            args.batch_size, args.log_format)
+    else:
+        sender = TokenBucketSender(buffer, bucket, (args.out_ip, args.out_port),
+                                   metrics)
+        receiver_cls = (RingTokenBucketReceiver if args.queue == "ring"
+                        else TokenBucketReceiver)
+        receiver = receiver_cls(sender, args.in_port, args.max_packet_size,
+                                args.logfile, args.log_format)
 
     sender.start()
     receiver.start()
-    sender.join()
-    receiver.join()
+    try:
+        sender.join()
+        receiver.join()
+    finally:
+        receiver.close()
@@ -0,0 +1 @@
+../../Lab1/trace_cache.py
\ No newline at end of file
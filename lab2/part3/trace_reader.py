@@ -0,0 +1 @@
+../part2/trace_reader.py
\ No newline at end of file